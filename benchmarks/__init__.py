@@ -0,0 +1,4 @@
+"""
+Performance benchmarks for the One Codex client. These aren't run as part of the test suite;
+run them individually, e.g. `python -m benchmarks.compression`.
+"""
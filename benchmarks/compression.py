@@ -0,0 +1,68 @@
+"""
+Compares the available compression backends on typical FASTQ data.
+
+Usage: python -m benchmarks.compression [path/to/reads.fastq]
+"""
+from __future__ import print_function, division
+from io import BytesIO
+import sys
+import time
+
+from onecodex.lib.compression import GzipWriter, available_backends, get_backend
+from onecodex.lib.inline_validator import GZIP_COMPRESSION_LEVEL
+
+from benchmarks.data import generate_fastq
+
+
+def _time(func, repeat=3):
+    best = None
+    for _ in range(repeat):
+        start = time.time()
+        result = func()
+        elapsed = time.time() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best, result
+
+
+def benchmark_backend(name, data, level=GZIP_COMPRESSION_LEVEL):
+    backend = get_backend(name)
+
+    def compress():
+        out = BytesIO()
+        writer = GzipWriter(out, level, backend=backend)
+        writer.write(data)
+        writer.close()
+        return out.getvalue()
+
+    compress_time, compressed = _time(compress)
+    decompress_time, decompressed = _time(lambda: backend.open(BytesIO(compressed)).read())
+    assert decompressed == data
+
+    mb = len(data) / 1024 / 1024
+    return {
+        'backend': name,
+        'level': level,
+        'ratio': len(compressed) / len(data),
+        'compress_mb_s': mb / compress_time,
+        'decompress_mb_s': mb / decompress_time,
+    }
+
+
+def main(argv):
+    if len(argv) > 1:
+        with open(argv[1], 'rb') as f:
+            data = f.read()
+    else:
+        data = generate_fastq()
+
+    header = ('backend', 'level', 'ratio', 'compress MB/s', 'decompress MB/s')
+    print('{:>8} {:>5} {:>7} {:>15} {:>17}'.format(*header))
+    for name in available_backends():
+        for level in (1, GZIP_COMPRESSION_LEVEL, 9):
+            r = benchmark_backend(name, data, level)
+            print('{backend:>8} {level:>5} {ratio:>7.3f} {compress_mb_s:>15.1f} '
+                  '{decompress_mb_s:>17.1f}'.format(**r))
+
+
+if __name__ == '__main__':
+    main(sys.argv)
@@ -0,0 +1,81 @@
+"""
+Deterministic synthetic FASTA/FASTQ data for benchmarking
+"""
+import bz2
+import gzip
+import io
+import random
+
+
+# IUPAC ambiguity codes (and U), as they'd turn up in assemblies or RNA data
+IUPAC_BASES = 'RYSWKMBDHVNU'
+
+
+def _sequence(rng, length, iupac_fraction=0.):
+    seq = [rng.choice('ACGT') for _ in range(length)]
+    if iupac_fraction:
+        for ix in range(length):
+            if rng.random() < iupac_fraction:
+                seq[ix] = rng.choice(IUPAC_BASES)
+    return ''.join(seq)
+
+
+def generate_fastq(n_reads=100000, read_length=150, seed=42, read_number=1, iupac_fraction=0.):
+    """
+    Returns Illumina-like FASTQ data (as bytes). The same arguments always generate the same data.
+
+    Generate the R2 of a pair with the same `seed` and `read_number=2` (the reads are named
+    alike). `iupac_fraction` of the bases are replaced with IUPAC ambiguity codes.
+    """
+    rng = random.Random(seed)
+    quals = 'FFFFF:FFF,F:FFFFFF#'
+    records = []
+    for ix in range(n_reads):
+        seq = _sequence(rng, read_length, iupac_fraction)
+        # quality scores are mostly high with a noisy tail, like a typical NovaSeq run
+        qual = ''.join(quals[min(len(quals) - 1, int(rng.expovariate(0.4)))]
+                       for _ in range(read_length))
+        records.append('@SIM:1:FCX:1:{}:{}:{} {}:N:0:ACGTACGT\n{}\n+\n{}\n'.format(
+            ix // 10000 + 1, ix % 10000, rng.randint(1000, 30000), read_number, seq, qual
+        ))
+    return ''.join(records).encode('ascii')
+
+
+def generate_long_fastq(n_reads=500, mean_length=10000, seed=42):
+    """
+    Returns nanopore-like FASTQ data: long reads of (exponentially) varying length with noisy,
+    lower quality scores.
+    """
+    rng = random.Random(seed)
+    records = []
+    for ix in range(n_reads):
+        length = max(200, int(rng.expovariate(1. / mean_length)))
+        seq = _sequence(rng, length)
+        qual = ''.join(chr(33 + max(3, min(40, int(rng.gauss(12, 4))))) for _ in range(length))
+        channel = rng.randint(1, 512)
+        records.append('@read{} runid=0 ch={}\n{}\n+\n{}\n'.format(ix, channel, seq, qual))
+    return ''.join(records).encode('ascii')
+
+
+def generate_fasta(n_records=200, length=50000, line_length=80, seed=42, iupac_fraction=0.):
+    """
+    Returns FASTA data of `n_records` contigs, wrapped at `line_length` characters.
+    """
+    rng = random.Random(seed)
+    records = []
+    for ix in range(n_records):
+        seq = _sequence(rng, length, iupac_fraction)
+        lines = [seq[i:i + line_length] for i in range(0, len(seq), line_length)]
+        records.append('>contig_{} length={}\n{}\n'.format(ix, length, '\n'.join(lines)))
+    return ''.join(records).encode('ascii')
+
+
+def gzip_data(data, level=6):
+    out = io.BytesIO()
+    with gzip.GzipFile(fileobj=out, mode='wb', compresslevel=level) as f:
+        f.write(data)
+    return out.getvalue()
+
+
+def bzip_data(data):
+    return bz2.compress(data)
@@ -0,0 +1,69 @@
+"""
+Saving benchmark results as JSON and comparing them with those of an earlier run
+"""
+from __future__ import print_function, division
+from collections import OrderedDict
+import datetime
+import json
+import os
+import platform
+import subprocess
+
+
+def git_commit():
+    """The commit being benchmarked (marked "-dirty" if there are uncommitted changes).
+    """
+    try:
+        with open(os.devnull, 'w') as devnull:
+            return subprocess.check_output(['git', 'describe', '--always', '--dirty'],
+                                           stderr=devnull).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def save_results(path, results, **settings):
+    """
+    Writes `results` (a list of dicts, each with a unique "name") to `path` as JSON, along with
+    the commit, platform and any `settings` of the run.
+    """
+    output = OrderedDict([
+        ('commit', git_commit()),
+        ('date', datetime.datetime.utcnow().isoformat()),
+        ('python', platform.python_version()),
+        ('platform', platform.platform()),
+    ])
+    output.update(sorted(settings.items()))
+    output['results'] = results
+    with open(path, 'w') as f:
+        json.dump(output, f, indent=2)
+
+
+def load_results(path):
+    with open(path) as f:
+        return json.load(f)
+
+
+def compare(results, baseline, tolerance=0.1, memory_key='peak_memory_mb'):
+    """
+    Prints the change in throughput ("mb_per_s") and peak memory of each benchmark since
+    `baseline` (the saved results of an earlier run), returning the names of those more than
+    `tolerance` slower.
+    """
+    before = {r['name']: r for r in baseline['results']}
+    print('\nCompared with {} ({}):'.format(
+        baseline.get('commit') or 'the baseline', baseline.get('date')
+    ))
+    slower = []
+    for result in results:
+        old = before.get(result['name'])
+        if old is None:
+            continue
+        change = result['mb_per_s'] / old['mb_per_s'] - 1
+        line = '{:<30} {:>+7.1%} MB/s'.format(result['name'], change)
+        if result.get(memory_key) is not None and old.get(memory_key):
+            line += ' {:>+7.1%} peak memory'.format(result[memory_key] / old[memory_key] - 1)
+        if change < -tolerance:
+            line += '  SLOWER'
+            slower.append(result['name'])
+        print(line)
+    return slower
@@ -0,0 +1,91 @@
+"""
+Measures how long the CLI takes to start: running `onecodex --version`, `onecodex --help` and
+`onecodex <command> --help` (none of which should need the API, or anything slow to import), as
+well as `import onecodex`, each in a new Python process. Fails if any takes longer than its
+budget.
+
+The time Python itself takes to start is measured too, and subtracted from each, so the budgets
+are only of the time the client adds. To see what's being imported (and how long it takes), run
+e.g. `python -X importtime -c 'import onecodex.cli'`.
+
+Usage: python -m benchmarks.startup [--output results.json] [--repeat 20] [--scale-budgets 2]
+"""
+from __future__ import print_function, division
+import argparse
+import os
+import subprocess
+import sys
+import time
+
+from benchmarks.results import save_results
+
+
+# what's run in each process (as argv, after the Python executable), with its budget in ms
+# (beyond the time it takes to start Python)
+CLI = 'import sys; from onecodex.cli import onecodex; sys.argv[0] = "onecodex"; onecodex()'
+BENCHMARKS = [
+    ('python', ['-c', 'pass'], None),
+    ('import onecodex', ['-c', 'import onecodex'], 50),
+    ('onecodex --version', ['-c', CLI, '--version'], 150),
+    ('onecodex --help', ['-c', CLI, '--help'], 150),
+    ('onecodex samples --help', ['-c', CLI, 'samples', '--help'], 150),
+    ('onecodex upload --help', ['-c', CLI, 'upload', '--help'], 150),
+]
+
+
+def time_process(args, repeat):
+    """
+    Returns the fastest of `repeat` runs of Python with `args` (in ms), and the median.
+    """
+    times = []
+    with open(os.devnull, 'w') as devnull:
+        for _ in range(repeat):
+            start = time.time()
+            subprocess.check_call([sys.executable] + args, stdout=devnull)
+            times.append((time.time() - start) * 1000)
+    times.sort()
+    return times[0], times[len(times) // 2]
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.strip().split('\n\n')[0])
+    parser.add_argument('--output', help='Write the results to this JSON file')
+    parser.add_argument('--repeat', type=int, default=20,
+                        help='Time this many runs of each command (default 20)')
+    parser.add_argument('--scale-budgets', type=float, default=1.,
+                        help='Multiply each budget by this (default 1)')
+    args = parser.parse_args(argv)
+
+    results = []
+    over_budget = []
+    baseline = None
+    print('{:<30} {:>9} {:>11} {:>9}'.format('COMMAND', 'BEST (ms)', 'MEDIAN (ms)', 'BUDGET'))
+    for name, command, budget in BENCHMARKS:
+        best, median = time_process(command, args.repeat)
+        if baseline is None:
+            # (the first is Python itself)
+            baseline = best
+            print('{:<30} {:>9.1f} {:>11.1f}'.format(name, best, median))
+            continue
+        best -= baseline
+        median -= baseline
+        budget *= args.scale_budgets
+        line = '{:<30} {:>9.1f} {:>11.1f} {:>9.0f}'.format(name, best, median, budget)
+        # (the best time is the least noisy, so is the one held to the budget)
+        if best > budget:
+            line += '  OVER BUDGET'
+            over_budget.append(name)
+        print(line)
+        results.append({'name': name, 'best_ms': best, 'median_ms': median, 'budget_ms': budget})
+
+    if args.output is not None:
+        save_results(args.output, results, repeat=args.repeat, python_ms=baseline)
+
+    if over_budget:
+        print('\n{} command(s) took longer than their budget to start'.format(len(over_budget)))
+        return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,408 @@
+"""
+Measures end-to-end upload throughput, CPU use, peak memory and the requests made, by uploading
+generated files to a local stand-in for the One Codex API and S3.
+
+The stand-in server (run in a separate process, so it doesn't count towards the client's CPU and
+memory use) implements the upload endpoints of the API, the form POST target that files sent in a
+single request go to and enough of S3's multipart API for large files, which are pointed at it by
+setting ONE_CODEX_S3_ENDPOINT_URL. Everything sent to it is counted and thrown away.
+
+Usage: python -m benchmarks.upload [--threads 1,4,8] [--mixes small,large] [--scale 0.5]
+                                   [--latency 0.05] [--output results.json]
+                                   [--compare baseline.json]
+"""
+from __future__ import print_function, division
+import argparse
+from collections import OrderedDict
+from contextlib import contextmanager
+import json
+import multiprocessing
+import os
+import resource
+import shutil
+import sys
+import tempfile
+from threading import Event, Lock, Thread
+import time
+import uuid
+
+import requests
+from six.moves.BaseHTTPServer import BaseHTTPRequestHandler, HTTPServer
+from six.moves.socketserver import ThreadingMixIn
+from six.moves.urllib.parse import parse_qs, urlparse
+
+from onecodex.lib.upload import upload
+
+from benchmarks.data import generate_fastq, gzip_data
+from benchmarks.results import compare, load_results, save_results
+
+
+MB = 1024 * 1024
+BUCKET = 'onecodex-benchmark'
+# files are sent in several parts (of at least 8MB) above this compressed size (at a scale of 1)
+MULTIPART_THRESHOLD = 10 * MB
+
+
+class _ThreadingHTTPServer(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+
+
+class StandInHandler(BaseHTTPRequestHandler):
+    """
+    Answers the requests made while uploading, counting them (by endpoint) and the bytes sent.
+    """
+    # (keep-alive, like the real services)
+    protocol_version = 'HTTP/1.1'
+
+    def log_message(self, format, *args):
+        pass
+
+    def _count(self, endpoint, n_bytes=0):
+        stats = self.server.stats
+        with self.server.stats_lock:
+            stats['requests'][endpoint] = stats['requests'].get(endpoint, 0) + 1
+            stats['bytes_received'] += n_bytes
+
+    def _read_body(self):
+        """Reads (and discards) the request's body, returning its size.
+        """
+        size = 0
+        if 'chunked' in self.headers.get('Transfer-Encoding', ''):
+            while True:
+                chunk_size = int(self.rfile.readline().split(b';')[0].strip(), 16)
+                if chunk_size == 0:
+                    self.rfile.readline()
+                    return size
+                size += self._discard(chunk_size)
+                self.rfile.readline()
+        return self._discard(int(self.headers.get('Content-Length', 0)))
+
+    def _discard(self, n_bytes):
+        left = n_bytes
+        while left > 0:
+            chunk = self.rfile.read(min(left, MB))
+            if not chunk:
+                break
+            left -= len(chunk)
+        return n_bytes - left
+
+    def _respond(self, status, body=b'', content_type='application/json', headers=None):
+        if isinstance(body, dict):
+            body = json.dumps(body).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        for key, value in (headers or {}).items():
+            self.send_header(key, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _respond_xml(self, body):
+        self._respond(200, ('<?xml version="1.0" encoding="UTF-8"?>' + body).encode('utf-8'),
+                      content_type='application/xml')
+
+    def _base_url(self):
+        return 'http://{}:{}'.format(*self.server.server_address)
+
+    def _simulate_latency(self):
+        if self.server.latency:
+            time.sleep(self.server.latency)
+
+    def do_GET(self):
+        path = urlparse(self.path).path
+        if path == '/api/v1/samples/init_multipart_upload':
+            self._count('init_multipart_upload')
+            self._respond(200, {
+                'callback_url': '/api/import_file_from_s3',
+                's3_bucket': BUCKET,
+                'file_id': uuid.uuid4().hex,
+                'upload_aws_access_key_id': 'benchmark',
+                'upload_aws_secret_access_key': 'benchmark',
+            })
+        elif path == '/stats':
+            with self.server.stats_lock:
+                self._respond(200, self.server.stats)
+        else:
+            self._respond(404, {'error': 'Not found'})
+
+    def do_POST(self):
+        url = urlparse(self.path)
+        query = parse_qs(url.query, keep_blank_values=True)
+        if url.path == '/api/v1/samples/init_upload':
+            self._count('init_upload', self._read_body())
+            self._respond(200, {
+                'upload_url': self._base_url() + '/form-upload',
+                'additional_fields': {'key': uuid.uuid4().hex, 'policy': 'benchmark'},
+                'sample_id': uuid.uuid4().hex[:16],
+            })
+        elif url.path == '/api/v1/samples/confirm_upload':
+            self._count('confirm_upload', self._read_body())
+            self._respond(200, {})
+        elif url.path == '/api/import_file_from_s3':
+            self._count('import_file_from_s3', self._read_body())
+            self._respond(200, {'sample_id': uuid.uuid4().hex[:16]})
+        elif url.path == '/form-upload':
+            n_bytes = self._read_body()
+            self._simulate_latency()
+            self._count('form_upload', n_bytes)
+            self._respond(201)
+        elif url.path.startswith('/' + BUCKET + '/') and 'uploads' in query:
+            self._count('s3_create_multipart_upload', self._read_body())
+            self._respond_xml(
+                '<InitiateMultipartUploadResult><Bucket>{}</Bucket><Key>{}</Key>'
+                '<UploadId>{}</UploadId></InitiateMultipartUploadResult>'.format(
+                    BUCKET, url.path.split('/', 2)[2], uuid.uuid4().hex
+                )
+            )
+        elif url.path.startswith('/' + BUCKET + '/') and 'uploadId' in query:
+            self._count('s3_complete_multipart_upload', self._read_body())
+            self._respond_xml(
+                '<CompleteMultipartUploadResult><Bucket>{}</Bucket><Key>{}</Key>'
+                '<ETag>"benchmark"</ETag></CompleteMultipartUploadResult>'.format(
+                    BUCKET, url.path.split('/', 2)[2]
+                )
+            )
+        elif url.path == '/stats/reset':
+            self._read_body()
+            with self.server.stats_lock:
+                self.server.stats = _empty_stats()
+            self._respond(200, {})
+        else:
+            self._read_body()
+            self._respond(404, {'error': 'Not found'})
+
+    def do_PUT(self):
+        url = urlparse(self.path)
+        query = parse_qs(url.query)
+        if url.path.startswith('/' + BUCKET + '/') and 'partNumber' in query:
+            n_bytes = self._read_body()
+            self._simulate_latency()
+            self._count('s3_upload_part', n_bytes)
+            etag = '"{}-{}"'.format(query['partNumber'][0], n_bytes)
+            self._respond(200, headers={'ETag': etag})
+        else:
+            self._read_body()
+            self._respond(404, {'error': 'Not found'})
+
+    def do_DELETE(self):
+        self._count('s3_abort_multipart_upload')
+        self._respond(204)
+
+
+def _empty_stats():
+    return {'requests': {}, 'bytes_received': 0}
+
+
+def _serve(port_queue, latency):
+    server = _ThreadingHTTPServer(('127.0.0.1', 0), StandInHandler)
+    server.stats = _empty_stats()
+    server.stats_lock = Lock()
+    server.latency = latency
+    port_queue.put(server.server_address[1])
+    server.serve_forever()
+
+
+@contextmanager
+def stand_in_server(latency=0.):
+    """
+    Runs the stand-in server in a child process, yielding its URL. Each upload request (a form
+    POST or S3 part) is answered after `latency` seconds.
+    """
+    port_queue = multiprocessing.Queue()
+    process = multiprocessing.Process(target=_serve, args=(port_queue, latency))
+    process.daemon = True
+    process.start()
+    try:
+        yield 'http://127.0.0.1:{}'.format(port_queue.get(timeout=30))
+    finally:
+        process.terminate()
+        process.join()
+
+
+class StandInSamples(object):
+    """
+    The parts of the Samples resource that uploading uses, sending plain requests to the
+    stand-in server (which doesn't serve the API's schema).
+    """
+    def __init__(self, session, server_url):
+        self.session = session
+        self.server_url = server_url
+
+    def _request(self, method, endpoint, data=None):
+        response = self.session.request(method, self.server_url + '/api/v1/samples/' + endpoint,
+                                        json=data)
+        response.raise_for_status()
+        return response.json()
+
+    def init_upload(self, data):
+        return self._request('POST', 'init_upload', data)
+
+    def confirm_upload(self, data):
+        return self._request('POST', 'confirm_upload', data)
+
+    def read_init_multipart_upload(self):
+        return self._request('GET', 'init_multipart_upload')
+
+
+def _rss():
+    """The current resident set size in bytes (or None, if it can't be read).
+    """
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (IOError, OSError, ValueError):
+        return None
+
+
+class PeakMemory(object):
+    """
+    Samples the process's resident memory in a background thread, keeping the peak. Where that
+    can't be read (i.e. off Linux), it falls back to the peak over the life of the process.
+    """
+    def __init__(self, interval=0.02):
+        self.interval = interval
+        self.peak = _rss()
+        self._stop = Event()
+        self._thread = Thread(target=self._run)
+        self._thread.daemon = True
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            self.peak = max(self.peak, _rss())
+
+    def __enter__(self):
+        if self.peak is not None:
+            self._thread.start()
+        return self
+
+    def __exit__(self, *exc_info):
+        if self.peak is None:
+            max_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+            # (in KB on Linux, but bytes on macOS)
+            self.peak = max_rss if sys.platform == 'darwin' else max_rss * 1024
+        else:
+            self._stop.set()
+            self._thread.join()
+            self.peak = max(self.peak, _rss())
+
+
+def _fastq_of_size(block, size):
+    # repeats of a block of reads, each too far apart for gzip to notice them
+    return block * max(1, int(round(size / len(block))))
+
+
+def make_mixes(scale=1.):
+    """
+    The sets of files uploaded, as (name, [(filename, data)]). At a `scale` of 1 the small files
+    are 4MB and the large ones (sent in parts) 64MB, before compression.
+    """
+    block = generate_fastq(2000)
+    small = _fastq_of_size(block, 4 * MB * scale)
+    large = _fastq_of_size(block, 64 * MB * scale)
+    gzipped = gzip_data(small)
+    return [
+        ('small', [('small{}.fq'.format(i), small) for i in range(15)]),
+        ('gzipped', [('small{}.fq.gz'.format(i), gzipped) for i in range(15)]),
+        ('large', [('large{}.fq'.format(i), large) for i in range(2)]),
+        ('mixed', [('small{}.fq'.format(i), small) for i in range(7)] + [('large.fq', large)]),
+    ]
+
+
+def run(mixes, server_url, thread_counts, directory, multipart_threshold):
+    session = requests.Session()
+    samples = StandInSamples(session, server_url)
+    results = []
+    for mix, files in mixes:
+        paths = []
+        input_size = 0
+        for filename, data in files:
+            paths.append(os.path.join(directory, filename))
+            with open(paths[-1], 'wb') as f:
+                f.write(data)
+            input_size += len(data)
+
+        for threads in thread_counts:
+            session.post(server_url + '/stats/reset').raise_for_status()
+            cpu_before = os.times()
+            start = time.time()
+            with PeakMemory() as memory:
+                upload(paths, session, samples, server_url + '/', threads=threads,
+                       multipart_threshold=multipart_threshold)
+            seconds = time.time() - start
+            cpu_after = os.times()
+            stats = session.get(server_url + '/stats').json()
+
+            cpu_seconds = (cpu_after[0] - cpu_before[0]) + (cpu_after[1] - cpu_before[1])
+            result = OrderedDict([
+                ('name', '{}/threads={}'.format(mix, threads)),
+                ('mix', mix),
+                ('threads', threads),
+                ('files', len(paths)),
+                ('input_mb', input_size / MB),
+                ('uploaded_mb', stats['bytes_received'] / MB),
+                ('seconds', seconds),
+                ('mb_per_s', input_size / MB / seconds),
+                ('cpu_seconds', cpu_seconds),
+                ('cpu_percent', 100 * cpu_seconds / seconds),
+                ('peak_rss_mb', memory.peak / MB),
+                ('requests', OrderedDict(sorted(stats['requests'].items()))),
+            ])
+            results.append(result)
+            _print_result(result)
+
+        for path in paths:
+            os.remove(path)
+    return results
+
+
+def _print_result(result):
+    print('{name:<20} {input_mb:>7.1f} MB -> {uploaded_mb:>6.1f} MB {mb_per_s:>7.1f} MB/s '
+          '{cpu_percent:>5.0f}% CPU {peak_rss_mb:>7.1f} MB peak RSS  {n_requests} requests'.format(
+              n_requests=sum(result['requests'].values()), **result
+          ))
+    sys.stdout.flush()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.strip().split('\n\n')[0])
+    parser.add_argument('--threads', default='1,4,8',
+                        help='Comma-separated numbers of concurrent uploads (default 1,4,8)')
+    parser.add_argument('--mixes', help='Only upload these comma-separated mixes of files '
+                                        '(small, gzipped, large and mixed)')
+    parser.add_argument('--scale', type=float, default=1.,
+                        help='Scale the size of the files (default 1, up to 128MB per mix)')
+    parser.add_argument('--latency', type=float, default=0.,
+                        help='Seconds the server takes to answer each upload request')
+    parser.add_argument('--output', help='Write the results to this JSON file')
+    parser.add_argument('--compare', help='Compare with the JSON results of an earlier run')
+    parser.add_argument('--tolerance', type=float, default=0.1,
+                        help='Flag benchmarks this much slower than in --compare (default 0.1)')
+    args = parser.parse_args(argv)
+
+    thread_counts = [int(t) for t in args.threads.split(',')]
+    mixes = make_mixes(args.scale)
+    if args.mixes is not None:
+        wanted = args.mixes.split(',')
+        mixes = [(name, files) for name, files in mixes if name in wanted]
+
+    directory = tempfile.mkdtemp()
+    try:
+        with stand_in_server(args.latency) as server_url:
+            # (large files are sent to the stand-in instead of S3)
+            os.environ['ONE_CODEX_S3_ENDPOINT_URL'] = server_url
+            results = run(mixes, server_url, thread_counts, directory,
+                          int(MULTIPART_THRESHOLD * args.scale))
+    finally:
+        shutil.rmtree(directory)
+
+    if args.output is not None:
+        save_results(args.output, results, scale=args.scale, latency=args.latency)
+    if args.compare is not None:
+        if compare(results, load_results(args.compare), args.tolerance,
+                   memory_key='peak_rss_mb'):
+            return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,234 @@
+"""
+Measures the throughput (MB/s of uncompressed input) and peak memory of the inline validator in
+each of the ways it's used to upload files, on a set of synthetic inputs.
+
+Results can be written out as JSON and compared with those of an earlier run (e.g. of another
+commit); anything that got more than --tolerance slower is flagged.
+
+Usage: python -m benchmarks.validator [--output results.json] [--compare baseline.json]
+                                      [--scale 0.5] [--repeat 3] [--only fastq]
+"""
+from __future__ import print_function, division
+import argparse
+from collections import OrderedDict
+import os
+import shutil
+import sys
+import tempfile
+import time
+import warnings
+
+try:
+    import tracemalloc
+except ImportError:  # pragma: no cover
+    tracemalloc = None
+
+from onecodex.lib.inline_validator import (Buffer, FASTXNuclIterator, FASTXTranslator,
+                                           GzipBuffer)
+
+from benchmarks.data import (bzip_data, generate_fasta, generate_fastq, generate_long_fastq,
+                             gzip_data)
+from benchmarks.results import compare, load_results, save_results
+
+
+# the uploader (via requests_toolbelt) reads its files 8KB at a time
+READ_SIZE = 8192
+MB = 1024 * 1024
+
+
+class Dataset(object):
+    """
+    A synthetic input: its (uncompressed) data, how it's stored on disk, and its R2 if it's one
+    half of a pair.
+    """
+    def __init__(self, name, data, compression=None, pair=None, allow_iupac=False):
+        self.name = name
+        self.data = data
+        self.compression = compression
+        self.pair = pair
+        self.allow_iupac = allow_iupac
+
+    def write(self, directory):
+        """Writes the dataset into `directory`, returning the path(s) to upload.
+        """
+        ext = '.fq' if self.data.startswith(b'@') else '.fa'
+        paths = []
+        for suffix, data in (('_R1', self.data), ('_R2', self.pair)):
+            if data is None:
+                continue
+            path = os.path.join(directory, self.name + suffix + ext)
+            if self.compression == 'gz':
+                path, data = path + '.gz', gzip_data(data)
+            elif self.compression == 'bz2':
+                path, data = path + '.bz2', bzip_data(data)
+            with open(path, 'wb') as f:
+                f.write(data)
+            paths.append(path)
+        return paths
+
+    @property
+    def size(self):
+        return len(self.data) + (len(self.pair) if self.pair is not None else 0)
+
+
+def make_datasets(scale=1.):
+    """
+    The inputs benchmarked, about 30MB each (uncompressed) at a `scale` of 1.
+    """
+    n_reads = int(100000 * scale)
+    short = generate_fastq(n_reads)
+    return [
+        Dataset('short_fastq', short),
+        Dataset('short_fastq_gz', short, compression='gz'),
+        Dataset('short_fastq_bz2', short, compression='bz2'),
+        Dataset('paired_fastq', short, pair=generate_fastq(n_reads, read_number=2)),
+        Dataset('long_fastq', generate_long_fastq(int(1500 * scale))),
+        Dataset('fasta', generate_fasta(int(600 * scale))),
+        Dataset('iupac_fasta', generate_fasta(int(600 * scale), iupac_fraction=0.01),
+                allow_iupac=True),
+    ]
+
+
+def _read_all(file_obj):
+    while len(file_obj.read(READ_SIZE)) != 0:
+        pass
+
+
+def _translate(paths, dataset, **kwargs):
+    files = [open(path, 'rb') for path in paths]
+    reader = FASTXTranslator(files[0], pair=files[1] if len(files) > 1 else None,
+                             allow_iupac=dataset.allow_iupac, **kwargs)
+    _read_all(reader)
+    reader.close()
+
+
+def _iterate_raw(paths, dataset):
+    reads = FASTXNuclIterator(open(paths[0], 'rb'), allow_iupac=dataset.allow_iupac, as_raw=True)
+    for _ in reads:
+        pass
+    reads.close()
+
+
+def _buffer_roundtrip(buffer_class, data):
+    # written a record at a time (as the validator does) and read back 8KB at a time
+    buf = buffer_class()
+    for line in data.splitlines(True):
+        buf.write(line)
+        while len(buf) >= READ_SIZE:
+            buf.read(READ_SIZE)
+    buf.close()
+    buf.read()
+
+
+# name -> (function(paths, dataset), whether it's run on paired datasets)
+MODES = OrderedDict([
+    ('validate', (lambda paths, dataset: _translate(paths, dataset, recompress=False), True)),
+    ('no_validate', (lambda paths, dataset: _translate(paths, dataset, recompress=False,
+                                                       validate=False), False)),
+    ('recompress', (lambda paths, dataset: _translate(paths, dataset), True)),
+    ('as_raw', (_iterate_raw, False)),
+])
+# the buffers are benchmarked on the (uncompressed) data of each unpaired dataset
+BUFFER_MODES = OrderedDict([
+    ('buffer', Buffer),
+    ('gzip_buffer', GzipBuffer),
+])
+
+
+def _measure(func, repeat):
+    """
+    Returns the best of `repeat` timings of `func` and its peak memory use (of a separate run,
+    since tracing allocations slows everything down).
+    """
+    best = None
+    for _ in range(repeat):
+        start = time.time()
+        func()
+        elapsed = time.time() - start
+        best = elapsed if best is None else min(best, elapsed)
+
+    peak = None
+    if tracemalloc is not None:
+        tracemalloc.start()
+        func()
+        peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+    return best, peak
+
+
+def run(datasets, directory, repeat=3, only=None):
+    results = []
+    for dataset in datasets:
+        paths = dataset.write(directory)
+        benchmarks = []
+        for mode, (func, paired) in MODES.items():
+            if paired or dataset.pair is None:
+                benchmarks.append((mode, lambda func=func: func(paths, dataset)))
+        if dataset.pair is None and dataset.compression is None:
+            for mode, buffer_class in BUFFER_MODES.items():
+                benchmarks.append((mode, lambda buffer_class=buffer_class:
+                                   _buffer_roundtrip(buffer_class, dataset.data)))
+
+        for mode, func in benchmarks:
+            name = '{}/{}'.format(dataset.name, mode)
+            if only is not None and only not in name:
+                continue
+            seconds, peak = _measure(func, repeat)
+            result = OrderedDict([
+                ('name', name),
+                ('dataset', dataset.name),
+                ('mode', mode),
+                ('input_mb', dataset.size / MB),
+                ('seconds', seconds),
+                ('mb_per_s', dataset.size / MB / seconds),
+                ('peak_memory_mb', peak / MB if peak is not None else None),
+            ])
+            results.append(result)
+            _print_result(result)
+    return results
+
+
+def _print_result(result):
+    line = '{name:<30} {input_mb:>8.1f} MB {mb_per_s:>9.1f} MB/s'.format(**result)
+    if result['peak_memory_mb'] is not None:
+        line += ' {:>9.1f} MB peak'.format(result['peak_memory_mb'])
+    print(line)
+    sys.stdout.flush()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.strip().split('\n\n')[0])
+    parser.add_argument('--output', help='Write the results to this JSON file')
+    parser.add_argument('--compare', help='Compare with the JSON results of an earlier run')
+    parser.add_argument('--tolerance', type=float, default=0.1,
+                        help='Flag benchmarks this much slower than in --compare (default 0.1)')
+    parser.add_argument('--scale', type=float, default=1.,
+                        help='Scale the size of the inputs (default 1, about 30MB each)')
+    parser.add_argument('--repeat', type=int, default=3,
+                        help='Best of this many runs of each benchmark (default 3)')
+    parser.add_argument('--only', help='Only run the benchmarks with this in their name')
+    args = parser.parse_args(argv)
+
+    directory = tempfile.mkdtemp()
+    try:
+        with warnings.catch_warnings():
+            # (the IUPAC dataset warns about its bases being translated)
+            warnings.simplefilter('ignore')
+            results = run(make_datasets(args.scale), directory, args.repeat, args.only)
+    finally:
+        shutil.rmtree(directory)
+
+    if args.output is not None:
+        save_results(args.output, results, scale=args.scale, repeat=args.repeat)
+
+    if args.compare is not None:
+        baseline = load_results(args.compare)
+        if baseline.get('scale') != args.scale:
+            print('\nWarning: the baseline was run at a scale of {}'.format(baseline.get('scale')))
+        if compare(results, baseline, args.tolerance):
+            return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
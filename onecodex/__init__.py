@@ -3,6 +3,7 @@ __init__.py
 author: @mbiokyle29
 """
 import logging
+import sys
 
 __all__ = ["Api"]
 
@@ -10,5 +11,23 @@ log = logging.getLogger(__name__)
 log.setLevel(logging.WARN)
 log_formatter = logging.Formatter('%(asctime)s {%(levelname)s}: %(message)s')
 
-from onecodex.api import Api  # noqa
-from onecodex.cli import onecodex as Cli  # noqa
+
+# the API and CLI are only imported when they're first used (they're slow to import, which would
+# otherwise slow down everything that imports any part of the package, e.g. `onecodex --help`)
+def __getattr__(name):
+    if name == 'Api':
+        from onecodex import api
+        return api.Api
+    elif name == 'Cli':
+        from onecodex import cli
+        return cli.onecodex
+    raise AttributeError("module 'onecodex' has no attribute '{}'".format(name))
+
+
+def __dir__():
+    return sorted(list(globals()) + ['Api', 'Cli'])
+
+
+if sys.version_info < (3, 7):  # (modules can't have a __getattr__ before PEP 562)
+    from onecodex.api import Api  # noqa
+    from onecodex.cli import onecodex as Cli  # noqa
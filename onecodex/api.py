@@ -5,18 +5,25 @@ author: @mbiokyle29
 One Codex API
 """
 from __future__ import print_function
-from datetime import datetime
+import atexit
+from functools import partial
 import json
 import logging
 import os
+from threading import Thread
 import warnings
 
 from potion_client import Client as PotionClient
-from potion_client.converter import PotionJSONSchemaDecoder, PotionJSONDecoder, PotionJSONEncoder
+from potion_client.converter import (JSONSchemaReference, PotionJSONSchemaDecoder,
+                                     PotionJSONDecoder, schema_resolve_refs)
 from potion_client.utils import upper_camel_case
+import requests
 from requests.auth import HTTPBasicAuth
+from six.moves.urllib.parse import urljoin
 
 from onecodex.lib.auth import BearerTokenAuth
+from onecodex.lib.schema_cache import (REVALIDATE_AT_EXIT_TIMEOUT, SchemaCache, atomic_write,
+                                       resolve_refs)
 from onecodex.models import _model_lookup
 
 log = logging.getLogger(__name__)
@@ -26,12 +33,16 @@ class Api(object):
     """
     This is the base One Codex Api object class. It instantiates a Potion-Client
         object under the hood for making requests.
+
+    With `lazy`, nothing is fetched when it's created: each resource (e.g. `Samples`) loads its
+        own schema the first time it's used instead of every schema being loaded up front.
     """
 
     def __init__(self, api_key=None,
                  bearer_token=None, cache_schema=False,
                  base_url=None,
-                 schema_path="/api/v1/schema"):
+                 schema_path="/api/v1/schema",
+                 lazy=False):
 
         if base_url is None:
             base_url = os.environ.get("ONE_CODEX_API_BASE", "https://app.onecodex.com")
@@ -66,9 +77,14 @@ class Api(object):
         # Create client instance
         self._client = ExtendedPotionClient(self._base_url, schema_path=self._schema_path,
                                             fetch_schema=False, **self._req_args)
-        self._client._fetch_schema(cache_schema=cache_schema)
         self._session = self._client.session
-        self._copy_resources()
+        if lazy:
+            self._client._load_schema_cache(cache_schema=cache_schema)
+            self._client._lazy_paths = set(_model_lookup)
+            self._bind_lazy_resources()
+        else:
+            self._client._fetch_schema(cache_schema=cache_schema)
+            self._copy_resources()
 
     def _copy_resources(self):
         """
@@ -89,86 +105,180 @@ class Api(object):
             except KeyError:  # Ignore resources we don't explicitly model
                 pass
 
+    def _bind_lazy_resources(self):
+        """
+        Like `_copy_resources`, but each model's resource is only loaded when it's first used
+        """
+        for resource_path, oc_cls in _model_lookup.items():
+            oc_cls._api = self
+            oc_cls._resource = LazyResource(self._client, resource_path)
+            setattr(self, oc_cls.__name__, oc_cls)
+
+
+class LazyResource(object):
+    """
+    Stands in for a model's potion resource until it's first accessed, when the resource is
+    loaded from its schema and replaces this on the model class
+    """
+    def __init__(self, client, resource_path):
+        self._client = client
+        self._resource_path = resource_path
+
+    def __get__(self, instance, owner):
+        resource = self._client._lazy_resource(self._resource_path)
+        for cls in owner.__mro__:
+            if cls.__dict__.get('_resource') is self:
+                cls._resource = resource
+                break
+        return resource
+
 
 class ExtendedPotionClient(PotionClient):
     """
     An extention of the PotionClient that caches schema
     """
-    DATE_FORMAT = "%Y-%m-%d %H:%M"
-    SCHEMA_SAVE_DURATION = 1  # day
+    _lazy_paths = frozenset()
+
+    def __init__(self, *args, **kwargs):
+        self._cached_schema = {}  # decoded schemas by URI
+        self._snapshot = None  # the cached (undecoded) schemas, if any
+        self._new_schemas = {}  # the JSON of those fetched since the cache was last saved
+        self._schema_cache = None
+        self._schema_etag = None
+        super(ExtendedPotionClient, self).__init__(*args, **kwargs)
 
     def fetch(self, uri, cls=PotionJSONDecoder, **kwargs):
         if uri in self._cached_schema:
             return self._cached_schema[uri]
-        return super(ExtendedPotionClient, self).fetch(uri, cls=cls, **kwargs)
+        if cls is not PotionJSONSchemaDecoder:
+            return super(ExtendedPotionClient, self).fetch(uri, cls=cls, **kwargs)
 
-    def _fetch_schema(self, cache_schema=False, creds_file=None):
-        self._cached_schema = {}
-        creds_fp = os.path.expanduser('~/.onecodex') if creds_file is None else creds_file
+        ref_resolver = partial(self.instance, cls=JSONSchemaReference, client=self)
+        if self._snapshot is not None and uri in self._snapshot['schemas']:
+            # (each is only decoded once, so can be resolved in place)
+            schema = resolve_refs(self._snapshot['schemas'].pop(uri),
+                                  self._snapshot['refs'].get(uri, []), ref_resolver)
+        else:
+            response = self.session.get(urljoin(self._root_url, uri, True))
+            response.raise_for_status()
+            if uri == self._schema_url:
+                self._schema_etag = response.headers.get('ETag')
+            self._new_schemas[uri] = response.json()
+            schema = schema_resolve_refs(self._new_schemas[uri], ref_resolver)
+        self._cached_schema[uri] = schema
+        return schema
 
+    def instance(self, uri, cls=None, default=None, **kwargs):
+        if cls is None:
+            # make sure references to lazily loaded resources are instances of them
+            resource_path = uri[:uri.rfind('/')]
+            if resource_path in self._lazy_paths and resource_path not in self._resources:
+                self._lazy_resource(resource_path)
+        return super(ExtendedPotionClient, self).instance(uri, cls=cls, default=default,
+                                                          **kwargs)
+
+    def _load_schema_cache(self, cache_schema=False, creds_file=None):
+        """
+        Loads the snapshot of the schema from the cache (see `SchemaCache`) in the `cache_schema`
+        directory (or the default one if it's True, or $ONE_CODEX_SCHEMA_CACHE otherwise). An out
+        of date snapshot is still used, but revalidated in the background for next time (which
+        the process waits a few seconds for as it exits, if need be).
+        """
+        creds_fp = os.path.expanduser('~/.onecodex') if creds_file is None else creds_file
         if os.path.exists(creds_fp):
             creds = json.load(open(creds_fp, 'r'))
-        else:
-            creds = {}
-
-        schema = None
-        serialized_schema = None
-        if cache_schema:
-            # Determine if we need to update
-            schema_update_needed = True
-            last_update = creds.get('schema_saved_at')
-            if last_update is not None:
-                last_update = datetime.strptime(last_update, self.DATE_FORMAT)
-                time_diff = datetime.now() - last_update
-                schema_update_needed = time_diff.days > self.SCHEMA_SAVE_DURATION
-
-            if not schema_update_needed:
-                # get the schema from the credentials file (as a string)
-                serialized_schema = creds.get('schema')
-
-        if serialized_schema is not None:
-            # Catch schema caching issues and fall back to remote URL
-            try:
-                base_schema = serialized_schema.pop(self._schema_url)
-                schema = json.loads(base_schema, cls=PotionJSONSchemaDecoder,
-                                    referrer=self._schema_url, client=self)
-
-                for route, route_schema in serialized_schema.items():
-                    object_schema = json.loads(route_schema, cls=PotionJSONSchemaDecoder,
-                                               referrer=self._schema_url, client=self)
-                    self._cached_schema[route] = object_schema
-            except KeyError:  # Caches issue with schema_url not existing
-                pass
+            if 'schema' in creds or 'schema_saved_at' in creds:
+                # (the schema used to be cached in the credentials file)
+                creds.pop('schema', None)
+                creds.pop('schema_saved_at', None)
+                atomic_write(creds_fp, json.dumps(creds), mode='w')
+
+        if cache_schema is True:
+            self._schema_cache = SchemaCache()
+        elif cache_schema:
+            self._schema_cache = SchemaCache(cache_schema)
+        elif os.environ.get('ONE_CODEX_SCHEMA_CACHE'):
+            self._schema_cache = SchemaCache(os.environ['ONE_CODEX_SCHEMA_CACHE'])
+        if self._schema_cache is None:
+            return
+
+        self._snapshot = self._schema_cache.load(self._schema_url)
+        if self._snapshot is not None:
+            self._schema_etag = self._snapshot['etag']
+            if self._schema_cache.is_stale(self._snapshot):
+                thread = Thread(target=self._revalidate_schema_cache)
+                thread.daemon = True
+                thread.start()
+                # (so a short-lived process, e.g. most CLI commands, still gets to finish it)
+                atexit.register(thread.join, REVALIDATE_AT_EXIT_TIMEOUT)
+
+    def _save_schema_cache(self):
+        if self._schema_cache is None or not self._new_schemas:
+            return
+        schemas = {}
+        etag = self._schema_etag
+        latest = self._schema_cache.load(self._schema_url)
+        if latest is not None and etag in (None, latest['etag']):
+            # keep the schemas already cached (including any other processes have added)
+            schemas.update(latest['schemas'])
+            etag = latest['etag']
+        schemas.update(self._new_schemas)
+        self._schema_cache.save(self._schema_url, schemas, etag)
+        self._new_schemas = {}
 
-        if schema is None:
-            # if the schema wasn't cached or if it was expired, get it anew
-            schema = self.session.get(self._schema_url).json(cls=PotionJSONSchemaDecoder,
-                                                             referrer=self._schema_url,
-                                                             client=self)
-            if cache_schema:
-                # serialize the schemas back out
-                creds['schema_saved_at'] = datetime.strftime(datetime.now(), self.DATE_FORMAT)
-
-                # serialize the main schema
-                serialized_schema = {}
-                serialized_schema[self._schema_url] = json.dumps(schema, cls=PotionJSONEncoder)
-
-                # serialize the object schemas
-                for schema_ref in schema['properties'].values():
-                    serialized_schema[schema_ref._uri] = json.dumps(schema_ref._properties,
-                                                                    cls=PotionJSONEncoder)
-
-                creds['schema'] = serialized_schema
-            else:
-                if 'schema_saved_at' in creds:
-                    del creds['schema_saved_at']
-                if 'schema' in creds:
-                    del creds['schema']
-
-            # always resave the creds (to make sure we're removing schema if we need to be or
-            # saving if we need to do that instead)
-            json.dump(creds, open(creds_fp, mode='w'))
+    def _revalidate_schema_cache(self):
+        """
+        Checks the cached schema against the server, refetching it all if it's changed (unless
+        another process is already doing so, or has just done so).
+        """
+        with self._schema_cache.lock(self._schema_url) as locked:
+            entry = self._schema_cache.load(self._schema_url) if locked else None
+            if entry is None or not self._schema_cache.is_stale(entry):
+                return
+            session = requests.Session()
+            session.auth = self.session.auth
+            try:
+                headers = {'If-None-Match': entry['etag']} if entry['etag'] else {}
+                response = session.get(self._schema_url, headers=headers, timeout=30)
+                schemas, etag = entry['schemas'], entry['etag']
+                if response.status_code != 304:
+                    response.raise_for_status()
+                    etag = response.headers.get('ETag')
+                    if etag is None or etag != entry['etag']:
+                        schemas = {self._schema_url: response.json()}
+                        for uri in entry['schemas']:
+                            if uri != self._schema_url:
+                                route_response = session.get(urljoin(self._root_url, uri, True),
+                                                             timeout=30)
+                                route_response.raise_for_status()
+                                schemas[uri] = route_response.json()
+                self._schema_cache.save(self._schema_url, schemas, etag)
+            except (requests.RequestException, ValueError) as e:
+                log.debug('Failed to revalidate the cached schema: %s', e)
+            finally:
+                session.close()
 
+    def _fetch_schema(self, cache_schema=False, creds_file=None):
+        self._load_schema_cache(cache_schema=cache_schema, creds_file=creds_file)
+        schema = self.fetch(self._schema_url, cls=PotionJSONSchemaDecoder)
         for name, resource_schema in schema['properties'].items():
             class_name = upper_camel_case(name)
             setattr(self, class_name, self.resource_factory(name, resource_schema))
+        self._save_schema_cache()
+
+    def _lazy_resource(self, resource_path):
+        """
+        Returns the resource at `resource_path` (e.g. /api/v1/samples), creating it from its own
+        schema the first time it's needed
+        """
+        resource = self._resources.get(resource_path)
+        if resource is not None:
+            return resource
+
+        schema = self.instance(resource_path + '/schema#', cls=JSONSchemaReference, client=self)
+        name = resource_path.rsplit('/', 1)[1].replace('-', '_')
+        resource = self.resource_factory(name, schema)
+        setattr(self, upper_camel_case(name), resource)
+        self._resources.setdefault(resource_path, resource)
+        self._save_schema_cache()
+        return resource
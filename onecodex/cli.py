@@ -4,22 +4,26 @@ cli.py
 author: @mbiokyle29
 """
 from __future__ import print_function
+import json
 import logging
 import os
-import re
 import sys
 import warnings
 
 import click
 
 from onecodex.utils import (cli_resource_fetcher, download_file_helper,
-                            valid_api_key, OPTION_HELP, pprint,
-                            warn_if_insecure_platform)
-from onecodex.api import Api
-from onecodex.exceptions import ValidationWarning, ValidationError, UploadException
-from onecodex.auth import _login, _logout, _silent_login
+                            valid_api_key, valid_bandwidth, valid_checks, valid_compression_level,
+                            valid_size, valid_threads,
+                            OPTION_HELP, pprint, warn_if_insecure_platform)
+from onecodex.exceptions import (ReadCheckWarning, ValidationWarning, ValidationError,
+                                 UploadException)
+from onecodex.lib.throttle import format_size
 from onecodex.version import __version__
 
+# NB: the API, and anything that needs requests, is only imported by the commands that use it
+# (it's slow enough to import that it'd dominate `onecodex --help` and the like)
+
 # set the context for getting -h also
 CONTEXT_SETTINGS = dict(
     help_option_names=['-h', '--help'],
@@ -35,6 +39,30 @@ stream_handler.setFormatter(log_formatter)
 log.addHandler(stream_handler)
 
 
+def make_api(api_key=None):
+    from onecodex.api import Api
+    from onecodex.auth import _silent_login
+
+    if api_key is None:
+        # try and find it
+        api_key = _silent_login()
+        if api_key is None:
+            click.echo("No One Codex API key is available - running anonymously", err=True)
+    return Api(cache_schema=True, lazy=True, api_key=api_key)
+
+
+class ContextObject(dict):
+    """
+    The context passed to each command, which only creates its API (`ctx.obj['API']`) when it's
+    first used, so commands that don't need one (or just print their --help) don't log in.
+    """
+    def __missing__(self, key):
+        if key != 'API':
+            raise KeyError(key)
+        self['API'] = make_api(self.get('API_KEY'))
+        return self['API']
+
+
 # options
 @click.group(context_settings=CONTEXT_SETTINGS)
 @click.option("--api-key", callback=valid_api_key,
@@ -50,28 +78,13 @@ def onecodex(ctx, api_key, no_pprint, verbose):
 
     # set up the context for sub commands
     click.Context.get_usage = click.Context.get_help
-    ctx.obj = {}
+    ctx.obj = ContextObject()
     ctx.obj['API_KEY'] = api_key
     ctx.obj['NOPPRINT'] = no_pprint
 
     if verbose:
         log.setLevel(logging.INFO)
 
-    # create the api
-    no_api_subcommands = ["login", "logout"]
-    if ctx.invoked_subcommand not in no_api_subcommands:
-        if api_key is not None:
-            ctx.obj['API'] = Api(cache_schema=True,
-                                 api_key=api_key)
-        else:
-            # try and find it
-            api_key = _silent_login()
-            if api_key is not None:
-                ctx.obj['API'] = Api(cache_schema=True, api_key=api_key)
-            else:
-                click.echo("No One Codex API key is available - running anonymously", err=True)
-                ctx.obj['API'] = Api(cache_schema=True)
-
     # handle checking insecure platform, we let upload command do it by itself
     if ctx.invoked_subcommand != "upload":
         warn_if_insecure_platform()
@@ -145,43 +158,83 @@ def samples(ctx, samples):
 
 # utilites
 @onecodex.command('upload')
-@click.option('--max-threads', default=4,
-              help=OPTION_HELP['max_threads'], metavar='<int:threads>')
-@click.argument('files', nargs=-1, required=False, type=click.Path(exists=True))
+@click.option('--max-threads', default='4', callback=valid_threads,
+              help=OPTION_HELP['max_threads'], metavar='<int:threads|auto>')
+@click.argument('files', nargs=-1, required=False, type=click.Path(exists=True, allow_dash=True))
 @click.option('--clean', is_flag=True, help=OPTION_HELP['clean'], default=False)
 @click.option('--do-not-interleave', 'no_interleave', is_flag=True, help=OPTION_HELP['interleave'],
               default=False)
 @click.option('--prompt/--no-prompt', is_flag=True, help=OPTION_HELP['prompt'], default=True)
+@click.option('--merge-lanes/--do-not-merge-lanes', is_flag=True, default=None,
+              help=OPTION_HELP['merge_lanes'])
 @click.option('--validate/--do-not-validate', is_flag=True, help=OPTION_HELP['validate'],
               default=True)
+@click.option('--normalize', is_flag=True, default=False, help=OPTION_HELP['normalize'])
+@click.option('--bin-qualities', is_flag=True, default=False, help=OPTION_HELP['bin_qualities'])
+@click.option('--sketch', is_flag=True, default=False, help=OPTION_HELP['sketch'])
+@click.option('--check', 'checks', multiple=True, callback=valid_checks, help=OPTION_HELP['check'],
+              metavar='<name=action[:value]>')
+@click.option('--compression-level', default='auto', callback=valid_compression_level,
+              help=OPTION_HELP['compression_level'], metavar='<auto|level|min-max>')
+@click.option('--max-bandwidth', callback=valid_bandwidth, help=OPTION_HELP['max_bandwidth'],
+              metavar='<rate>')
+@click.option('--bandwidth-control-file', type=click.Path(dir_okay=False),
+              help=OPTION_HELP['bandwidth_control_file'])
+@click.option('--multipart-threshold', callback=valid_size, metavar='<size>',
+              help=OPTION_HELP['multipart_threshold'])
+@click.option('--spool-dir', type=click.Path(exists=True, file_okay=False),
+              help=OPTION_HELP['spool_dir'], metavar='<directory>')
+@click.option('--max-spool-size', callback=valid_size, metavar='<size>',
+              help=OPTION_HELP['max_spool_size'])
+@click.option('--manifest', type=click.Path(exists=True, dir_okay=False),
+              help=OPTION_HELP['manifest'])
+@click.option('--journal', type=click.Path(dir_okay=False), help=OPTION_HELP['journal'])
+@click.option('--distributed', is_flag=True, default=False, help=OPTION_HELP['distributed'])
+@click.option('--stream-name', help=OPTION_HELP['stream_name'], metavar='<filename>')
+@click.option('--watch', type=click.Path(exists=True, file_okay=False), help=OPTION_HELP['watch'],
+              metavar='<directory>')
 @click.pass_context
-def upload(ctx, files, max_threads, clean, no_interleave, prompt, validate):
-    """Upload a FASTA or FASTQ (optionally gzip'd) to One Codex"""
-    if len(files) == 0:
+def upload(ctx, files, max_threads, clean, no_interleave, prompt, merge_lanes, validate,
+           normalize, bin_qualities, sketch, checks, compression_level, max_bandwidth,
+           bandwidth_control_file, multipart_threshold, spool_dir, max_spool_size, manifest, journal,
+           distributed, stream_name, watch):
+    """Upload a FASTA or FASTQ (optionally gzip'd) to One Codex. Pass - to upload from stdin."""
+    from onecodex.lib.journal import UploadJournal
+    from onecodex.lib.upload import group_lanes, pair_files
+
+    if distributed and manifest is None and journal is None:
+        raise click.BadParameter('A --manifest or --journal is required for distributed uploads')
+    if watch is not None and (len(files) > 0 or manifest is not None or distributed):
+        raise click.BadParameter('Files, a manifest or --distributed cannot be used with --watch')
+    stream = '-' in files
+    if sketch and (stream or watch is not None or (journal is None and manifest is None)):
+        raise click.BadParameter('--sketch needs a --journal (or --manifest) to keep the sketches '
+                                 'in, and cannot be used with a stream or --watch')
+    if max_spool_size is not None and spool_dir is None:
+        raise click.BadParameter('--max-spool-size caps the space used in --spool-dir, so needs one')
+    if stream and (len(files) > 1 or manifest is not None or journal is not None):
+        raise click.BadParameter('Only a single stream (-) can be uploaded at a time, without a '
+                                 'manifest or journal')
+    if stream and (spool_dir is not None or multipart_threshold is not None or merge_lanes):
+        raise click.BadParameter("--spool-dir, --multipart-threshold and --merge-lanes don't "
+                                 "apply to a stream (-), which is always sent in parts")
+    if watch is not None and merge_lanes:
+        raise click.BadParameter('--merge-lanes cannot be used with --watch, which uploads each '
+                                 "file (or pair) as soon as it's finished")
+    if manifest is not None:
+        if len(files) > 0:
+            raise click.BadParameter('Files cannot be passed along with a manifest')
+    elif len(files) == 0 and watch is None:
         print(ctx.get_help())
         return
     else:
         files = list(files)
 
-    if not no_interleave:
-        # "intelligently" find paired files and tuple them
-        paired_files = []
-        single_files = set(files)
-        for filename in files:
-            # convert "read 1" filenames into "read 2" and check that they exist; if they do
-            # upload the files as a pair, autointerleaving them
-            pair = re.sub('[._][Rr]1[._]', lambda x: x.group().replace('1', '2'), filename)
-            # we don't necessary need the R2 to have been passed in; we infer it anyways
-            if pair != filename and os.path.exists(pair):
-                if not prompt and pair not in single_files:
-                    # if we're not prompting, don't automatically pull in files
-                    # not in the list the user passed in
-                    continue
-
-                paired_files.append((filename, pair))
-                if pair in single_files:
-                    single_files.remove(pair)
-                single_files.remove(filename)
+    if not no_interleave and manifest is None and not stream and watch is None:
+        # "intelligently" find paired files and tuple them; if we're prompting, the R2s needn't
+        # have been passed in (but otherwise don't automatically pull in files the user didn't
+        # list)
+        paired_files, single_files = pair_files(files, include_unlisted=prompt)
 
         auto_pair = True
         if prompt and len(paired_files) > 0:
@@ -199,14 +252,91 @@ def upload(ctx, files, max_threads, clean, no_interleave, prompt, validate):
                 auto_pair = False
 
         if auto_pair:
-            files = paired_files + list(single_files)
+            files = paired_files + single_files
+
+    # (lanes are merged unless --do-not-merge-lanes is given)
+    if merge_lanes is not False and manifest is None and not stream and watch is None:
+        # likewise, upload the lanes of each library (e.g. "_L001" to "_L004") as one sample
+        lane_groups, other_files = group_lanes(files)
+
+        auto_merge = True
+        if prompt and len(lane_groups) > 0:
+            group_list = ''
+            for group in lane_groups:
+                names = [os.path.basename(f[0] if isinstance(f, tuple) else f) for f in group]
+                group_list += '\n  {}'.format('  +  '.join(names))
+
+            auto_merge = click.confirm(
+                'It appears there are several lanes of the same libraries:{}\nMerge each '
+                'library into one sample?'.format(group_list),
+                default='Y'
+            )
+
+        if auto_merge:
+            files = lane_groups + other_files
 
     if not clean:
         warnings.filterwarnings('error', category=ValidationWarning)
-
+        # (but not warnings about reads that are uploaded unchanged)
+        warnings.filterwarnings('default', category=ReadCheckWarning)
+
+    upload_kwargs = {
+        'threads': max_threads,
+        'validate': validate,
+        'compression_level': compression_level,
+        'max_bandwidth': max_bandwidth,
+        'bandwidth_control_file': bandwidth_control_file,
+        'distributed': distributed,
+        'normalize': normalize,
+        'quality_bins': bin_qualities,
+    }
+    if sketch:
+        upload_kwargs['sketch'] = True
+    if checks:
+        upload_kwargs['checks'] = checks
+    if multipart_threshold is not None:
+        upload_kwargs['multipart_threshold'] = multipart_threshold
+    if spool_dir is not None:
+        upload_kwargs['spool_dir'] = spool_dir
+    if max_spool_size is not None:
+        upload_kwargs['max_spool_size'] = max_spool_size
     try:
         # do the uploading
-        ctx.obj['API'].Samples.upload(files, threads=max_threads, validate=validate)
+        if manifest is not None:
+            counts = ctx.obj['API'].Samples.upload_manifest(manifest, journal=journal,
+                                                            **upload_kwargs)
+            sys.stderr.write('Uploading: {} of {} file(s) in the manifest are uploaded.\n'.format(
+                counts.get('confirmed', 0), sum(counts.values())
+            ))
+        elif watch is not None:
+            upload_journal = UploadJournal(journal) if journal is not None else None
+            sys.stderr.write('Watching: Uploading files written into {} (press Ctrl-C to '
+                             'stop)...\n'.format(watch))
+            # (--distributed isn't allowed with --watch)
+            watch_kwargs = {k: v for k, v in upload_kwargs.items() if k != 'distributed'}
+            try:
+                ctx.obj['API'].Samples.watch(watch, journal=upload_journal,
+                                             interleave=not no_interleave, **watch_kwargs)
+            except KeyboardInterrupt:
+                sys.stderr.write('Watching: Stopped.\n')
+            finally:
+                if upload_journal is not None:
+                    upload_journal.close()
+        elif stream:
+            ctx.obj['API'].Samples.upload_stream(
+                click.get_binary_stream('stdin'), filename=stream_name, threads=max_threads,
+                validate=validate, compression_level=compression_level,
+                max_bandwidth=max_bandwidth, bandwidth_control_file=bandwidth_control_file,
+                normalize=normalize, quality_bins=bin_qualities, checks=checks
+            )
+        elif journal is not None:
+            upload_journal = UploadJournal(journal)
+            try:
+                ctx.obj['API'].Samples.upload(files, journal=upload_journal, **upload_kwargs)
+            finally:
+                upload_journal.close()
+        else:
+            ctx.obj['API'].Samples.upload(files, **upload_kwargs)
     except ValidationWarning as e:
         sys.stderr.write('\nERROR: {}. {}'.format(
             e, 'Running with the --clean flag will suppress this error.'
@@ -219,10 +349,102 @@ def upload(ctx, files, max_threads, clean, no_interleave, prompt, validate):
         sys.exit(1)
 
 
+@onecodex.command('compare')
+@click.argument('files', nargs=-1, required=True, type=click.Path(exists=True, dir_okay=False))
+@click.option('--journal', 'journals', multiple=True, required=True,
+              type=click.Path(exists=True, dir_okay=False), help=OPTION_HELP['compare_journal'])
+@click.option('--min-containment', type=float, default=0.5,
+              help=OPTION_HELP['min_containment'])
+@click.pass_context
+def compare(ctx, files, journals, min_containment):
+    """Check files for duplicates among earlier uploads (made with --sketch)"""
+    from onecodex.lib.journal import UploadJournal
+    from onecodex.lib.sketch import find_similar, sketch_file
+
+    upload_journals = [UploadJournal(journal) for journal in journals]
+    found = False
+    try:
+        for filename in files:
+            file_sketch = sketch_file(filename)
+            matches = []
+            for upload_journal in upload_journals:
+                matches += find_similar(file_sketch, upload_journal, min_containment)
+            if not matches:
+                click.echo('{}: no similar uploads'.format(filename))
+            for other, sample_id, containment, jaccard in sorted(matches, key=lambda m: -m[2]):
+                found = True
+                if isinstance(other, (tuple, list)):
+                    other = ' & '.join(str(f) for f in other)
+                click.echo('{}: {:.0%} of its k-mers are in {} (sample {}, Jaccard similarity '
+                           '{:.2f})'.format(filename, containment, other, sample_id, jaccard))
+    finally:
+        for upload_journal in upload_journals:
+            upload_journal.close()
+    if found:
+        sys.exit(1)
+
+
+@onecodex.command('validate')
+@click.argument('files', nargs=-1, required=True, type=click.Path(exists=True, dir_okay=False))
+@click.option('--clean', is_flag=True, help=OPTION_HELP['clean'], default=False)
+@click.option('--do-not-interleave', 'no_interleave', is_flag=True,
+              help=OPTION_HELP['validate_interleave'], default=False)
+@click.option('--check', 'checks', multiple=True, callback=valid_checks, help=OPTION_HELP['check'],
+              metavar='<name=action[:value]>')
+@click.option('--processes', type=click.IntRange(1), help=OPTION_HELP['processes'])
+@click.option('--json', 'as_json', is_flag=True, default=False, help=OPTION_HELP['json_report'])
+@click.pass_context
+def validate(ctx, files, clean, no_interleave, checks, processes, as_json):
+    """Check FASTA or FASTQ files as uploading them would, without uploading anything"""
+    from onecodex.lib.upload import pair_files
+    from onecodex.lib.validation import validate_files
+
+    files = list(files)
+    if not no_interleave:
+        paired_files, single_files = pair_files(files)
+        files = paired_files + single_files
+
+    names = [' & '.join(f) if isinstance(f, tuple) else f for f in files]
+    width = max(len(name) for name in names + ['FILE'])
+    if not as_json:
+        click.echo('{:<{width}}  {:>12}  {:>9}  {:>8}  {}'.format(
+            'FILE', 'RECORDS', 'SIZE', 'SECONDS', 'STATUS', width=width
+        ))
+
+    reports = []
+    failed = False
+    for name, report in zip(names, validate_files(files, processes, clean=clean, checks=checks)):
+        reports.append(report)
+        failed = failed or report['error'] is not None
+        if as_json:
+            continue
+        if report['error'] is None:
+            status = 'OK' if not report['warnings'] else 'OK ({} warning(s))'.format(
+                len(report['warnings'])
+            )
+        else:
+            status = 'ERROR' + (' (--clean fixes this)' if report['fixable'] else '')
+        click.echo('{:<{width}}  {:>12}  {:>9}  {:>8.1f}  {}'.format(
+            name, report['records'], format_size(report['bytes']), report['seconds'], status,
+            width=width
+        ))
+        for message in report['warnings']:
+            click.echo('    Warning: {}'.format(message))
+        if report['error'] is not None:
+            click.echo('    Error: {}'.format(report['error']))
+
+    if as_json:
+        click.echo(json.dumps(reports, indent=None if ctx.obj['NOPPRINT'] else 4))
+    if failed:
+        sys.exit(1)
+
+
 @onecodex.command('login')
 @click.pass_context
 def login(ctx):
     """Add an API key (saved in ~/.onecodex)"""
+    from onecodex.auth import _login
+
     base_url = os.environ.get("ONE_CODEX_API_BASE", "https://app.onecodex.com")
     _login(base_url)
 
@@ -231,4 +453,6 @@ def login(ctx):
 @click.pass_context
 def logout(ctx):
     """Delete your API key (saved in ~/.onecodex)"""
+    from onecodex.auth import _logout
+
     _logout()
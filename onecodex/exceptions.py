@@ -28,10 +28,24 @@ class ValidationError(OneCodexException):
     pass
 
 
+class PassthroughAborted(ValidationError):
+    """
+    A file can not be uploaded as-is because validating it requires modifying it.
+    """
+    pass
+
+
 class ValidationWarning(Warning):
     pass
 
 
+class ReadCheckWarning(ValidationWarning):
+    """
+    A read check set to "warn" found problem records, which are uploaded as they are.
+    """
+    pass
+
+
 class UploadException(Exception):
     """
     An exception for when things go wrong with uploading
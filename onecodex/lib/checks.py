@@ -0,0 +1,363 @@
+"""
+Checks run on each batch of records parsed by the validator, so that all of the quality control
+happens in the one streaming pass made while uploading. Each check can be set to "warn" about,
+"fix" or raise an "error" for the records it finds.
+"""
+from __future__ import division
+from collections import OrderedDict
+import re
+import string
+
+from onecodex.exceptions import ValidationError
+
+
+ACTIONS = ('warn', 'fix', 'error')
+
+# this checks and translates all valid IUPAC nucleotide codes into the core 4+n (ACGTN)
+OTHER_BASES = re.compile(b'[BDHIKMRSUVWXYbdhikmrsuvwxy]')
+if hasattr(bytes, 'maketrans'):
+    OTHER_BASE_TRANS = bytes.maketrans(b'BDHIKMRSUVWXYbdhikmrsuvwxy',
+                                       b'NNNNNNNNTNNNNnnnnnnnntnnnn')
+else:
+    OTHER_BASE_TRANS = string.maketrans(b'BDHIKMRSUVWXYbdhikmrsuvwxy',
+                                        b'NNNNNNNNTNNNNnnnnnnnntnnnn')
+
+WHITESPACE = b' \t\r\n'
+
+
+def _numpy():
+    # (imported when first needed, since most uploads never run a check that uses it)
+    try:
+        import numpy
+    except ImportError:
+        return None
+    return numpy
+
+
+def _record_lengths(np, records):
+    return np.fromiter((len(record) for record in records), dtype=np.int64, count=len(records))
+
+
+def _count_array(np, records, chars):
+    table = np.zeros(256, dtype=np.int64)
+    table[np.frombuffer(chars, dtype=np.uint8)] = 1
+    data = table[np.frombuffer(b''.join(records), dtype=np.uint8)]
+    if not len(data):
+        return np.zeros(len(records), dtype=np.int64)
+    starts = np.concatenate(([0], np.cumsum(_record_lengths(np, records))[:-1]))
+    # (every record has at least one character, so none of the sums are empty)
+    return np.add.reduceat(data, starts)
+
+
+def count_in_records(records, chars):
+    """
+    Counts the occurrences of any of `chars` in each of `records`, all at once with numpy if it's
+    installed.
+    """
+    np = _numpy()
+    if np is None or not records:
+        counts = [0] * len(records)
+        for char in bytearray(chars):
+            char = bytes(bytearray([char]))
+            counts = [n + record.count(char) for n, record in zip(counts, records)]
+        return counts
+    return _count_array(np, records, chars).tolist()
+
+
+class RecordBatch(object):
+    """
+    The (unformatted) fields of a run of records: their identifiers, sequences, FASTQ "+" lines
+    and quality scores (None for FASTA).
+    """
+    def __init__(self, file_type, ids, seqs, ids2, quals):
+        self.file_type = file_type
+        self.ids = ids
+        self.seqs = seqs
+        self.ids2 = ids2
+        self.quals = quals
+        self._lengths = None
+
+    def __len__(self):
+        return len(self.seqs)
+
+    def __iter__(self):
+        return iter(zip(self.ids, self.seqs, self.ids2, self.quals))
+
+    @property
+    def lengths(self):
+        """Number of bases in each sequence (not counting FASTA line breaks), as a numpy array if
+        it's installed.
+        """
+        if self._lengths is None:
+            np = _numpy()
+            if np is None or not self.seqs:
+                lengths = [len(seq) for seq in self.seqs]
+                if self.file_type == 'FASTA':
+                    lengths = [n - ws for n, ws in zip(lengths,
+                                                       count_in_records(self.seqs, WHITESPACE))]
+            else:
+                lengths = _record_lengths(np, self.seqs)
+                if self.file_type == 'FASTA':
+                    lengths -= _count_array(np, self.seqs, WHITESPACE)
+            self._lengths = lengths
+        return self._lengths
+
+    def drop(self, indices):
+        """Removes the records at `indices`.
+        """
+        indices = set(indices)
+        keep = [i for i in range(len(self.seqs)) if i not in indices]
+        self.ids = [self.ids[i] for i in keep]
+        self.seqs = [self.seqs[i] for i in keep]
+        self.ids2 = [self.ids2[i] for i in keep]
+        self.quals = [self.quals[i] for i in keep]
+        self._lengths = None
+
+
+class RecordCheck(object):
+    """
+    A check of a batch of records. `find` returns the indices of the records in the batch that
+    fail it (ideally testing all of them at once), and `fix` repairs them, by default by dropping
+    them. Checks that take a `value` (e.g. a minimum length) set `value_type`.
+    """
+    name = None
+    description = None
+    actions = ACTIONS
+    default_action = None
+    value_type = None
+    # whether fixing the records drops some of them
+    drops_records = True
+
+    def __init__(self, action, value=None):
+        if action not in self.actions:
+            raise ValueError('The {} check can only {} (not {})'.format(
+                self.name, ' or '.join(self.actions), action
+            ))
+        if self.value_type is not None:
+            if value is None:
+                raise ValueError('The {} check needs a value, e.g. {}={}:<value>'.format(
+                    self.name, self.name, action
+                ))
+            value = self.value_type(value)
+        self.action = action
+        self.value = value
+
+    def __repr__(self):
+        return '<{} {}>'.format(self.__class__.__name__, self.action)
+
+    def find(self, batch, reads):
+        raise NotImplementedError
+
+    def fix(self, batch, failing, reads):
+        batch.drop(failing)
+
+    def error_message(self, batch, index, reads):
+        seq_id = batch.ids[index].decode('utf-8', 'replace')
+        return '{} has {}: {}'.format(reads.name, self.describe(), seq_id)
+
+    def warning_message(self, reads):
+        if self.action == 'fix':
+            return '{} has {}; {}'.format(reads.name, self.describe(),
+                                          'removing them' if self.drops_records else 'fixing them')
+        return '{} has {}'.format(reads.name, self.describe())
+
+    def describe(self):
+        return self.description.format(value=self.value)
+
+    def run(self, batch, reads):
+        """
+        Runs the check on `batch` (modifying it to fix any failing records) for `reads` (the
+        `FASTXNuclIterator` it's from), counting the failing records in `reads.check_counts`.
+        """
+        failing = self.find(batch, reads)
+        if not failing:
+            return
+        reads.check_counts[self.name] = reads.check_counts.get(self.name, 0) + len(failing)
+        if self.action == 'error':
+            raise ValidationError(self.error_message(batch, failing[0], reads))
+        elif self.action == 'fix':
+            self.fix(batch, failing, reads)
+            reads._warn_once(self.warning_message(reads))
+        else:
+            reads._warn_once(self.warning_message(reads), modified=False)
+
+
+CHECKS = OrderedDict()
+
+
+def register_check(cls):
+    """Adds a `RecordCheck` (sub)class to the checks that can be configured by name.
+    """
+    CHECKS[cls.name] = cls
+    return cls
+
+
+@register_check
+class AlphabetCheck(RecordCheck):
+    name = 'alphabet'
+    description = 'non-nucleic acid characters'
+    actions = ('fix', 'error')
+    default_action = 'error'
+    drops_records = False
+
+    def find(self, batch, reads):
+        # one match over the whole batch is much faster than one per record
+        if reads.valid_bases_match.match(b''.join(batch.seqs)):
+            return []
+        return [i for i, seq in enumerate(batch.seqs) if not reads.valid_bases_match.match(seq)]
+
+    def fix(self, batch, failing, reads):
+        for i in failing:
+            batch.seqs[i] = reads.valid_bases.sub(b'N', batch.seqs[i])
+
+    def error_message(self, batch, index, reads):
+        chars = b','.join(set(reads.valid_bases.findall(batch.seqs[index])))
+        return '{} contains non-nucleic acid characters: {}'.format(reads.name, chars)
+
+    def warning_message(self, reads):
+        return 'Replacing non-nucleic acid characters in {} with N'.format(reads.name)
+
+    def run(self, batch, reads):
+        super(AlphabetCheck, self).run(batch, reads)
+        # Only search for OTHER_BASES if we're allowing them in the first place
+        if reads.allow_iupac and OTHER_BASES.search(b''.join(batch.seqs)) is not None:
+            reads._warn_once('Translating other bases in {} (X->N,U->T)'.format(reads.name))
+            batch.seqs = [seq.translate(OTHER_BASE_TRANS) for seq in batch.seqs]
+
+
+@register_check
+class HeaderTabsCheck(RecordCheck):
+    name = 'header_tabs'
+    description = 'tabs in headers'
+    default_action = 'fix'
+    drops_records = False
+
+    def find(self, batch, reads):
+        if b'\t' not in b''.join(batch.ids) and b'\t' not in b''.join(batch.ids2):
+            return []
+        return [i for i, (seq_id, seq_id2) in enumerate(zip(batch.ids, batch.ids2))
+                if b'\t' in seq_id or b'\t' in seq_id2]
+
+    def fix(self, batch, failing, reads):
+        for i in failing:
+            batch.ids[i] = batch.ids[i].replace(b'\t', b'|')
+            batch.ids2[i] = batch.ids2[i].replace(b'\t', b'|')
+
+    def warning_message(self, reads):
+        if self.action == 'fix':
+            return '{} can not have tabs in headers; autoreplacing'.format(reads.name)
+        return super(HeaderTabsCheck, self).warning_message(reads)
+
+
+@register_check
+class MinLengthCheck(RecordCheck):
+    name = 'min_length'
+    description = 'reads shorter than {value} bases'
+    value_type = int
+
+    def find(self, batch, reads):
+        np = _numpy()
+        if np is None or not len(batch):
+            return [i for i, n in enumerate(batch.lengths) if n < self.value]
+        return np.flatnonzero(batch.lengths < self.value).tolist()
+
+
+@register_check
+class MaxNFractionCheck(RecordCheck):
+    name = 'max_n_fraction'
+    description = 'reads more than {value:.0%} N'
+    value_type = float
+
+    def find(self, batch, reads):
+        np = _numpy()
+        if np is None or not len(batch):
+            n_counts = count_in_records(batch.seqs, b'Nn')
+            return [i for i, (n, length) in enumerate(zip(n_counts, batch.lengths))
+                    if n > self.value * length]
+        n_counts = _count_array(np, batch.seqs, b'Nn')
+        return np.flatnonzero(n_counts > self.value * batch.lengths).tolist()
+
+
+@register_check
+class DuplicateIdsCheck(RecordCheck):
+    """
+    Finds repeated read identifiers (up to the first whitespace) within each batch of records
+    (which are up to 16MB each), keeping the first of each.
+    """
+    name = 'duplicate_ids'
+    description = 'duplicate read IDs'
+
+    def find(self, batch, reads):
+        # (splitting off the IDs is per record, but finding the repeats is all at once)
+        read_ids = [(seq_id.split(None, 1) or [b''])[0] for seq_id in batch.ids]
+        if len(set(read_ids)) == len(read_ids):
+            return []
+        np = _numpy()
+        if np is None:
+            seen, failing = set(), []
+            for i, read_id in enumerate(read_ids):
+                if read_id in seen:
+                    failing.append(i)
+                seen.add(read_id)
+            return failing
+        # (an object array, since fixed-width byte strings would ignore trailing NULs)
+        _, first = np.unique(np.array(read_ids, dtype=object), return_index=True)
+        repeated = np.ones(len(read_ids), dtype=bool)
+        repeated[first] = False
+        return np.flatnonzero(repeated).tolist()
+
+
+@register_check
+class QualityLengthCheck(RecordCheck):
+    name = 'qual_length'
+    description = 'quality scores of a different length than their sequence'
+    drops_records = False
+
+    def find(self, batch, reads):
+        if batch.file_type != 'FASTQ':
+            return []
+        np = _numpy()
+        if np is None or not len(batch):
+            return [i for i, (seq, qual) in enumerate(zip(batch.seqs, batch.quals))
+                    if len(seq) != len(qual)]
+        return np.flatnonzero(_record_lengths(np, batch.seqs) !=
+                              _record_lengths(np, batch.quals)).tolist()
+
+    def fix(self, batch, failing, reads):
+        # trim the longer of the two
+        for i in failing:
+            length = min(len(batch.seqs[i]), len(batch.quals[i]))
+            batch.seqs[i], batch.quals[i] = batch.seqs[i][:length], batch.quals[i][:length]
+
+
+def make_checks(config=None):
+    """
+    Returns the checks to run, in order, given a `config` dict mapping check names to an action
+    (or to an (action, value) tuple, for checks that need a value). Checks that aren't configured
+    get their `default_action`, if they have one; an action of None turns a check off.
+    """
+    config = dict(config or {})
+    unknown = set(config) - set(CHECKS)
+    if unknown:
+        raise ValueError('Unknown check(s): {}. Choose from {}'.format(
+            ', '.join(sorted(unknown)), ', '.join(CHECKS)
+        ))
+    checks = []
+    for name, cls in CHECKS.items():
+        setting = config.get(name, cls.default_action)
+        action, value = setting if isinstance(setting, tuple) else (setting, None)
+        if action is not None:
+            checks.append(cls(action, value))
+    return checks
+
+
+def parse_check(spec):
+    """
+    Parses a check setting of the form "name=action" or "name=action:value" (e.g.
+    "min_length=warn:50") into a (name, action) or (name, (action, value)) pair.
+    """
+    name, sep, setting = spec.partition('=')
+    action, _, value = setting.partition(':')
+    if not sep or not name or not action:
+        raise ValueError('Checks must be given as name=action or name=action:value')
+    return name.strip(), (action, value) if value else action
@@ -0,0 +1,264 @@
+"""
+Interchangeable deflate implementations used for reading gzipped inputs and (re)compressing
+uploads. Accelerated libraries (python-isal, zlib-ng) are used when installed, falling back to
+the standard library's zlib.
+"""
+from __future__ import division
+import gzip
+import struct
+from threading import Lock
+import time
+import zlib
+
+from onecodex.exceptions import OneCodexException
+
+
+class CompressionBackend(object):
+    """
+    A deflate implementation that is API-compatible with the stdlib `zlib` and `gzip` modules.
+
+    Parameters
+    ----------
+    name : string
+        Name used to select the backend.
+    zlib_module : module
+        Provides `compressobj` and `crc32` like the stdlib `zlib`.
+    gzip_file : class
+        A `gzip.GzipFile` (sub)class used to decompress gzipped inputs.
+    level_map : dict, optional
+        Maps zlib compression levels (1-9) onto the backend's own levels.
+    """
+    def __init__(self, name, zlib_module, gzip_file, level_map=None):
+        self.name = name
+        self._zlib = zlib_module
+        self._gzip_file = gzip_file
+        self._level_map = level_map
+
+    def __repr__(self):
+        return '<{} {}>'.format(self.__class__.__name__, self.name)
+
+    def compressobj(self, level):
+        """Returns a raw deflate compressor (to be wrapped in a gzip header/trailer).
+        """
+        if self._level_map is not None:
+            level = self._level_map[level]
+        return self._zlib.compressobj(level, zlib.DEFLATED, -zlib.MAX_WBITS)
+
+    def crc32(self, data, value=0):
+        return self._zlib.crc32(data, value)
+
+    def open(self, file_obj):
+        """Transparently decompress the gzipped `file_obj`.
+        """
+        return self._gzip_file(fileobj=file_obj, mode='rb')
+
+
+def _load_isal():
+    from isal import igzip, isal_zlib
+    # ISA-L only has levels 0-3
+    level_map = {1: 0, 2: 1, 3: 1, 4: 1, 5: 2, 6: 2, 7: 3, 8: 3, 9: 3}
+    return CompressionBackend('isal', isal_zlib, igzip.IGzipFile, level_map=level_map)
+
+
+def _load_zlib_ng():
+    from zlib_ng import gzip_ng, zlib_ng
+    return CompressionBackend('zlib-ng', zlib_ng, gzip_ng.GzipNGFile)
+
+
+def _load_zlib():
+    return CompressionBackend('zlib', zlib, gzip.GzipFile)
+
+
+# in order of preference (fastest first)
+BACKEND_LOADERS = [
+    ('isal', _load_isal),
+    ('zlib-ng', _load_zlib_ng),
+    ('zlib', _load_zlib),
+]
+_loaded_backends = {}
+
+
+def available_backends():
+    """
+    Returns a list of the names of the installed compression backends, fastest first.
+    """
+    names = []
+    for name, loader in BACKEND_LOADERS:
+        try:
+            get_backend(name)
+        except OneCodexException:
+            continue
+        names.append(name)
+    return names
+
+
+def get_backend(name=None):
+    """
+    Returns a `CompressionBackend` by name (or the fastest available if `name` is None).
+    Instances of `CompressionBackend` are passed straight through.
+    """
+    if isinstance(name, CompressionBackend):
+        return name
+    if name is None:
+        return get_backend(available_backends()[0])
+
+    if name not in _loaded_backends:
+        loaders = dict(BACKEND_LOADERS)
+        if name not in loaders:
+            raise OneCodexException('Unknown compression backend: {}'.format(name))
+        try:
+            _loaded_backends[name] = loaders[name]()
+        except ImportError:
+            raise OneCodexException('The {} compression backend is not installed'.format(name))
+    return _loaded_backends[name]
+
+
+class GzipWriter(object):
+    """
+    Writes a single gzip member to `file_obj`, using any backend's raw deflate compressor.
+    """
+    def __init__(self, file_obj, level, backend=None):
+        self.file_obj = file_obj
+        self.backend = get_backend(backend)
+        self.level = level
+        self._compressor = self.backend.compressobj(level)
+        self._crc = 0
+        self._size = 0
+        self.bytes_out = 0
+        self.closed = False
+
+        if level == 9:
+            xfl = b'\x02'
+        elif level == 1:
+            xfl = b'\x04'
+        else:
+            xfl = b'\x00'
+        # magic, deflate, no flags, mtime, extra flags, unknown OS
+        self._write(b'\x1f\x8b\x08\x00' + struct.pack('<L', int(time.time())) + xfl + b'\xff')
+
+    def _write(self, data):
+        self.bytes_out += len(data)
+        self.file_obj.write(data)
+
+    def set_level(self, level):
+        """
+        Switch compression levels mid-stream. The current deflate stream is sync-flushed (so it
+        ends on a byte boundary without being marked final) and a new one is started at the new
+        level; the concatenation is still a single valid gzip member.
+        """
+        if level == self.level:
+            return
+        self._write(self._compressor.flush(zlib.Z_SYNC_FLUSH))
+        self._compressor = self.backend.compressobj(level)
+        self.level = level
+
+    def write(self, data):
+        self._crc = self.backend.crc32(data, self._crc)
+        self._size += len(data)
+        self._write(self._compressor.compress(data))
+
+    def close(self):
+        if self.closed:
+            return
+        self.closed = True
+        self._write(self._compressor.flush())
+        self._write(struct.pack('<LL', self._crc & 0xffffffff, self._size & 0xffffffff))
+
+
+class ThroughputMeter(object):
+    """
+    A thread-safe, exponentially-weighted estimate of a transfer rate (in bytes per second).
+    Measurements are pooled into windows of at least `window` seconds before being averaged in,
+    so many tiny reads don't make for a noisy estimate.
+    """
+    def __init__(self, window=0.25, alpha=0.3):
+        self.window = window
+        self.alpha = alpha
+        self.rate = None
+        self._bytes = 0
+        self._seconds = 0.
+        self._lock = Lock()
+
+    def record(self, n_bytes, seconds):
+        with self._lock:
+            self._bytes += n_bytes
+            self._seconds += seconds
+            if self._seconds < self.window:
+                return
+            rate = self._bytes / self._seconds
+            if self.rate is None:
+                self.rate = rate
+            else:
+                self.rate = self.alpha * rate + (1 - self.alpha) * self.rate
+            self._bytes, self._seconds = 0, 0.
+
+
+class AdaptiveCompressionLevel(object):
+    """
+    Picks a compression level for each block of an upload to minimize its time to completion.
+
+    Compressing and sending happen one after the other, so every uncompressed byte costs the
+    time to compress it plus the time to send its compressed share. Each level's speed and ratio
+    are measured on the data itself (the first few blocks probe the available levels and the
+    neighbours of the current choice are re-probed periodically) and the network rate comes from
+    a `ThroughputMeter` shared by all of the transfers in a batch.
+
+    Parameters
+    ----------
+    min_level, max_level : int, optional
+        Bounds on the levels to choose from (1-9).
+    network : ThroughputMeter, optional
+        Measures the achieved network throughput. Until it has an estimate, `initial_level` is
+        used (after probing).
+    initial_level : int, optional
+    reprobe_every : int, optional
+        Number of blocks between re-measuring the current level's neighbours.
+    """
+    PROBE_LEVELS = (1, 3, 5, 7, 9)
+
+    def __init__(self, min_level=1, max_level=9, network=None, initial_level=5,
+                 reprobe_every=32, alpha=0.3):
+        if not 1 <= min_level <= max_level <= 9:
+            raise OneCodexException('Compression levels must be between 1 and 9')
+        self.min_level = min_level
+        self.max_level = max_level
+        self.network = network if network is not None else ThroughputMeter()
+        self.level = min(max(initial_level, min_level), max_level)
+        self.reprobe_every = reprobe_every
+        self.alpha = alpha
+
+        levels = {l for l in self.PROBE_LEVELS if min_level <= l <= max_level}
+        levels.update([min_level, max_level])
+        self._to_probe = sorted(levels)
+        self._stats = {}  # level -> (seconds per input byte, output bytes per input byte)
+        self._blocks = 0
+
+    def record_compression(self, level, n_in, n_out, seconds):
+        if n_in == 0:
+            return
+        sample = (seconds / n_in, n_out / n_in)
+        if level in self._stats:
+            old = self._stats[level]
+            sample = tuple(self.alpha * s + (1 - self.alpha) * o for s, o in zip(sample, old))
+        self._stats[level] = sample
+
+    def cost(self, level):
+        """Estimated seconds to compress and send one uncompressed byte at `level`.
+        """
+        seconds_per_byte, ratio = self._stats[level]
+        return seconds_per_byte + ratio / self.network.rate
+
+    def next_level(self):
+        self._blocks += 1
+        if self._to_probe:
+            return self._to_probe.pop(0)
+
+        if self.network.rate:
+            candidates = [l for l in self._stats if self.min_level <= l <= self.max_level]
+            self.level = min(candidates, key=self.cost)
+
+            if self._blocks % self.reprobe_every == 0:
+                # re-measure the neighbours in case the data or machine has changed
+                self._to_probe = [l for l in (self.level - 1, self.level + 1)
+                                  if self.min_level <= l <= self.max_level]
+        return self.level
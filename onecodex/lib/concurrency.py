@@ -0,0 +1,159 @@
+"""
+Auto-tuning of the number of concurrent uploads
+"""
+from __future__ import division
+import multiprocessing
+import os
+from threading import Condition, Event, Lock, Thread
+import time
+
+
+class AdjustableSemaphore(object):
+    """
+    A semaphore whose limit can be changed while it's in use. Lowering the limit doesn't
+    interrupt holders; new acquirers just wait until enough of them have released.
+    """
+    def __init__(self, limit):
+        self._limit = limit
+        self._held = 0
+        self._cond = Condition(Lock())
+
+    @property
+    def limit(self):
+        return self._limit
+
+    def set_limit(self, limit):
+        with self._cond:
+            self._limit = limit
+            self._cond.notify_all()
+
+    def acquire(self):
+        with self._cond:
+            while self._held >= self._limit:
+                self._cond.wait()
+            self._held += 1
+
+    def release(self):
+        with self._cond:
+            self._held -= 1
+            self._cond.notify_all()
+
+
+class ConcurrencyTuner(object):
+    """
+    Hill-climbs the number of concurrent uploads towards the one with the best aggregate
+    throughput. Every `interval` seconds the throughput since the last adjustment is compared
+    with the one before: while it keeps improving the limit keeps moving in the same direction,
+    and when it drops the direction is reversed. Errors or timeouts halve the limit (AIMD-style)
+    and saturating the CPU backs off by one. After `settle_after` reversals the tuner settles on
+    the best limit seen.
+
+    Parameters
+    ----------
+    min_workers, max_workers : int, optional
+        Bounds on the number of concurrent uploads. `max_workers` defaults to 4 per CPU (max 32).
+    initial : int, optional
+    interval : float, optional
+        Seconds between adjustments.
+    """
+    def __init__(self, min_workers=1, max_workers=None, initial=2, interval=5.,
+                 tolerance=0.05, max_cpu=0.9, settle_after=3):
+        if max_workers is None:
+            max_workers = min(32, 4 * multiprocessing.cpu_count())
+        self.min_workers = min_workers
+        self.max_workers = max_workers
+        self.interval = interval
+        self.tolerance = tolerance
+        self.max_cpu = max_cpu
+        self.settle_after = settle_after
+
+        self.semaphore = AdjustableSemaphore(min(max(initial, min_workers), max_workers))
+        self.best_limit = self.semaphore.limit
+        self.best_throughput = None
+        self.settled = False
+        self.history = []
+
+        self._direction = 1
+        self._reversals = 0
+        self._last_throughput = None
+        self._bytes = 0
+        self._errors = 0
+        self._lock = Lock()
+        self._stop = Event()
+        self._thread = None
+
+    @property
+    def limit(self):
+        return self.semaphore.limit
+
+    def record_bytes(self, n_bytes):
+        with self._lock:
+            self._bytes += n_bytes
+
+    def record_error(self, *args):
+        with self._lock:
+            self._errors += 1
+
+    def adjust(self, throughput, cpu=0., errors=0):
+        """
+        Update the limit given the throughput (bytes per second), CPU use (as a fraction of all
+        cores) and number of errors observed at the current limit since the last adjustment.
+        """
+        limit = self.limit
+        self.history.append((limit, throughput))
+        if errors == 0 and (self.best_throughput is None or throughput > self.best_throughput):
+            self.best_limit, self.best_throughput = limit, throughput
+
+        if self.settled:
+            new_limit = self.best_limit
+            if errors > 0:
+                new_limit = limit // 2
+        elif errors > 0:
+            new_limit = limit // 2
+            self._direction = 1
+        elif cpu >= self.max_cpu:
+            new_limit = limit - 1
+            self._direction = -1
+        elif self._last_throughput is None or \
+                throughput > self._last_throughput * (1 + self.tolerance):
+            new_limit = limit + self._direction
+        elif throughput < self._last_throughput * (1 - self.tolerance):
+            self._direction = -self._direction
+            self._reversals += 1
+            new_limit = limit + self._direction
+        else:
+            new_limit = limit
+
+        if not self.settled and self._reversals >= self.settle_after:
+            self.settled = True
+            new_limit = self.best_limit
+
+        self._last_throughput = throughput
+        new_limit = min(max(new_limit, self.min_workers), self.max_workers)
+        if new_limit != limit:
+            self.semaphore.set_limit(new_limit)
+        return new_limit
+
+    def _cpu_time(self):
+        times = os.times()
+        return times[0] + times[1]
+
+    def _run(self):
+        last_time, last_cpu = time.time(), self._cpu_time()
+        while not self._stop.wait(self.interval):
+            now, cpu_time = time.time(), self._cpu_time()
+            elapsed = now - last_time
+            with self._lock:
+                n_bytes, errors = self._bytes, self._errors
+                self._bytes, self._errors = 0, 0
+            cpu = (cpu_time - last_cpu) / elapsed / multiprocessing.cpu_count()
+            self.adjust(n_bytes / elapsed, cpu=cpu, errors=errors)
+            last_time, last_cpu = now, cpu_time
+
+    def start(self):
+        self._thread = Thread(target=self._run)
+        self._thread.daemon = True
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
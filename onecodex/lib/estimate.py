@@ -0,0 +1,167 @@
+"""
+Predicting how much data an upload will send (and how long it will take) by sampling a few
+blocks of each input, rather than making a full pass over it
+"""
+from __future__ import division
+import bz2
+import os
+import time
+import zlib
+
+from onecodex.lib.compression import GzipWriter, get_backend
+
+
+N_SAMPLES = 4
+SAMPLE_SIZE = 256 * 1024
+# small, so the input behind each output (e.g. a bzip2 block) is measured closely
+READ_SIZE = 16 * 1024
+
+
+class _CountingSink(object):
+    def __init__(self):
+        self.size = 0
+
+    def write(self, data):
+        self.size += len(data)
+
+
+class SizeEstimate(object):
+    """
+    The predicted outcome of uploading a file (or an R1/R2 pair).
+
+    Attributes
+    ----------
+    disk_size : int
+        Size of the input(s) on disk.
+    data_size : int
+        Estimated size once decompressed.
+    upload_size : int
+        Estimated size once (re)compressed for uploading.
+    compress_seconds : float
+        Estimated CPU time to compress it.
+    exact : bool
+        Whether the whole input was sampled (so the sizes aren't extrapolated).
+    """
+    def __init__(self, disk_size, data_size, upload_size, compress_seconds, exact=False):
+        self.disk_size = disk_size
+        self.data_size = data_size
+        self.upload_size = upload_size
+        self.compress_seconds = compress_seconds
+        self.exact = exact
+
+    def __repr__(self):
+        return '<{} {} -> {}>'.format(self.__class__.__name__, self.disk_size, self.upload_size)
+
+    def __add__(self, other):
+        return SizeEstimate(self.disk_size + other.disk_size, self.data_size + other.data_size,
+                            self.upload_size + other.upload_size,
+                            self.compress_seconds + other.compress_seconds,
+                            exact=self.exact and other.exact)
+
+    @property
+    def ratio(self):
+        """Estimated bytes uploaded per byte on disk.
+        """
+        return self.upload_size / self.disk_size if self.disk_size else 1.
+
+    def seconds(self, bandwidth=None):
+        """
+        Predicted time to compress and send the file at `bandwidth` bytes per second (or just to
+        compress it if the bandwidth isn't known).
+        """
+        if not bandwidth:
+            return self.compress_seconds
+        return self.compress_seconds + self.upload_size / bandwidth
+
+
+def _sample_blocks(file_obj, disk_size, n_samples, sample_size):
+    """
+    Returns a list of uncompressed samples of `file_obj`, the ratio of its uncompressed to
+    on-disk size and whether the whole file was read.
+    """
+    magic = file_obj.read(2)
+    file_obj.seek(0)
+    if magic == b'\x1f\x8b':
+        # gzip (possibly of several members)
+        new_decompressor = lambda: zlib.decompressobj(16 + zlib.MAX_WBITS)  # noqa
+    elif magic == b'BZ':
+        new_decompressor = bz2.BZ2Decompressor
+    elif disk_size <= n_samples * sample_size:
+        return [file_obj.read()], 1., True
+    else:
+        # uncompressed files can be sampled evenly throughout
+        samples = []
+        for i in range(n_samples):
+            file_obj.seek(i * (disk_size - sample_size) // max(n_samples - 1, 1))
+            samples.append(file_obj.read(sample_size))
+        return samples, 1., False
+
+    # compressed files can't be entered midway, so decompress the start of the file. The ratio
+    # only counts the input up to the last output, since the decompressor may be holding on to a
+    # partial block
+    decompressor = new_decompressor()
+    chunks, n_out, n_in, n_in_used = [], 0, 0, 0
+    while n_out < n_samples * sample_size:
+        data = file_obj.read(READ_SIZE)
+        if not data:
+            return [b''.join(chunks)], n_out / max(n_in, 1), True
+        n_in += len(data)
+        n_out_before = n_out
+        while data:
+            if getattr(decompressor, 'eof', False):
+                decompressor = new_decompressor()
+            chunk = decompressor.decompress(data)
+            chunks.append(chunk)
+            n_out += len(chunk)
+            data = decompressor.unused_data
+            if data:
+                decompressor = new_decompressor()
+        if n_out > n_out_before:
+            n_in_used = n_in
+    return [b''.join(chunks)], n_out / max(n_in_used, 1), file_obj.read(1) == b''
+
+
+def estimate_upload(filename, compression_level=5, compression_backend=None,
+                    n_samples=N_SAMPLES, sample_size=SAMPLE_SIZE):
+    """
+    Estimates how big a file (or (R1, R2) tuple or list of lanes of files) will be once validated
+    and compressed for uploading, by decompressing and recompressing a few samples of it.
+
+    Uncompressed files are sampled at `n_samples` evenly spaced points; gzipped and bzipped ones
+    can only be read from the start, so their first few blocks are decompressed instead. Raises
+    IOError if a file can't be read or isn't validly compressed.
+    """
+    if isinstance(filename, (tuple, list)):
+        estimates = [estimate_upload(f, compression_level, compression_backend, n_samples,
+                                     sample_size) for f in filename]
+        total = estimates[0]
+        for estimate in estimates[1:]:
+            total += estimate
+        return total
+
+    if compression_level == 'auto':
+        compression_level = 5
+    elif isinstance(compression_level, tuple):
+        compression_level = min(max(5, compression_level[0]), compression_level[1])
+
+    with open(filename, 'rb') as f:
+        disk_size = os.fstat(f.fileno()).st_size
+        try:
+            samples, ratio, exact = _sample_blocks(f, disk_size, n_samples, sample_size)
+        except (zlib.error, EOFError, ValueError) as e:
+            raise IOError('Could not decompress {}: {}'.format(filename, e))
+
+    sink = _CountingSink()
+    start = time.time()
+    writer = GzipWriter(sink, compression_level, backend=get_backend(compression_backend))
+    for sample in samples:
+        writer.write(sample)
+    writer.close()
+    seconds = time.time() - start
+
+    n_sampled = sum(len(sample) for sample in samples)
+    data_size = int(round(disk_size * ratio))
+    if exact or n_sampled == 0:
+        return SizeEstimate(disk_size, data_size, sink.size, seconds, exact=exact)
+    scale = data_size / n_sampled
+    return SizeEstimate(disk_size, data_size, int(round(sink.size * scale)), seconds * scale)
@@ -2,12 +2,18 @@ import bz2
 from collections import deque
 import gzip
 from io import BytesIO
+import mmap
 import os
 import re
-import string
+from stat import S_ISREG
+import time
 import warnings
+import zlib
 
-from onecodex.exceptions import ValidationError, ValidationWarning
+from onecodex.exceptions import (PassthroughAborted, ReadCheckWarning, ValidationError,
+                                 ValidationWarning)
+from onecodex.lib.checks import RecordBatch, make_checks
+from onecodex.lib.compression import AdaptiveCompressionLevel, GzipWriter, get_backend
 
 GZIP_COMPRESSION_LEVEL = 5
 
@@ -50,14 +56,25 @@ class Buffer(object):
 
 
 class GzipBuffer(object):
-    def __init__(self):
+    def __init__(self, compresslevel=GZIP_COMPRESSION_LEVEL, compression_backend=None,
+                 level_controller=None, level_schedule=None):
+        """
+        Buffers reads and gzips them in blocks. The compression level can be switched between
+        blocks, either by an `AdaptiveCompressionLevel` or by replaying the `levels_used` of a
+        previous pass over the same data (so that both passes produce the same number of bytes).
+        """
         self._buf = Buffer()
-        self._gzip = gzip.GzipFile(None, mode='wb', fileobj=self._buf,
-                                   compresslevel=GZIP_COMPRESSION_LEVEL)
+        self._gzip = GzipWriter(self._buf, compresslevel, backend=compression_backend)
         self._reads_buffer = Buffer()
         self.MAX_READS_BUFFER_SIZE = 1024 * 256  # 256kb
         self.closed = False
 
+        self.compresslevel = compresslevel
+        self.level_controller = level_controller
+        self.level_schedule = level_schedule
+        self.levels_used = []
+        self.level_sizes = {}
+
     def __len__(self):
         return len(self._buf)
 
@@ -69,39 +86,253 @@ class GzipBuffer(object):
     def read(self, size=-1):
         return self._buf.read(size)
 
+    def _next_level(self):
+        if self.level_schedule is not None:
+            return self.level_schedule[len(self.levels_used)]
+        elif self.level_controller is not None:
+            return self.level_controller.next_level()
+        return self.compresslevel
+
     def flush(self):
-        self._gzip.write(self._reads_buffer.read())
+        data = self._reads_buffer.read()
+        if len(data) == 0:
+            return
+
+        level = self._next_level()
+        self._gzip.set_level(level)
+        bytes_out = self._gzip.bytes_out
+        start = time.time()
+        self._gzip.write(data)
+        if self.level_controller is not None:
+            self.level_controller.record_compression(level, len(data),
+                                                     self._gzip.bytes_out - bytes_out,
+                                                     time.time() - start)
+        self.levels_used.append(level)
+        self.level_sizes[level] = self.level_sizes.get(level, 0) + len(data)
 
     def close(self):
+        if self.closed:
+            return
         if len(self._reads_buffer) > 0:
             self.flush()
         self._gzip.close()
         self.closed = True
 
 
-# this checks and translates all valid IUPAC nucleotide codes into the core 4+n (ACGTN)
-OTHER_BASES = re.compile(b'[BDHIKMRSUVWXYbdhikmrsuvwxy]')
-if hasattr(bytes, 'maketrans'):
-    OTHER_BASE_TRANS = bytes.maketrans(b'BDHIKMRSUVWXYbdhikmrsuvwxy',
-                                       b'NNNNNNNNTNNNNnnnnnnnntnnnn')
-else:
-    OTHER_BASE_TRANS = string.maketrans(b'BDHIKMRSUVWXYbdhikmrsuvwxy',
-                                        b'NNNNNNNNTNNNNnnnnnnnntnnnn')
+class RewindableStream(object):
+    def __init__(self, stream, name=None, spool_size=1024 * 1024):
+        """
+        Wraps a non-seekable stream (e.g. a pipe) so that it keeps track of its position and can
+        be rewound as long as no more than its first `spool_size` bytes have been read (plenty to
+        sniff the format of the data), without storing anything more of it.
+        """
+        self.stream = stream
+        self.name = name if name is not None else 'stdin'
+        self.spool_size = spool_size
+        self._spool = b''  # the start of the stream, until it outgrows `spool_size`
+        self._position = 0
+
+    def read(self, n=-1):
+        data = b''
+        if self._spool is not None and self._position < len(self._spool):
+            end = len(self._spool) if n < 0 else min(len(self._spool), self._position + n)
+            data = self._spool[self._position:end]
+            self._position = end
+            if n >= 0:
+                n -= len(data)
+                if n == 0:
+                    return data
+
+        new_data = self.stream.read(n)
+        if self._spool is not None:
+            if len(self._spool) + len(new_data) <= self.spool_size:
+                self._spool += new_data
+            else:
+                self._spool = None
+        self._position += len(new_data)
+        return data + new_data
+
+    def readinto(self, buf):
+        data = self.read(len(buf))
+        buf[:len(data)] = data
+        return len(data)
+
+    def readable(self):
+        return True
+
+    def seekable(self):
+        # as far as the decompressors wrapping this are concerned (they need to be able to `tell`)
+        return True
+
+    def tell(self):
+        return self._position
+
+    def seek(self, offset, whence=0):
+        if whence == 0 and offset == self._position:
+            return self._position
+        if whence != 0 or self._spool is None or offset > len(self._spool):
+            raise IOError('{} is a stream and can only be rewound within its first {} '
+                          'bytes'.format(self.name, self.spool_size))
+        self._position = offset
+        return offset
+
+    def close(self):
+        self.stream.close()
+
+
+class FileGroup(object):
+    def __init__(self, file_objs, compression_backend=None):
+        """
+        Reads several FASTX files (e.g. the lanes of one library) one after the other as a single
+        stream. Each file is decompressed (if need be) separately and they must all be the same
+        type (FASTA or FASTQ). `tell` reports the position in the files on disk, to measure
+        progress by.
+        """
+        self.file_objs = file_objs
+        self.compression_backend = get_backend(compression_backend)
+        self.total_size = sum(os.fstat(f.fileno()).st_size for f in file_objs)
+        name = file_objs[0].name
+        for ext in ('.gz', '.gzip', '.bz2', '.bz', '.bzip'):
+            if name.endswith(ext):
+                name = name[:-len(ext)]
+        self.name = name
+        self.seek(0)
+
+    def _open(self, index):
+        raw = self.file_objs[index]
+        start = raw.read(1)
+        raw.seek(0)
+        if start == b'\x1f':
+            if not raw.name.endswith(('.gz', '.gzip')):
+                raise ValidationError('{} is gzipped, but lacks a ".gz" ending'.format(raw.name))
+            file_obj = self.compression_backend.open(raw)
+        elif start == b'\x42' and hasattr(bz2, 'open'):
+            if not raw.name.endswith(('.bz2', '.bz', '.bzip')):
+                raise ValidationError('{} is bzipped, but lacks a ".bz2" ending'.format(raw.name))
+            file_obj = bz2.open(raw)
+        else:
+            file_obj = raw
+
+        first = file_obj.read(1)
+        if index == 0:
+            self._first_byte = first
+        elif first != self._first_byte:
+            raise ValidationError('{} is a different type (FASTA/FASTQ) than {}'.format(
+                raw.name, self.file_objs[0].name
+            ))
+        self._current = file_obj
+        self._pending = first  # read ahead of where the caller has got to
+        self._ends_with_newline = True
+
+    def read(self, n=-1):
+        chunks = []
+        while n != 0 and self._index < len(self.file_objs):
+            data = self._pending + self._current.read(n - len(self._pending) if n > 0 else -1)
+            self._pending = b''
+            if data:
+                self._ends_with_newline = data.endswith(b'\n')
+            elif self._index + 1 < len(self.file_objs):
+                # keep a record from running into the next file's first one
+                data = b'' if self._ends_with_newline else b'\n'
+                self._index += 1
+                self._done_size += os.fstat(self.file_objs[self._index - 1].fileno()).st_size
+                self._open(self._index)
+            else:
+                self._index += 1
+            chunks.append(data)
+            if n > 0:
+                n -= len(data)
+        return b''.join(chunks)
+
+    def tell(self):
+        if self._index >= len(self.file_objs):
+            return self.total_size
+        return self._done_size + self.file_objs[self._index].tell()
+
+    def seek(self, loc):
+        assert loc == 0  # we can only rewind all the way
+        for f in self.file_objs:
+            f.seek(0)
+        self._index = 0
+        self._done_size = 0
+        self._open(0)
+
+    def close(self):
+        for f in self.file_objs:
+            f.close()
+
+
+# Illumina's 8-level binning: each (lowest score, binned score) applies up to the next bin's
+# lowest score (and scores below the first bin are left as they are)
+ILLUMINA_QUALITY_BINS = ((2, 6), (10, 15), (20, 22), (25, 27), (30, 33), (35, 37), (40, 40))
+PHRED_OFFSET = 33
+# the most quality data (both binned and not) kept to estimate the binning's savings from
+QUALITY_SAMPLE_SIZE = 1024 * 1024
+
+
+def quality_bin_table(bins=ILLUMINA_QUALITY_BINS, offset=PHRED_OFFSET):
+    """
+    Makes a `bytes.translate` table mapping quality characters into `bins` (see
+    `ILLUMINA_QUALITY_BINS`).
+    """
+    table = bytearray(range(256))
+    bins = sorted(bins)
+    for i, (low, value) in enumerate(bins):
+        high = bins[i + 1][0] if i + 1 < len(bins) else 256 - offset
+        for score in range(low, high):
+            table[score + offset] = value + offset
+    # (anything past "~" isn't a quality score)
+    table[127:] = range(127, 256)
+    return bytes(table)
 
 
 class FASTXNuclIterator(object):
     def __init__(self, file_obj, allow_iupac=False, check_filename=True, as_raw=False,
-                 validate=True):
+                 validate=True, compression_backend=None, normalize=False, quality_bins=None,
+                 sketch=None, checks=None):
+        """
+        Parses (and validates) the records of a FASTA/FASTQ file.
+
+        The records are parsed a batch at a time and each batch is run through the checks in
+        `onecodex.lib.checks.CHECKS`. `checks` maps the names of any to change to an action
+        ('warn', 'fix', 'error' or None to skip it), or to an (action, value) tuple for checks
+        that need a value, e.g. `{'min_length': ('fix', 50)}`. The number of records that fail
+        each check is kept in `check_counts` (and the number read in `n_records`).
+
+        With `normalize`, records are also stripped of anything redundant: trailing whitespace,
+        the identifier repeated on FASTQ "+" lines and the line wrapping of FASTA sequences. The
+        number of bytes this removes is kept in `normalized_size`.
+
+        `quality_bins` (True for `ILLUMINA_QUALITY_BINS`, or a sequence of bins in the same form)
+        lossily bins FASTQ quality scores, which makes them compress much better; see
+        `binning_savings`.
+
+        The sequences are also added to `sketch` (a `KmerSketch`), if there is one.
+        """
         if hasattr(file_obj, 'name'):
             self.name = file_obj.name
         else:
             self.name = 'File'
 
+        self.compression_backend = get_backend(compression_backend)
         self._set_file_obj(file_obj, check_filename=check_filename)
         self.unchecked_buffer = b''
         self.seq_reader = self._generate_seq_reader(False)
         self.allow_iupac = allow_iupac
         self.validate = validate
+        self.normalize = normalize
+        self.normalized_size = 0
+        if quality_bins is True:
+            quality_bins = ILLUMINA_QUALITY_BINS
+        self.quality_bins = quality_bins
+        self._quality_table = quality_bin_table(quality_bins) if quality_bins else None
+        self.binned_size = 0
+        self._quality_samples = ([], [])  # (as they were, binned)
+        self._quality_sample_size = 0
+        self.sketch = sketch
+        self.check_config = checks
+        self.check_counts = {}
+        self.n_records = 0
         self.modified = False
 
         if self.allow_iupac:
@@ -110,6 +341,7 @@ class FASTXNuclIterator(object):
         else:
             self.valid_bases = re.compile(b'[^ACGTNacgtn\s]')
             self.valid_bases_match = re.compile(b'^[ACGTNacgtn\s]*$')
+        self.checks = make_checks(checks)
         self.as_raw = as_raw
 
         self._set_total_size()
@@ -130,7 +362,7 @@ class FASTXNuclIterator(object):
             if check_filename and not file_obj.name.endswith(('.gz', '.gzip')):
                 raise ValidationError('{} is gzipped, but lacks a ".gz" ending'.format(self.name))
             file_obj.seek(0)
-            file_obj = gzip.GzipFile(fileobj=file_obj)
+            file_obj = self.compression_backend.open(file_obj)
             start = file_obj.read(1)
         elif start == b'\x42' and hasattr(bz2, 'open'):
             if check_filename and not file_obj.name.endswith(('.bz2', '.bz', '.bzip')):
@@ -168,18 +400,24 @@ class FASTXNuclIterator(object):
             self.file_obj.seek(0)
             self.total_size = len(self.file_obj.read())
             self.file_obj.seek(1)
+        elif isinstance(self.file_obj, FileGroup):
+            self.total_size = self.file_obj.total_size
         else:
+            # the size of streams (e.g. pipes) isn't known in advance
+            self.total_size = None
             try:
-                self.total_size = os.fstat(self.file_obj.fileno()).st_size
+                stat = os.fstat(self.file_obj.fileno())
+            except (AttributeError, IOError, OSError, ValueError):
+                stat = None
+            if stat is not None and S_ISREG(stat.st_mode):
+                self.total_size = stat.st_size
                 if self.total_size < 70:
                     raise ValidationError('{} is too small to be analyzed: {} bytes'.format(
                         self.name, self.total_size
                     ))
-            except IOError:
-                pass
 
-        # Set the buffer size, 16MB by default for files >32MB
-        if self.total_size >= (1024 * 1024 * 32):
+        # Set the buffer size, 16MB by default for files >32MB (or streams)
+        if self.total_size is None or self.total_size >= (1024 * 1024 * 32):
             self.buffer_read_size = 1024 * 1024 * 16  # 16MB
         else:
             self.buffer_read_size = 1024 * 16  # 16KB small chunk
@@ -201,37 +439,62 @@ class FASTXNuclIterator(object):
             """ + (b'' if last else b'(?:\\n@)'), re.DOTALL + re.VERBOSE)
         return seq_reader
 
-    def _warn_once(self, message):
+    def _warn_once(self, message, modified=True):
+        # (warnings about records that are left as they are don't count as modifying the file)
         if message in self.warnings:
             return
-        warnings.warn(message, ValidationWarning)
+        warnings.warn(message, ValidationWarning if modified else ReadCheckWarning)
         self.warnings.add(message)
-        self.modified = True
+        if modified:
+            self.modified = True
 
-    def _validate_record(self, rec):
+    def _check_batch(self, batch):
         # TODO: if there are quality scores, make sure they're in range
         # FIXME: fail if reads aren't interleaved and an override flag isn't passed?
-        seq_id, seq, seq_id2, qual = rec['id'], rec['seq'], rec.get('id2', b''), rec.get('qual')
-        if not self.validate:
-            return seq_id, seq, seq_id2, qual
-
-        if b'\t' in seq_id or b'\t' in seq_id2:
-            self._warn_once('{} can not have tabs in headers; autoreplacing'.format(self.name))
-            seq_id = seq_id.replace(b'\t', b'|')
-
-        # Match then search is ~5-10% faster than just searching
-        if not bool(self.valid_bases_match.match(seq)):
-            chars = b','.join(set(self.valid_bases.findall(seq)))
-            raise ValidationError('{} contains non-nucleic acid characters: {}'.format(self.name,
-                                                                                       chars))
-
-        # Only search for OTHER_BASES if we're allowing them above in the first place
-        if self.allow_iupac and OTHER_BASES.search(seq) is not None:
-            self._warn_once('Translating other bases in {} (X->N,U->T)'.format(self.name))
-            seq = seq.translate(OTHER_BASE_TRANS)
-
+        for check in self.checks:
+            # (fixes are made even when not validating, so every pass produces the same output)
+            if self.validate or check.action == 'fix':
+                check.run(batch, self)
+
+    def _normalize_record(self, seq_id, seq, seq_id2, qual):
+        size = len(seq_id) + len(seq) + len(seq_id2)
+        seq_id = seq_id.rstrip()
+        if self.file_type == 'FASTA':
+            # unwrap the sequence
+            seq = b''.join(seq.split())
+        else:
+            size += len(qual)
+            seq, seq_id2, qual = seq.rstrip(), b'', qual.rstrip()
+            size -= len(qual)
+
+        removed = size - len(seq_id) - len(seq)
+        if removed:
+            self.normalized_size += removed
+            self.modified = True
         return seq_id, seq, seq_id2, qual
 
+    def _bin_qualities(self, qual):
+        binned = qual.translate(self._quality_table)
+        if binned != qual:
+            self.modified = True
+        self.binned_size += len(qual)
+        if self._quality_sample_size < QUALITY_SAMPLE_SIZE:
+            self._quality_samples[0].append(qual)
+            self._quality_samples[1].append(binned)
+            self._quality_sample_size += len(qual)
+        return binned
+
+    def binning_savings(self, compression_level=GZIP_COMPRESSION_LEVEL):
+        """
+        Estimates how many fewer bytes binning the quality scores leaves to upload once
+        compressed, by compressing a sample of them both before and after binning.
+        """
+        if not self._quality_sample_size:
+            return 0
+        before, after = (len(zlib.compress(b''.join(s), compression_level))
+                         for s in self._quality_samples)
+        return int((before - after) * self.binned_size / self._quality_sample_size)
+
     def __iter__(self):
         eof = False
         while not eof:
@@ -249,12 +512,31 @@ class FASTXNuclIterator(object):
                 self.unchecked_buffer += new_data
 
             end = 0
+            ids, seqs, ids2, quals = [], [], [], []
             while True:
                 match = self.seq_reader.match(self.unchecked_buffer, end)
                 if match is None:
                     break
                 rec = match.groupdict()
-                seq_id, seq, seq_id2, qual = self._validate_record(rec)
+                ids.append(rec['id'])
+                seqs.append(rec['seq'])
+                ids2.append(rec.get('id2', b''))
+                quals.append(rec.get('qual'))
+                end = match.end()
+
+            batch = RecordBatch(self.file_type, ids, seqs, ids2, quals)
+            self.n_records += len(batch)
+            self._check_batch(batch)
+            for seq_id, seq, seq_id2, qual in batch:
+                if self.normalize:
+                    # (even when not validating, so every pass produces the same output)
+                    seq_id, seq, seq_id2, qual = self._normalize_record(seq_id, seq, seq_id2,
+                                                                        qual)
+                if self._quality_table is not None and qual is not None:
+                    qual = self._bin_qualities(qual)
+                if self.sketch is not None and not self.sketch.complete:
+                    self.sketch.add_sequence(seq if self.file_type == 'FASTQ' or b'\n' not in seq
+                                             else b''.join(seq.split()))
                 if self.as_raw:
                     yield (seq_id, seq, qual)
                 elif self.file_type == 'FASTA':
@@ -262,11 +544,13 @@ class FASTXNuclIterator(object):
                 elif self.file_type == 'FASTQ':
                     yield (b'@' + seq_id + b'\n' + seq +
                            b'\n+' + seq_id2 + b'\n' + qual + b'\n')
-                end = match.end()
 
             if hasattr(self.file_obj, 'fileobj'):
                 # for gzip files, get the amount read of the gzipped file (which is wrapped inside)
                 self.processed_size = self.file_obj.fileobj.tell()
+            elif isinstance(self.file_obj, bz2.BZ2File) and hasattr(self.file_obj, '_fp'):
+                # likewise for bzipped files (which don't expose the file they wrap)
+                self.processed_size = self.file_obj._fp.tell()
             else:
                 self.processed_size = self.file_obj.tell()
             self.unchecked_buffer = self.unchecked_buffer[end:]
@@ -277,8 +561,8 @@ class FASTXNuclIterator(object):
             return self.total_size - self.processed_size
 
     def close(self):
-        # did we read everything?
-        if self.bytes_left != 0:
+        # did we read everything? (streams are always read to the end)
+        if self.bytes_left not in (None, 0):
             raise ValidationError('Failed to properly read file: {}/{} bytes unread.'.format(
                 self.bytes_left, self.total_size))
 
@@ -341,6 +625,18 @@ class BaseFASTXReader(object):
                                                                    gzip.GzipFile)
         return read1_gzipped and self.reads_pair is None or read2_gzipped
 
+    @property
+    def can_passthrough(self):
+        """Can the raw (already gzipped) bytes be uploaded as-is while validating alongside?
+        """
+        if self.reads_pair is not None or not self.is_gzipped or not self.reads.validate:
+            return False
+        if self.reads.quality_bins and self.reads.file_type == 'FASTQ':
+            # (binning is all but certain to change the qualities)
+            return False
+        raw = self.reads.file_obj.fileobj
+        return hasattr(raw, 'fileno') and hasattr(raw, 'name')
+
     def validate(self):
         raise NotImplementedError
 
@@ -356,9 +652,53 @@ class BaseFASTXReader(object):
 
 class FASTXTranslator(BaseFASTXReader):
     def __init__(self, *args, **kwargs):
+        """
+        Validates (and optionally recompresses) FASTX files as they're read.
+
+        `compression_level` is either a fixed gzip level, a (min, max) tuple of levels to
+        adaptively choose between for each block or 'auto' (any level). Adaptive levels are
+        chosen using the network throughput measured by `network_meter` (a `ThroughputMeter`).
+
+        With a `spool` (a `DiskSpool`), the compressed output is also written to a spool file as
+        it's read, and rewinding replays it from there instead of recompressing the input (unless
+        the spool's cap was reached, in which case the output is recomputed as usual).
+        """
+        compression_level = kwargs.pop('compression_level', GZIP_COMPRESSION_LEVEL)
+        network_meter = kwargs.pop('network_meter', None)
+        spool = kwargs.pop('spool', None)
+        self._level_schedule = kwargs.pop('level_schedule', None)
         super(FASTXTranslator, self).__init__(*args, **kwargs)
+        self._saved_args.update({
+            'compression_level': compression_level,
+            'network_meter': network_meter,
+            'spool': spool,
+        })
+
+        self.network_meter = network_meter
+        self._last_read_at = None
+        self._last_read_size = 0
+        # set while making a pass over the file just to find its length
+        self._measuring = False
+
+        self._spool_file = None
+        self._replay_at = None  # our position in the spool file while replaying it
+        if spool is not None and kwargs.get('recompress', True):
+            self._spool_file = spool.open()
+
         if kwargs.get('recompress', True):
-            self.checked_buffer = GzipBuffer()
+            level_controller = None
+            if compression_level == 'auto':
+                compression_level = (1, 9)
+            if isinstance(compression_level, tuple):
+                level_controller = AdaptiveCompressionLevel(*compression_level,
+                                                            network=network_meter)
+                compression_level = level_controller.level
+            self.checked_buffer = GzipBuffer(
+                compresslevel=compression_level,
+                compression_backend=kwargs.get('compression_backend'),
+                level_controller=level_controller,
+                level_schedule=self._level_schedule,
+            )
         else:
             self.checked_buffer = Buffer()
 
@@ -367,12 +707,58 @@ class FASTXTranslator(BaseFASTXReader):
         self.reads_iter = iter(self.reads)
 
     def _set_pair(self, pair):
-        self.reads_pair = FASTXNuclIterator(pair)
+        self.reads_pair = FASTXNuclIterator(pair,
+                                            compression_backend=self.reads.compression_backend,
+                                            normalize=self.reads.normalize,
+                                            quality_bins=self.reads.quality_bins,
+                                            sketch=self.reads.sketch,
+                                            checks=self.reads.check_config)
         self.reads_pair_iter = iter(self.reads_pair)
+        for check in self.reads.checks:
+            if check.action == 'fix' and check.drops_records:
+                raise ValidationError('The {} check can not fix paired files, since removing '
+                                      'reads from one file would unpair them'.format(check.name))
         if self.reads.file_type != self.reads_pair.file_type:
             raise ValidationError('Paired read files are different types (FASTA/FASTQ)')
 
     def read(self, n=-1):
+        # the time between our reads is how long the consumer took to send the last chunk
+        if self.network_meter is not None and self._last_read_at is not None:
+            self.network_meter.record(self._last_read_size, time.time() - self._last_read_at)
+
+        if self._replay_at is not None:
+            bytes_reads = self._replay(n)
+        else:
+            bytes_reads = self._read_checked(n)
+            if self._spool_file is not None:
+                self._spool_file.append(bytes_reads)
+        self.total_written += len(bytes_reads)
+        self._last_read_at = time.time()
+        self._last_read_size = len(bytes_reads)
+        return bytes_reads
+
+    def _replay(self, n):
+        spool_file = self._spool_file
+        bytes_reads = spool_file.read_at(self._replay_at, n)
+        self._replay_at += len(bytes_reads)
+        if self.progress_callback is not None and spool_file.size:
+            processed_size = self.reads.processed_size
+            if self.reads_pair is not None:
+                processed_size += self.reads_pair.processed_size
+            self.progress_callback(self.reads.name,
+                                   processed_size * self._replay_at // spool_file.size,
+                                   validation=False)
+
+        if self._replay_at >= spool_file.size:
+            # we've caught up with the output so far, so carry on from the input
+            self._replay_at = None
+            if n < 0 or len(bytes_reads) < n:
+                more = self._read_checked(n - len(bytes_reads) if n >= 0 else -1)
+                spool_file.append(more)
+                bytes_reads += more
+        return bytes_reads
+
+    def _read_checked(self, n):
         if self.reads_pair is None:
             while len(self.checked_buffer) < n or n < 0:
                 try:
@@ -383,12 +769,12 @@ class FASTXTranslator(BaseFASTXReader):
                 if record is not None:
                     self.checked_buffer.write(record)
                 elif record is None:
-                    self.checked_buffer.close()
+                    self._finish()
                     break
 
                 if self.progress_callback is not None:
                     self.progress_callback(self.reads.name, self.reads.processed_size,
-                                           validation=(not self.reads.validate))
+                                           validation=(self._measuring or not self.reads.validate))
         else:
             while len(self.checked_buffer) < n or n < 0:
                 try:
@@ -404,7 +790,7 @@ class FASTXTranslator(BaseFASTXReader):
                     self.checked_buffer.write(record)
                     self.checked_buffer.write(record_pair)
                 elif record is None and record_pair is None:
-                    self.checked_buffer.close()
+                    self._finish()
                     break
                 else:
                     raise ValidationError("Paired read files do not have the "
@@ -413,11 +799,38 @@ class FASTXTranslator(BaseFASTXReader):
                 if self.progress_callback is not None:
                     bytes_uploaded = self.reads.processed_size + self.reads_pair.processed_size
                     self.progress_callback(self.reads.name, bytes_uploaded,
-                                           validation=(not self.reads.validate))
+                                           validation=(self._measuring or not self.reads.validate))
 
-        bytes_reads = self.checked_buffer.read(n)
-        self.total_written += len(bytes_reads)
-        return bytes_reads
+        return self.checked_buffer.read(n)
+
+    def _finish(self):
+        self.checked_buffer.close()
+        if self.reads.sketch is not None:
+            # every record has been sketched, so any later passes needn't be
+            self.reads.sketch.finish()
+
+    @property
+    def compression_levels(self):
+        """Number of uncompressed bytes compressed at each gzip level (empty if not recompressing).
+        """
+        return getattr(self.checked_buffer, 'level_sizes', {})
+
+    @property
+    def normalized_size(self):
+        """Number of (uncompressed) bytes removed by normalizing the records.
+        """
+        size = self.reads.normalized_size
+        if self.reads_pair is not None:
+            size += self.reads_pair.normalized_size
+        return size
+
+    def binning_savings(self, compression_level=GZIP_COMPRESSION_LEVEL):
+        """Estimated number of compressed bytes saved by binning the quality scores.
+        """
+        savings = self.reads.binning_savings(compression_level)
+        if self.reads_pair is not None:
+            savings += self.reads_pair.binning_savings(compression_level)
+        return savings
 
     @property
     def modified(self):
@@ -432,12 +845,20 @@ class FASTXTranslator(BaseFASTXReader):
         # Properly ensure requests_toolbelt reads the entirety of the
         # file *plus* the remaining buffer object
         if self.total is None:
-            self.reads.validate = False
-            if self.reads_pair:
-                self.reads_pair.validate = False
+            if self._spool_file is not None:
+                # the output of this pass is what will be sent, so it has to be validated
+                self._measuring = True
+            else:
+                self.reads.validate = False
+                if self.reads_pair:
+                    self.reads_pair.validate = False
+            # nothing is being sent during this pass, so don't measure it
+            network_meter, self.network_meter = self.network_meter, None
             while len(self.read(8192)) != 0:
                 pass
             self.total = self.total_written
+            self._measuring = False
+            self.network_meter = network_meter
             self.seek(0)
         return self.total - self.total_written
 
@@ -451,6 +872,17 @@ class FASTXTranslator(BaseFASTXReader):
 
     def seek(self, loc):
         assert loc == 0  # we can only rewind all the way
+        spool_args = {}
+        if self._spool_file is not None:
+            if self._spool_file.active and self._spool_file.size > 0:
+                self._replay_at = 0
+                self.total_written = 0
+                return
+            if not self._spool_file.active:
+                # the spool filled up, so don't bother trying again
+                spool_args['spool'] = None
+            self._spool_file.close()
+
         reads = self.reads.file_obj
         reads.seek(0)
         if self.reads_pair:
@@ -459,10 +891,17 @@ class FASTXTranslator(BaseFASTXReader):
         else:
             pair = None
 
+        # Once we've been all the way through, replay the same compression levels so that every
+        # pass produces exactly `self.total` bytes
+        level_schedule = self._level_schedule
+        if level_schedule is None and self.total is not None:
+            level_schedule = getattr(self.checked_buffer, 'levels_used', None)
+
         # Re-initialize the file. Note that we do *not* need
         # to do any expensive validation or filename checks
         # as those have already been done before calling seek(0)
-        self.__init__(reads, pair, total=self.total, **self._saved_args)
+        saved_args = dict(self._saved_args, **spool_args)
+        self.__init__(reads, pair, total=self.total, level_schedule=level_schedule, **saved_args)
 
     def write(self, b):
         raise NotImplementedError
@@ -472,6 +911,18 @@ class FASTXTranslator(BaseFASTXReader):
         self.reads.close()
         if self.reads_pair is not None:
             self.reads_pair.close()
+        if self._spool_file is not None:
+            self._spool_file.close()
+
+    def discard(self):
+        """Closes the files (and frees any spool file) without checking that they were read to the
+        end, e.g. once their upload has failed.
+        """
+        self.reads.file_obj.close()
+        if self.reads_pair is not None:
+            self.reads_pair.file_obj.close()
+        if self._spool_file is not None:
+            self._spool_file.close()
 
 
 class FASTXReader(BaseFASTXReader):
@@ -508,3 +959,86 @@ class FASTXReader(BaseFASTXReader):
 
     def close(self):
         self.reads.close()
+
+    def discard(self):
+        self.close()
+
+
+class FASTXPassthroughReader(BaseFASTXReader):
+    def __init__(self, *args, **kwargs):
+        """Uploads the raw bytes of an already gzipped file while validating its decompressed
+        contents alongside (a "tee"). The raw bytes are served straight out of an mmap of the
+        file and the decompressed records are parsed from a second handle, staying just ahead of
+        what has been handed out. Any invalid record raises before the rest of the file is read;
+        any record that would need to be modified raises `PassthroughAborted` so that the caller
+        can fall back to a `FASTXTranslator`.
+        """
+        super(FASTXPassthroughReader, self).__init__(*args, **kwargs)
+
+    def _set_read(self, file_obj, **kwargs):
+        self.raw = file_obj
+        self.name = file_obj.name
+        self.total_size = os.fstat(file_obj.fileno()).st_size
+        if self.total_size < 70:
+            raise ValidationError('{} is too small to be analyzed: {} bytes'.format(
+                                  self.name, self.total_size))
+        self._mmap = mmap.mmap(file_obj.fileno(), 0, access=mmap.ACCESS_READ)
+        self.position = 0
+
+        # the validator gets its own file handle so it never moves the raw stream
+        kwargs['check_filename'] = False
+        self.reads = FASTXNuclIterator(open(self.name, 'rb'), **kwargs)
+        self.reads_iter = iter(self.reads)
+
+    def _validate_to(self, offset):
+        at_eof = offset >= self.total_size
+        while at_eof or self.reads.processed_size < offset:
+            try:
+                next(self.reads_iter)
+            except StopIteration:
+                break
+            if self.reads.modified:
+                raise PassthroughAborted('{} must be modified to upload'.format(self.name))
+
+        if at_eof and self.reads.bytes_left != 0:
+            raise ValidationError('Failed to properly read file: {}/{} bytes unread.'.format(
+                self.reads.bytes_left, self.total_size))
+
+    def read(self, n=-1):
+        if n < 0:
+            n = self.total_size - self.position
+        bytes_read = self._mmap[self.position:self.position + n]
+        self.position += len(bytes_read)
+
+        # validate (at least) everything we're handing out *before* it's sent
+        self._validate_to(self.position)
+
+        if self.progress_callback is not None:
+            self.progress_callback(self.name, self.position, validation=False)
+        return bytes_read
+
+    @property
+    def modified(self):
+        return False
+
+    @property
+    def len(self):
+        return self.total_size - self.position
+
+    def __len__(self):
+        return self.len
+
+    def seek(self, loc):
+        assert loc == 0  # we can only rewind all the way
+        self.release()
+        self.__init__(self.raw, **self._saved_args)
+
+    def release(self):
+        """Close our mmap and validator handle, but leave the raw file open.
+        """
+        self.reads.file_obj.close()
+        self._mmap.close()
+
+    def close(self):
+        self.release()
+        self.raw.close()
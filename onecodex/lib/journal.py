@@ -0,0 +1,189 @@
+"""
+A checkpoint journal recording the progress of each file in a batch upload, so an interrupted
+or partially failed batch can be resumed (or shared between several upload processes)
+"""
+from contextlib import contextmanager
+import os
+import socket
+import sqlite3
+from threading import Lock
+import time
+
+
+def journal_key(filename):
+    """
+    The journal key for a file path, an (R1, R2) tuple of paths or a list of lanes (of either).
+    """
+    if isinstance(filename, list):
+        return '\n'.join(journal_key(f) for f in filename)
+    if isinstance(filename, tuple):
+        return '\t'.join(os.path.abspath(f) for f in filename)
+    return os.path.abspath(filename)
+
+
+def _key_filename(key):
+    if '\n' in key:
+        return [_key_filename(k) for k in key.split('\n')]
+    return tuple(key.split('\t')) if '\t' in key else key
+
+
+class UploadJournal(object):
+    """
+    Persists the state of each file of a batch upload (and its sample ID once uploaded) in a
+    SQLite database. Files move from pending through validating and uploading to confirmed (or
+    failed); re-running a batch against the same journal skips the confirmed files.
+
+    Several processes (e.g. on different nodes sharing a filesystem with working locks) can
+    also work through one batch by `claim`ing files from the journal. A claim is a lease held
+    for `lease` seconds that the owner keeps `renew`ing while it uploads; if the owner crashes
+    the lease expires and the file is handed to another process. Each file is claimed at most
+    `max_attempts` times if it keeps failing.
+
+    The journal is safe to share between upload threads.
+    """
+    PENDING = 'pending'
+    VALIDATING = 'validating'
+    UPLOADING = 'uploading'
+    CONFIRMED = 'confirmed'
+    FAILED = 'failed'
+
+    def __init__(self, path, owner=None, lease=300., max_attempts=3, timeout=60.):
+        self.path = path
+        self.owner = owner if owner is not None else '{}:{}'.format(socket.gethostname(),
+                                                                    os.getpid())
+        self.lease = lease
+        self.max_attempts = max_attempts
+        self._lock = Lock()
+        # transactions are managed explicitly (see _transaction)
+        self._db = sqlite3.connect(path, timeout=timeout, check_same_thread=False,
+                                   isolation_level=None)
+        with self._transaction() as db:
+            db.execute(
+                'CREATE TABLE IF NOT EXISTS files (key TEXT PRIMARY KEY, state TEXT NOT NULL, '
+                'sample_id TEXT, error TEXT, annotated INTEGER NOT NULL DEFAULT 0, updated REAL)'
+            )
+            columns = {row[1] for row in db.execute('PRAGMA table_info(files)')}
+            for column, definition in [('owner', 'TEXT'), ('lease_expires', 'REAL'),
+                                       ('attempts', 'INTEGER NOT NULL DEFAULT 0'),
+                                       ('sketch', 'BLOB')]:
+                if column not in columns:
+                    db.execute('ALTER TABLE files ADD COLUMN {} {}'.format(column, definition))
+
+    @contextmanager
+    def _transaction(self):
+        # take the write lock up front so concurrent claims can't interleave
+        with self._lock:
+            self._db.execute('BEGIN IMMEDIATE')
+            try:
+                yield self._db
+            except Exception:
+                self._db.execute('ROLLBACK')
+                raise
+            self._db.execute('COMMIT')
+
+    def add(self, filename):
+        """Start tracking `filename` (if it isn't already).
+        """
+        with self._transaction() as db:
+            db.execute('INSERT OR IGNORE INTO files (key, state, updated) VALUES (?, ?, ?)',
+                       (journal_key(filename), self.PENDING, time.time()))
+
+    def set_state(self, filename, state, sample_id=None, error=None):
+        # finishing a file (successfully or not) gives up any lease on it
+        finished = state in (self.CONFIRMED, self.FAILED)
+        with self._transaction() as db:
+            db.execute(
+                'UPDATE files SET state = ?, sample_id = COALESCE(?, sample_id), error = ?, '
+                'updated = ?, owner = CASE WHEN ? THEN NULL ELSE owner END WHERE key = ?',
+                (state, sample_id, error, time.time(), finished, journal_key(filename))
+            )
+
+    def get(self, filename):
+        """
+        Returns a dict of the `state`, `sample_id`, `error` and whether metadata and tags have
+        been applied (`annotated`) for `filename`, or None if it isn't being tracked.
+        """
+        with self._lock:
+            row = self._db.execute('SELECT state, sample_id, error, annotated FROM files '
+                                   'WHERE key = ?', (journal_key(filename),)).fetchone()
+        if row is None:
+            return None
+        return {'state': row[0], 'sample_id': row[1], 'error': row[2], 'annotated': bool(row[3])}
+
+    def state(self, filename):
+        entry = self.get(filename)
+        return None if entry is None else entry['state']
+
+    def set_annotated(self, filename):
+        with self._transaction() as db:
+            db.execute('UPDATE files SET annotated = 1 WHERE key = ?', (journal_key(filename),))
+
+    def set_sketch(self, filename, sketch):
+        """Stores a (serialized) k-mer sketch of `filename`; see `KmerSketch`.
+        """
+        with self._transaction() as db:
+            db.execute('UPDATE files SET sketch = ? WHERE key = ?',
+                       (sqlite3.Binary(sketch), journal_key(filename)))
+
+    def sketches(self):
+        """
+        Returns a list of (filename, sample ID, serialized sketch) tuples of the uploaded files
+        that were sketched.
+        """
+        with self._lock:
+            rows = self._db.execute('SELECT key, sample_id, sketch FROM files WHERE state = ? '
+                                    'AND sketch IS NOT NULL', (self.CONFIRMED,)).fetchall()
+        return [(_key_filename(key), sample_id, bytes(sketch)) for key, sample_id, sketch in rows]
+
+    def counts(self):
+        """Returns the number of files in each state.
+        """
+        with self._lock:
+            return dict(self._db.execute('SELECT state, COUNT(*) FROM files GROUP BY state'))
+
+    def claim(self):
+        """
+        Leases the next unfinished file that isn't leased by anyone else (or whose lease has
+        expired) to this journal's owner and returns it, or returns None if there isn't one.
+        """
+        now = time.time()
+        with self._transaction() as db:
+            row = db.execute(
+                'SELECT key FROM files WHERE state != ? AND attempts < ? AND '
+                '(owner IS NULL OR lease_expires < ?) ORDER BY rowid LIMIT 1',
+                (self.CONFIRMED, self.max_attempts, now)
+            ).fetchone()
+            if row is None:
+                return None
+            db.execute('UPDATE files SET owner = ?, lease_expires = ?, attempts = attempts + 1, '
+                       'updated = ? WHERE key = ?', (self.owner, now + self.lease, now, row[0]))
+        return _key_filename(row[0])
+
+    def renew(self):
+        """Extends the leases on all of the files this journal's owner has claimed.
+        """
+        with self._transaction() as db:
+            db.execute('UPDATE files SET lease_expires = ? WHERE owner = ?',
+                       (time.time() + self.lease, self.owner))
+
+    def outstanding(self):
+        """
+        Returns the number of files that could still be uploaded: unfinished ones being worked
+        on by someone or waiting to be claimed.
+        """
+        with self._lock:
+            return self._db.execute(
+                'SELECT COUNT(*) FROM files WHERE state != ? AND '
+                '(lease_expires >= ? AND owner IS NOT NULL OR attempts < ?)',
+                (self.CONFIRMED, time.time(), self.max_attempts)
+            ).fetchone()[0]
+
+    def reset_attempts(self):
+        """Allows failed files that aren't being worked on to be claimed again.
+        """
+        with self._transaction() as db:
+            db.execute('UPDATE files SET attempts = 0 WHERE state = ? AND owner IS NULL',
+                       (self.FAILED,))
+
+    def close(self):
+        self._db.close()
@@ -0,0 +1,61 @@
+"""
+Reading manifests (CSV/TSV files listing the files of a batch upload)
+"""
+import csv
+import os
+import re
+
+from onecodex.exceptions import OneCodexException
+
+
+class ManifestEntry(object):
+    """
+    One sample in a manifest: its file (or (R1, R2) tuple of files), plus any metadata fields
+    and tags to apply to the sample once it's uploaded.
+    """
+    def __init__(self, files, metadata=None, tags=None):
+        self.files = files
+        self.metadata = metadata or {}
+        self.tags = tags or []
+
+    def __repr__(self):
+        return '<{} {}>'.format(self.__class__.__name__, self.files)
+
+
+def read_manifest(path):
+    """
+    Parses a manifest into a list of `ManifestEntry`s.
+
+    The manifest must have a header row with a `file` column and may have a `pair` column (the
+    R2 file to interleave with `file`) and a `tags` column (tag names separated by semicolons or
+    commas). Any other columns are sample metadata fields; blank cells are skipped. Files are
+    relative to the manifest's directory. TSVs are detected by their extension or header.
+    """
+    base_dir = os.path.dirname(os.path.abspath(path))
+    with open(path) as f:
+        header = f.readline()
+        f.seek(0)
+        delimiter = '\t' if path.endswith(('.tsv', '.txt')) or '\t' in header else ','
+        rows = list(csv.DictReader(f, delimiter=delimiter))
+
+    if not rows or 'file' not in rows[0]:
+        raise OneCodexException('Manifest {} must have a header with a "file" column'.format(path))
+
+    entries = []
+    for line_no, row in enumerate(rows, 2):
+        row = {k.strip(): (v or '').strip() for k, v in row.items() if k is not None}
+        if not row['file']:
+            raise OneCodexException('Missing file on line {} of {}'.format(line_no, path))
+        files = os.path.join(base_dir, row.pop('file'))
+        pair = row.pop('pair', '')
+        if pair:
+            files = (files, os.path.join(base_dir, pair))
+        for f in files if isinstance(files, tuple) else [files]:
+            if not os.path.exists(f):
+                raise OneCodexException('File {} on line {} of {} does not exist'.format(
+                    f, line_no, path
+                ))
+        tags = [t.strip() for t in re.split('[;,]', row.pop('tags', '')) if t.strip()]
+        metadata = {k: v for k, v in row.items() if v != ''}
+        entries.append(ManifestEntry(files, metadata=metadata, tags=tags))
+    return entries
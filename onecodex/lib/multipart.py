@@ -0,0 +1,243 @@
+"""
+Parallel S3 multipart uploads, compressing and sending several parts of a file at once
+"""
+from __future__ import division
+from io import BytesIO
+from math import ceil
+import sys
+from threading import Condition, Lock, Thread
+import time
+
+import six
+from six.moves.queue import Queue
+
+from onecodex.lib.compression import AdaptiveCompressionLevel, GzipWriter, get_backend
+from onecodex.lib.throttle import ThrottledReader
+
+
+S3_MAX_PARTS = 10000
+S3_MIN_PART_SIZE = 5 * 1024 * 1024
+S3_MAX_PART_SIZE = 5 * 1024 * 1024 * 1024
+MIN_PART_SIZE = 8 * 1024 * 1024
+# uncompressed bytes compressed at a time (by each compression thread)
+BLOCK_SIZE = 8 * 1024 * 1024
+
+
+def plan_part_size(total_size=None, max_parts=S3_MAX_PARTS):
+    """
+    Chooses the (minimum) size of the parts to upload a file of about `total_size` bytes in.
+
+    The uploaded size isn't known in advance, so this assumes the upload is up to 1.5 times the
+    size of the input (e.g. a gzipped file recompressed at a faster level) and leaves headroom
+    under the part limit. Parts also grow as they're numbered (see `part_size_for`), so even a
+    badly underestimated (or unknown) size stays within S3's limits.
+    """
+    if total_size is None:
+        return MIN_PART_SIZE
+    part_size = int(ceil(1.5 * total_size / (0.9 * max_parts)))
+    return min(max(part_size, MIN_PART_SIZE), S3_MAX_PART_SIZE)
+
+
+def part_size_for(part_number, base_size, max_parts=S3_MAX_PARTS):
+    """
+    The minimum size of part `part_number` (1-based): `base_size`, doubling every tenth of the
+    part limit (so 10,000 parts hold over 1,000 times as much as at a fixed size).
+    """
+    doublings = (part_number - 1) // (max_parts // 10)
+    return min(base_size * 2 ** doublings, S3_MAX_PART_SIZE)
+
+
+class ParallelMultipartUpload(object):
+    """
+    Uploads a file-like object to S3 as a multipart upload with several parts in flight.
+
+    The file is read (and so validated, if it's a `FASTXTranslator`) block by block in the calling
+    thread. With `compress`, each block is gzipped as an independent gzip member in a pool of
+    threads; concatenated gzip members are a valid gzip file, so blocks can be compressed in any
+    order and then strung together. Consecutive blocks are grouped into parts of at least the
+    planned part size and sent by another pool of threads. At most a couple of blocks and parts
+    per thread are held in memory at once.
+
+    Parameters
+    ----------
+    client : boto3 S3 client
+    bucket, key : string
+    threads : int, optional
+        Number of parts compressed and sent at once.
+    total_size : int, optional
+        Approximate size of the file, used to plan the part size.
+    compress : bool, optional
+        Gzip each block (otherwise blocks are sent as read).
+    compression_level : int, tuple or 'auto', optional
+        A fixed level, or a (min, max) range (or 'auto') to adapt the level per block.
+    network_meter : ThroughputMeter, optional
+        Measures the upload throughput, for adapting the compression level.
+    limiter : BandwidthLimiter, optional
+    extra_args : dict, optional
+        Extra arguments for `create_multipart_upload` (e.g. encryption settings).
+    """
+    def __init__(self, client, bucket, key, threads=4, total_size=None, compress=True,
+                 compression_level=5, compression_backend=None, network_meter=None, limiter=None,
+                 extra_args=None, block_size=BLOCK_SIZE):
+        self.client = client
+        self.bucket = bucket
+        self.key = key
+        self.threads = max(1, threads)
+        self.base_part_size = plan_part_size(total_size)
+        self.compress = compress
+        self.backend = get_backend(compression_backend)
+        self.network_meter = network_meter
+        self.limiter = limiter
+        self.extra_args = extra_args or {}
+        self.block_size = block_size
+
+        self.level_controller = None
+        if compression_level == 'auto':
+            compression_level = (1, 9)
+        if isinstance(compression_level, tuple):
+            self.level_controller = AdaptiveCompressionLevel(*compression_level,
+                                                             network=network_meter)
+            compression_level = self.level_controller.level
+        self.compression_level = compression_level
+
+        self.upload_id = None
+        self.parts = {}
+        self.level_sizes = {}
+        self.bytes_sent = 0
+        self._lock = Lock()
+        self._errors = []
+
+    def _compress(self, data):
+        if self.level_controller is not None:
+            with self._lock:
+                level = self.level_controller.next_level()
+        else:
+            level = self.compression_level
+        start = time.time()
+        out = BytesIO()
+        writer = GzipWriter(out, level, backend=self.backend)
+        writer.write(data)
+        writer.close()
+        compressed = out.getvalue()
+        with self._lock:
+            if self.level_controller is not None:
+                self.level_controller.record_compression(level, len(data), len(compressed),
+                                                         time.time() - start)
+            self.level_sizes[level] = self.level_sizes.get(level, 0) + len(data)
+        return compressed
+
+    def _upload_part(self, part_number, data):
+        body = data
+        if self.limiter is not None:
+            # (throttled as it's read to be sent; all of the parts of a file count as one reader,
+            # so sending them in parallel doesn't take more than the file's fair share)
+            body = ThrottledReader(BytesIO(data), self.limiter, key=self)
+        start = time.time()
+        response = self.client.upload_part(Bucket=self.bucket, Key=self.key,
+                                           UploadId=self.upload_id, PartNumber=part_number,
+                                           Body=body)
+        if self.network_meter is not None:
+            self.network_meter.record(len(data), time.time() - start)
+        with self._lock:
+            self.parts[part_number] = response['ETag']
+            self.bytes_sent += len(data)
+
+    def _run_worker(self, tasks):
+        while True:
+            task = tasks.get()
+            if task is None:
+                return
+            func, args = task
+            try:
+                func(*args)
+            except Exception:
+                with self._lock:
+                    self._errors.append(sys.exc_info())
+
+    def _check_errors(self):
+        if self._errors:
+            six.reraise(*self._errors[0])
+
+    def upload(self, file_obj):
+        """
+        Uploads `file_obj`, returning the number of bytes sent. If anything fails, the multipart
+        upload is aborted and the error re-raised.
+        """
+        response = self.client.create_multipart_upload(Bucket=self.bucket, Key=self.key,
+                                                       **self.extra_args)
+        self.upload_id = response['UploadId']
+        try:
+            self._upload(file_obj)
+        except BaseException:
+            self.client.abort_multipart_upload(Bucket=self.bucket, Key=self.key,
+                                               UploadId=self.upload_id)
+            raise
+
+        parts = [{'ETag': self.parts[n], 'PartNumber': n} for n in sorted(self.parts)]
+        self.client.complete_multipart_upload(Bucket=self.bucket, Key=self.key,
+                                              UploadId=self.upload_id,
+                                              MultipartUpload={'Parts': parts})
+        return self.bytes_sent
+
+    def _compress_block(self, block_number, data):
+        data = self._compress(data) if self.compress else data
+        with self._blocks_ready:
+            self._blocks[block_number] = data
+            self._blocks_ready.notify_all()
+
+    def _take_blocks(self, until, final=False):
+        """
+        Groups the compressed blocks (in order) into parts and queues them for uploading, up to
+        block number `until`. With `final`, the remainder is sent as the last part.
+        """
+        while self._next_block < until:
+            with self._blocks_ready:
+                while self._next_block not in self._blocks and not self._errors:
+                    self._blocks_ready.wait(1)
+                self._check_errors()
+                self._part.append(self._blocks.pop(self._next_block))
+            self._next_block += 1
+
+            size = sum(len(data) for data in self._part)
+            last = final and self._next_block == until
+            if size >= part_size_for(self._part_number, self.base_part_size) or last:
+                if size > 0 or self._part_number == 1:
+                    self._upload_tasks.put((self._upload_part,
+                                            (self._part_number, b''.join(self._part))))
+                    self._part_number += 1
+                self._part = []
+
+    def _upload(self, file_obj):
+        # bounded queues (plus the one task each thread is working on) bound the memory used
+        compress_tasks, self._upload_tasks = Queue(self.threads), Queue(self.threads)
+        workers = [Thread(target=self._run_worker, args=(queue,))
+                   for queue in (compress_tasks, self._upload_tasks) for _ in range(self.threads)]
+        for worker in workers:
+            worker.daemon = True
+            worker.start()
+
+        self._blocks = {}  # compressed blocks (by number) waiting to be grouped into parts
+        self._blocks_ready = Condition(self._lock)
+        self._part, self._part_number, self._next_block = [], 1, 0
+        try:
+            n_blocks = 0
+            while True:
+                self._check_errors()
+                data = file_obj.read(self.block_size)
+                if not data and n_blocks > 0:
+                    break
+                compress_tasks.put((self._compress_block, (n_blocks, data)))
+                n_blocks += 1
+                if not data:
+                    break
+                # keep at most a couple of blocks per thread in memory
+                if n_blocks - self._next_block > 2 * self.threads:
+                    self._take_blocks(n_blocks - self.threads)
+            self._take_blocks(n_blocks, final=True)
+        finally:
+            for _ in range(self.threads):
+                compress_tasks.put(None)
+                self._upload_tasks.put(None)
+            for worker in workers:
+                worker.join()
+        self._check_errors()
@@ -0,0 +1,186 @@
+"""
+A cache of the API's schema on disk, which is safe to share between many processes
+"""
+from contextlib import contextmanager
+import hashlib
+import logging
+import marshal
+import os
+import sys
+import tempfile
+import time
+
+import six
+
+log = logging.getLogger(__name__)
+
+# bumped whenever the layout of a snapshot changes
+FORMAT_VERSION = 1
+# snapshots are revalidated against the server once they're this old (in seconds)
+MAX_AGE = 24 * 60 * 60
+# locks older than this (in seconds) were left behind by a process that died holding them
+LOCK_TIMEOUT = 60
+# how long (in seconds) an exiting process waits for a revalidation in the background to finish
+REVALIDATE_AT_EXIT_TIMEOUT = 5
+
+
+def default_cache_dir():
+    """
+    ONE_CODEX_SCHEMA_CACHE, or a directory in the user's cache directory (~/.cache by default).
+    """
+    if os.environ.get('ONE_CODEX_SCHEMA_CACHE'):
+        return os.environ['ONE_CODEX_SCHEMA_CACHE']
+    cache_home = os.environ.get('XDG_CACHE_HOME') or os.path.join(os.path.expanduser('~'),
+                                                                  '.cache')
+    return os.path.join(cache_home, 'onecodex', 'schema')
+
+
+def find_refs(schema, path=()):
+    """
+    Returns the paths (lists of keys and indices) to the {"$ref": ...} objects in a JSON schema.
+    """
+    if isinstance(schema, dict):
+        if len(schema) == 1 and isinstance(schema.get('$ref'), six.string_types):
+            return [list(path)]
+        items = schema.items()
+    elif isinstance(schema, list):
+        items = enumerate(schema)
+    else:
+        return []
+    paths = []
+    for key, value in items:
+        paths.extend(find_refs(value, path + (key,)))
+    return paths
+
+
+def resolve_refs(schema, ref_paths, ref_resolver):
+    """
+    Resolves the references at `ref_paths` (see `find_refs`) in `schema` in place, just as
+    potion_client's `schema_resolve_refs` would (but without walking through the whole schema).
+    """
+    for path in ref_paths:
+        if not path:
+            return ref_resolver(schema['$ref'])
+        parent = schema
+        for key in path[:-1]:
+            parent = parent[key]
+        reference = parent[path[-1]]['$ref']
+        # (self-references are resolved to the whole schema)
+        parent[path[-1]] = schema if reference.startswith('#') else ref_resolver(reference)
+    return schema
+
+
+def atomic_write(path, data, mode='wb'):
+    """
+    Writes `data` to a temporary file next to `path` and then renames it over `path`, so that
+    readers only ever see the old or the new contents.
+    """
+    directory = os.path.dirname(path) or '.'
+    fd, temp_path = tempfile.mkstemp(dir=directory, prefix='.' + os.path.basename(path) + '.')
+    try:
+        with os.fdopen(fd, mode) as f:
+            f.write(data)
+        if hasattr(os, 'replace'):
+            os.replace(temp_path, path)
+        else:  # Py2 (where rename already replaces files, except on Windows)
+            os.rename(temp_path, path)
+    except Exception:
+        os.remove(temp_path)
+        raise
+
+
+class SchemaCache(object):
+    """
+    Keeps a snapshot of the (undecoded) schemas of each API in `directory`, keyed by the URL of
+    its schema, along with the ETag they were served with and where the references in them are
+    (so they can be resolved without walking through every schema).
+
+    Snapshots are written with `marshal`, which loads much faster than JSON, and only by renaming
+    a finished file into place, so any number of processes can read and write them at once. Any
+    snapshot that can't be read (e.g. written by another version of Python) is treated as missing,
+    as are any errors writing to the cache.
+    """
+    def __init__(self, directory=None, max_age=MAX_AGE):
+        self.directory = directory if directory is not None else default_cache_dir()
+        self.max_age = max_age
+
+    def path(self, schema_url):
+        key = hashlib.sha1(schema_url.encode('utf-8')).hexdigest()
+        # (marshal's format depends on the version of Python)
+        filename = '{}.py{}{}.snapshot'.format(key, *sys.version_info[:2])
+        return os.path.join(self.directory, filename)
+
+    def load(self, schema_url):
+        """
+        Returns the snapshot of the schemas at `schema_url` (a dict of their "schemas" and "refs"
+        by URI, "etag" and "fetched_at" time), or None.
+        """
+        try:
+            with open(self.path(schema_url), 'rb') as f:
+                # (much faster than unmarshalling straight from the file)
+                entry = marshal.loads(f.read())
+        except (IOError, OSError, EOFError, ValueError, TypeError):
+            return None
+        if (not isinstance(entry, dict) or entry.get('format') != FORMAT_VERSION or
+                entry.get('url') != schema_url):
+            return None
+        return entry
+
+    def save(self, schema_url, schemas, etag=None):
+        """
+        Saves `schemas` (a dict of the JSON of each schema by URI) as the snapshot of
+        `schema_url`, returning it (or None if it couldn't be written).
+        """
+        entry = {
+            'format': FORMAT_VERSION,
+            'url': schema_url,
+            'etag': etag,
+            'fetched_at': time.time(),
+            'schemas': schemas,
+            'refs': {uri: find_refs(schema) for uri, schema in schemas.items()},
+        }
+        try:
+            if not os.path.isdir(self.directory):
+                os.makedirs(self.directory)
+            atomic_write(self.path(schema_url), marshal.dumps(entry))
+        except (IOError, OSError, ValueError) as e:
+            log.debug('Failed to write the schema cache: %s', e)
+            return None
+        return entry
+
+    def is_stale(self, entry):
+        return time.time() - entry['fetched_at'] > self.max_age
+
+    @contextmanager
+    def lock(self, schema_url):
+        """
+        Tries to take the lock on the snapshot of `schema_url` (without waiting), yielding
+        whether it was taken. A lock left behind by a process that died holding it is taken over.
+        """
+        lock_path = self.path(schema_url) + '.lock'
+        if not self._take_lock(lock_path):
+            yield False
+            return
+
+        try:
+            yield True
+        finally:
+            try:
+                os.remove(lock_path)
+            except OSError:
+                pass
+
+    def _take_lock(self, lock_path):
+        for _ in range(2):
+            try:
+                os.close(os.open(lock_path, os.O_CREAT | os.O_EXCL | os.O_WRONLY))
+                return True
+            except OSError:
+                try:
+                    if time.time() - os.path.getmtime(lock_path) <= LOCK_TIMEOUT:
+                        return False
+                    # (then try again; if other processes are breaking it too, only one gets it)
+                    os.remove(lock_path)
+                except OSError:
+                    pass
+        return False
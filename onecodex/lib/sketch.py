@@ -0,0 +1,223 @@
+"""
+FracMinHash sketches of the k-mers in sequencing files, for spotting duplicate (or near-duplicate)
+uploads locally, without waiting for them to be analyzed
+"""
+from __future__ import division
+import struct
+
+try:
+    import numpy as np
+except ImportError:  # pragma: no cover
+    np = None
+
+from onecodex.lib.inline_validator import FASTXNuclIterator
+
+
+K = 21
+SCALE = 1000
+# at most this many hashes are kept; past that, the sketch is thinned (by lowering its threshold)
+MAX_HASHES = 100000
+# bytes of sequence gathered before hashing them all at once
+BATCH_SIZE = 1024 * 1024
+MASK_64 = 2 ** 64 - 1
+SKETCH_MAGIC = b'OCK1'
+
+# 2-bit codes for each base (in either case), and 4 for anything else
+_BASE_CODES = bytearray([4] * 256)
+for _i, _base in enumerate(bytearray(b'ACGT')):
+    _BASE_CODES[_base] = _BASE_CODES[_base + 32] = _i
+
+
+def _mix64(z):
+    # splitmix64's finalizer, so that hashes are spread evenly whatever the k-mers look like
+    z = ((z ^ (z >> 30)) * 0xbf58476d1ce4e5b9) & MASK_64
+    z = ((z ^ (z >> 27)) * 0x94d049bb133111eb) & MASK_64
+    return z ^ (z >> 31)
+
+
+# (only defined with numpy, which is an optional extra)
+if np is not None:
+    _BASE_CODE_ARRAY = np.frombuffer(bytes(_BASE_CODES), dtype=np.uint8)
+
+    def _hash_kmers_numpy(seq, k, threshold):
+        codes = _BASE_CODE_ARRAY[np.frombuffer(seq, dtype=np.uint8)]
+        n_kmers = len(codes) - k + 1
+        if n_kmers <= 0:
+            return []
+        # k-mers overlapping anything other than ACGT are skipped
+        n_invalid = np.concatenate(([0], np.cumsum(codes > 3)))
+        valid = n_invalid[k:] == n_invalid[:-k]
+
+        bases = (codes & 3).astype(np.uint64)
+        forward = np.zeros(n_kmers, dtype=np.uint64)
+        reverse = np.zeros(n_kmers, dtype=np.uint64)
+        two, three = np.uint64(2), np.uint64(3)
+        for i in range(k):
+            window = bases[i:i + n_kmers]
+            forward = (forward << two) | window
+            reverse |= (three - window) << np.uint64(2 * i)
+        z = np.minimum(forward, reverse)[valid]
+
+        z ^= z >> np.uint64(30)
+        z *= np.uint64(0xbf58476d1ce4e5b9)
+        z ^= z >> np.uint64(27)
+        z *= np.uint64(0x94d049bb133111eb)
+        z ^= z >> np.uint64(31)
+        return z[z < np.uint64(threshold)].tolist()
+else:  # pragma: no cover
+    _hash_kmers_numpy = None
+
+
+def _hash_kmers_python(seq, k, threshold):
+    # (much slower, but gives the same hashes as the numpy version)
+    mask = (1 << 2 * k) - 1
+    shift = 2 * (k - 1)
+    forward = reverse = n_valid = 0
+    hashes = []
+    for base in bytearray(seq):
+        code = _BASE_CODES[base]
+        if code > 3:
+            n_valid = 0
+            continue
+        forward = ((forward << 2) | code) & mask
+        reverse = (reverse >> 2) | ((3 - code) << shift)
+        n_valid += 1
+        if n_valid >= k:
+            h = _mix64(min(forward, reverse))
+            if h < threshold:
+                hashes.append(h)
+    return hashes
+
+
+class KmerSketch(object):
+    """
+    A FracMinHash sketch: the hashes of a file's canonical k-mers that fall below `threshold`
+    (1/`scale` of the hash space), which estimate how similar two files are from a small,
+    fixed fraction of their k-mers.
+
+    Sequences are gathered into batches and hashed a batch at a time (vectorized with numpy, if
+    it's installed). To bound memory, at most `max_hashes` hashes are kept; past that, the
+    threshold is lowered to keep just the smallest. Sketches of different thresholds are
+    compared below the lower of the two.
+    """
+    def __init__(self, k=K, scale=SCALE, max_hashes=MAX_HASHES, threshold=None, hashes=()):
+        if not 0 < k <= 32:
+            raise ValueError('k must be between 1 and 32')
+        self.k = k
+        self.max_hashes = max_hashes
+        self.threshold = threshold if threshold is not None else MASK_64 // scale
+        self.hashes = set(hashes)
+        # set once every record has been added, so that later passes over the file can skip it
+        self.complete = False
+        self._batch = []
+        self._batch_size = 0
+
+    def __len__(self):
+        return len(self.hashes)
+
+    def __repr__(self):
+        return '<{} k={} {} hashes>'.format(self.__class__.__name__, self.k, len(self.hashes))
+
+    def add_sequence(self, seq):
+        if self.complete:
+            return
+        self._batch.append(seq)
+        self._batch_size += len(seq)
+        if self._batch_size >= BATCH_SIZE:
+            self.flush()
+
+    def flush(self):
+        """Hashes any sequences still waiting in the batch.
+        """
+        if not self._batch:
+            return
+        # (the N's keep k-mers from spanning two sequences)
+        seq = b'N'.join(self._batch)
+        self._batch, self._batch_size = [], 0
+        hash_kmers = _hash_kmers_numpy or _hash_kmers_python
+        self.hashes.update(hash_kmers(seq, self.k, self.threshold))
+        if len(self.hashes) > self.max_hashes:
+            kept = sorted(self.hashes)[:self.max_hashes]
+            self.threshold = kept[-1] + 1
+            self.hashes = set(kept)
+
+    def finish(self):
+        self.flush()
+        self.complete = True
+
+    def _common(self, other):
+        if self.k != other.k:
+            raise ValueError('Sketches with different k-mer sizes cannot be compared')
+        threshold = min(self.threshold, other.threshold)
+        mine = {h for h in self.hashes if h < threshold}
+        theirs = {h for h in other.hashes if h < threshold}
+        return mine, theirs
+
+    def jaccard(self, other):
+        """Estimated fraction of the two files' k-mers that they share.
+        """
+        mine, theirs = self._common(other)
+        union = len(mine | theirs)
+        return len(mine & theirs) / union if union else 0.
+
+    def containment(self, other):
+        """Estimated fraction of this file's k-mers that are also in `other`.
+        """
+        mine, theirs = self._common(other)
+        return len(mine & theirs) / len(mine) if mine else 0.
+
+    def to_bytes(self):
+        self.flush()
+        hashes = sorted(self.hashes)
+        return (struct.pack('<4sBQI', SKETCH_MAGIC, self.k, self.threshold, len(hashes)) +
+                struct.pack('<{}Q'.format(len(hashes)), *hashes))
+
+    @classmethod
+    def from_bytes(cls, data):
+        header = struct.calcsize('<4sBQI')
+        magic, k, threshold, n_hashes = struct.unpack('<4sBQI', data[:header])
+        if magic != SKETCH_MAGIC:
+            raise ValueError('Not a k-mer sketch')
+        hashes = struct.unpack('<{}Q'.format(n_hashes), data[header:])
+        sketch = cls(k=k, threshold=threshold, hashes=hashes)
+        sketch.complete = True
+        return sketch
+
+
+def sketch_file(filename, k=K, scale=SCALE):
+    """
+    Sketches a FASTA/FASTQ file, an (R1, R2) tuple of files or a list of the lanes of a library
+    (without validating them).
+    """
+    sketch = KmerSketch(k=k, scale=scale)
+    files = filename if isinstance(filename, (tuple, list)) else [filename]
+    for f in files:
+        if isinstance(f, tuple):
+            sketch_files = [open(path, 'rb') for path in f]
+        else:
+            sketch_files = [open(f, 'rb')]
+        for file_obj in sketch_files:
+            reads = FASTXNuclIterator(file_obj, check_filename=False, validate=False,
+                                      sketch=sketch)
+            for _ in reads:
+                pass
+            reads.file_obj.close()
+    sketch.finish()
+    return sketch
+
+
+def find_similar(sketch, journal, min_containment=0.5):
+    """
+    Compares `sketch` with those of the files uploaded through `journal`, returning a list of
+    (filename, sample ID, containment, Jaccard similarity) tuples of the files that contain at
+    least `min_containment` of its k-mers, most similar first.
+    """
+    matches = []
+    for filename, sample_id, data in journal.sketches():
+        other = KmerSketch.from_bytes(data)
+        if other.k != sketch.k:
+            continue
+        containment = sketch.containment(other)
+        if containment >= min_containment:
+            matches.append((filename, sample_id, containment, sketch.jaccard(other)))
+    return sorted(matches, key=lambda m: -m[2])
@@ -0,0 +1,88 @@
+"""
+Keeping the compressed output of an upload on local disk, so that retrying it replays those bytes
+rather than decompressing, validating and recompressing the input all over again
+"""
+import tempfile
+from threading import Lock
+
+
+DEFAULT_SPOOL_SIZE = 10 * 1000 ** 3
+
+
+class DiskSpool(object):
+    """
+    A directory for spool files and a cap on the disk space they can use, shared by all of the
+    files being uploaded.
+
+    Space is reserved as each spool file grows; once the cap is reached, a file's spool is
+    abandoned (see `SpoolFile`) and that upload falls back to recomputing its output.
+    """
+    def __init__(self, directory=None, max_size=DEFAULT_SPOOL_SIZE):
+        self.directory = directory
+        self.max_size = max_size
+        self.used = 0
+        self._lock = Lock()
+
+    def reserve(self, n_bytes):
+        """Takes `n_bytes` of the cap, returning False (and taking nothing) if they don't fit.
+        """
+        with self._lock:
+            if self.max_size is not None and self.used + n_bytes > self.max_size:
+                return False
+            self.used += n_bytes
+            return True
+
+    def release(self, n_bytes):
+        with self._lock:
+            self.used -= n_bytes
+
+    def open(self):
+        return SpoolFile(self)
+
+
+class SpoolFile(object):
+    """
+    An (anonymous) temporary file that output is appended to, and that can be read back from any
+    position. The file is only created once there's something to put in it. If the spool's cap is
+    reached (or the disk fills up) the file is abandoned and `active` becomes False.
+    """
+    def __init__(self, spool):
+        self.spool = spool
+        self.size = 0
+        self.active = True
+        self._file = None
+
+    def append(self, data):
+        if not self.active or not data:
+            return
+        if not self.spool.reserve(len(data)):
+            self.close()
+            return
+        try:
+            if self._file is None:
+                self._file = tempfile.TemporaryFile(dir=self.spool.directory)
+            self._file.seek(self.size)
+            self._file.write(data)
+        except (IOError, OSError):
+            self.spool.release(len(data))
+            self.close()
+            return
+        self.size += len(data)
+
+    def read_at(self, offset, n_bytes):
+        """Reads up to `n_bytes` (or everything, if negative) starting at `offset`.
+        """
+        if n_bytes < 0 or offset + n_bytes > self.size:
+            n_bytes = self.size - offset
+        if n_bytes <= 0:
+            return b''
+        self._file.seek(offset)
+        return self._file.read(n_bytes)
+
+    def close(self):
+        self.active = False
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+        self.spool.release(self.size)
+        self.size = 0
@@ -0,0 +1,202 @@
+"""
+Bandwidth limiting for uploads
+"""
+from __future__ import division
+import heapq
+from itertools import count
+import os
+import re
+from threading import Condition, Lock, current_thread
+import time
+
+from onecodex.exceptions import OneCodexException
+
+
+BANDWIDTH_UNITS = {'': 1, 'K': 1000, 'M': 1000 ** 2, 'G': 1000 ** 3}
+
+
+def parse_size(value):
+    """
+    Parses a number of bytes like "500K", "10M" or "1.5GB" (powers of 1000).
+    """
+    match = re.match(r'^(\d+(?:\.\d+)?)\s*([KMG]?)(?:B)?$', value.strip(), re.IGNORECASE)
+    if match is None:
+        raise OneCodexException('Could not parse size: {}'.format(value))
+    return float(match.group(1)) * BANDWIDTH_UNITS[match.group(2).upper()]
+
+
+def format_size(n_bytes):
+    """
+    Formats a number of bytes like "1.5GB" (the inverse of `parse_size`).
+    """
+    for unit in ('G', 'M', 'K'):
+        if n_bytes >= BANDWIDTH_UNITS[unit]:
+            return '{:.1f}{}B'.format(n_bytes / BANDWIDTH_UNITS[unit], unit)
+    return '{}B'.format(int(n_bytes))
+
+
+def parse_bandwidth(value):
+    """
+    Parses a rate in bytes per second like "500K", "10M" or "1.5GB/s" into a number of bytes per
+    second. Empty values, "0" and "none" mean unlimited (None).
+    """
+    value = value.strip()
+    if value.lower() in ('', '0', 'none', 'unlimited'):
+        return None
+    if value.lower().endswith('/s'):
+        value = value[:-2]
+    try:
+        return parse_size(value)
+    except OneCodexException:
+        raise OneCodexException('Could not parse bandwidth: {}'.format(value))
+
+
+class BandwidthLimiter(object):
+    """
+    A token bucket that caps the total rate of all the uploads sharing it.
+
+    Readers ask for tokens in slices of at most `quantum` bytes, which are handed out with fair
+    queueing: each slice is tagged with the (virtual) time its reader would finish it if every
+    waiting reader got an equal share, and the slice with the earliest tag goes first. Concurrent
+    uploads thus share the available bandwidth evenly however large their reads are, rather than
+    the first (or greediest) file hogging it.
+
+    The rate can be changed at runtime with `set_rate` or by writing a new rate (e.g. "10M", or
+    "0" for unlimited) into `control_file`, which is checked about once a second.
+
+    Parameters
+    ----------
+    rate : float, optional
+        Bytes per second (None for unlimited).
+    control_file : string, optional
+    """
+    CONTROL_FILE_INTERVAL = 1.
+
+    def __init__(self, rate=None, control_file=None, quantum=64 * 1024):
+        self.quantum = quantum
+        self.control_file = control_file
+        self._control_mtime = None
+        self._control_checked_at = 0
+        self._cond = Condition(Lock())
+        self._queue = []  # heap of (finish tag, sequence number) of waiting slices
+        self._sequence = count()
+        self._finish_tags = {}  # key -> finish tag of that reader's last slice
+        self._virtual_time = 0
+        self.set_rate(rate)
+        self._check_control_file()
+
+    def set_rate(self, rate):
+        with self._cond:
+            self._set_rate(rate)
+
+    def _set_rate(self, rate):
+        # (with the lock held)
+        self.rate = rate
+        # allow bursts of up to a quarter second of traffic (but at least one slice)
+        self._capacity = None if rate is None else max(self.quantum, rate / 4)
+        self._tokens = self._capacity
+        self._updated_at = time.time()
+        self._cond.notify_all()
+
+    def _check_control_file(self, locked=False):
+        if self.control_file is None:
+            return
+        now = time.time()
+        if now - self._control_checked_at < self.CONTROL_FILE_INTERVAL:
+            return
+        self._control_checked_at = now
+        try:
+            mtime = os.path.getmtime(self.control_file)
+            if mtime == self._control_mtime:
+                return
+            self._control_mtime = mtime
+            with open(self.control_file) as f:
+                rate = parse_bandwidth(f.read())
+        except (IOError, OSError, OneCodexException):
+            # the file may be missing or half-written; keep the current rate
+            return
+        if locked:
+            self._set_rate(rate)
+        else:
+            self.set_rate(rate)
+
+    def _refill(self):
+        now = time.time()
+        self._tokens = min(self._capacity, self._tokens + (now - self._updated_at) * self.rate)
+        self._updated_at = now
+
+    def consume(self, n_bytes, key=None):
+        """
+        Blocks until `n_bytes` may be sent. Bandwidth is shared evenly between distinct `key`s
+        (by default, the calling thread).
+        """
+        if key is None:
+            key = current_thread()
+        while n_bytes > 0:
+            self._check_control_file()
+            if self.rate is None:
+                return
+            size = min(n_bytes, self.quantum)
+            with self._cond:
+                tag = max(self._virtual_time, self._finish_tags.get(key, 0)) + size
+                self._finish_tags[key] = tag
+                entry = (tag, next(self._sequence))
+                heapq.heappush(self._queue, entry)
+                while True:
+                    if self.rate is None:
+                        break
+                    if self._queue[0] != entry:
+                        self._cond.wait()
+                        continue
+                    self._refill()
+                    if self._tokens >= size:
+                        self._tokens -= size
+                        break
+                    # (waking up at least as often as the control file's checked, so a slow
+                    # rate can't hold up the slice after the rate's raised)
+                    self._cond.wait(min((size - self._tokens) / self.rate,
+                                        self.CONTROL_FILE_INTERVAL))
+                    self._check_control_file(locked=True)
+                self._queue.remove(entry)
+                heapq.heapify(self._queue)
+                # virtual time advances to the start of the slice being sent
+                self._virtual_time = max(self._virtual_time, tag - size)
+                # readers that aren't behind don't need remembering (they'd restart from now)
+                self._finish_tags = {k: t for k, t in self._finish_tags.items()
+                                     if t > self._virtual_time}
+                self._cond.notify_all()
+            n_bytes -= size
+
+
+class ThrottledReader(object):
+    """
+    Wraps a file-like object so that reading from it draws from a `BandwidthLimiter` (sharing
+    it evenly with any other readers, or those with the same `key`). Everything else is passed
+    through to the wrapped object.
+    """
+    def __init__(self, file_obj, limiter, key=None):
+        self._file_obj = file_obj
+        self._limiter = limiter
+        self._key = key if key is not None else self
+
+    def __getattr__(self, key):
+        return getattr(self._file_obj, key)
+
+    @property
+    def len(self):
+        if hasattr(self._file_obj, 'len'):
+            return self._file_obj.len
+        # what's left of a plain (seekable) file, e.g. a BytesIO
+        position = self._file_obj.tell()
+        self._file_obj.seek(0, os.SEEK_END)
+        size = self._file_obj.tell()
+        self._file_obj.seek(position)
+        return size - position
+
+    def __len__(self):
+        return self.len
+
+    def read(self, n=-1):
+        data = self._file_obj.read(n)
+        self._limiter.consume(len(data), key=self._key)
+        return data
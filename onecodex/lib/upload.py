@@ -5,24 +5,104 @@ into the onecodex python library at some point for use across CLI and GUI client
 from __future__ import print_function, division
 
 from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from io import BytesIO
 from math import floor
-from multiprocessing import Value
+from multiprocessing.pool import ThreadPool
 import os
 import re
-from threading import BoundedSemaphore, Thread
+import sys
+from threading import Event, Thread
+import time
+import uuid
 
 import requests
 from requests_toolbelt import MultipartEncoder
+import six
+from six.moves.queue import Empty, Queue
+
+from onecodex.lib.checks import make_checks
+from onecodex.lib.compression import ThroughputMeter
+from onecodex.lib.concurrency import ConcurrencyTuner
+from onecodex.lib.estimate import estimate_upload
+from onecodex.lib.inline_validator import (FASTXPassthroughReader, FASTXReader, FASTXTranslator,
+                                           FileGroup, RewindableStream)
+from onecodex.lib.journal import journal_key
+from onecodex.lib.multipart import ParallelMultipartUpload
+from onecodex.lib.throttle import BandwidthLimiter, ThrottledReader, format_size
+from onecodex.exceptions import PassthroughAborted, UploadException
+
+
+# files at least this big are sent in parallel parts rather than in a single POST
+MULTIPART_SIZE = 100 * 1000 * 1000
+# the most that can be sent to S3 in a single POST
+MAX_POST_SIZE = 5 * 1000 * 1000 * 1000
+DEFAULT_UPLOAD_THREADS = 4
+# until a batch is this far along, its time left is predicted from the estimates of its files
+# rather than extrapolated from the time taken so far
+PREDICTED_ETA_PROGRESS = 0.1
+# the "_L001"-like lane number in Illumina filenames
+LANE_PATTERN = '_L[0-9]{3}(?=[._])'
 
-from onecodex.lib.inline_validator import FASTXReader, FASTXTranslator
-from onecodex.exceptions import UploadException
 
+def _swap_read_number(match):
+    chunk = match.group()
+    return chunk[:2] + ('2' if chunk[2] == '1' else '1') + chunk[3:]
 
-MULTIPART_SIZE = 5 * 1000 * 1000 * 1000
-DEFAULT_UPLOAD_THREADS = 4
+
+def read_mate(filename):
+    """
+    Returns the path of the other file of an R1/R2 pair (by swapping the "_R1_"-like chunk of its
+    name for "_R2_" or vice versa), or None if `filename` doesn't look like half of a pair.
+    """
+    mate = re.sub('[._][Rr][12][._]', _swap_read_number, filename)
+    return mate if mate != filename else None
+
+
+def pair_files(files, include_unlisted=False):
+    """
+    Finds the R1/R2 pairs among `files`, returning a list of (R1, R2) tuples and a list of the
+    remaining files. An R1's mate must exist and (unless `include_unlisted`) be in `files` too.
+    """
+    listed = set(files)
+    pairs, paired = [], set()
+    for filename in files:
+        if not re.search('[._][Rr]1[._]', filename):
+            continue
+        mate = read_mate(filename)
+        if not os.path.exists(mate) or (not include_unlisted and mate not in listed):
+            continue
+        pairs.append((filename, mate))
+        paired.update([filename, mate])
+    return pairs, [f for f in files if f not in paired]
+
+
+def group_lanes(files):
+    """
+    Groups files (or (R1, R2) tuples) that are lanes of the same library, i.e. whose names only
+    differ by their "_L001"-like lane numbers, into lists in lane order. Returns a list of the
+    groups and a list of the remaining files.
+    """
+    groups = OrderedDict()
+    for item in files:
+        name = item[0] if isinstance(item, tuple) else item
+        key = (re.sub(LANE_PATTERN, '', name), isinstance(item, tuple))
+        groups.setdefault(key if re.search(LANE_PATTERN, name) else item, []).append(item)
+
+    lanes, others = [], []
+    for items in groups.values():
+        if len(items) > 1:
+            lanes.append(sorted(items))
+        else:
+            others.extend(items)
+    return lanes, others
 
 
 def _file_stats(filename):
+    if isinstance(filename, list):
+        # the lanes of a library (see `group_lanes`) make one sample, named without a lane
+        stats = [_file_stats(f) for f in filename]
+        return re.sub(LANE_PATTERN, '', stats[0][0]), sum(size for _, size in stats)
     if isinstance(filename, tuple):
         assert len(filename) == 2
         file_size = sum(os.path.getsize(f) for f in filename)
@@ -32,26 +112,55 @@ def _file_stats(filename):
     else:
         file_size = os.path.getsize(filename)
 
+    return _upload_filename(filename), file_size
+
+
+def _upload_filename(filename):
+    # uploads are always gzipped
     new_filename, ext = os.path.splitext(os.path.basename(filename))
     if ext in {'.gz', '.gzip', '.bz', '.bz2', '.bzip'}:
         new_filename, ext = os.path.splitext(new_filename)
-
-    return new_filename + ext + '.gz', file_size
+    return new_filename + ext + '.gz'
 
 
-def _wrap_files(filename, logger=None, validate=True):
+def _wrap_files(filename, logger=None, validate=True, compression_level='auto',
+                network_meter=None, recompress=True, spool=None, normalize=False,
+                quality_bins=None, sketch=None, checks=None):
     """
-    A little helper to wrap a sequencing file (or join and wrap R1/R2 pairs)
-    and return a merged file_object
+    A little helper to wrap a sequencing file (or join and wrap R1/R2 pairs, or a list of the
+    lanes of one library) and return a merged file_object
     """
-    if isinstance(filename, tuple):
+    if (normalize or quality_bins or sketch is not None or checks) and not validate:
+        raise UploadException('Validation is required in order to normalize, bin, sketch or check '
+                              'files.')
+    translator_args = {
+        'progress_callback': logger,
+        'compression_level': compression_level,
+        'network_meter': network_meter,
+        'recompress': recompress,
+        'spool': spool,
+        'normalize': normalize,
+        'quality_bins': quality_bins,
+        'sketch': sketch,
+        'checks': checks,
+    }
+    if isinstance(filename, list):
+        if not validate:
+            raise UploadException('Validation is required in order to merge lanes.')
+        if isinstance(filename[0], tuple):
+            reads = FileGroup([open(f[0], 'rb') for f in filename])
+            pair = FileGroup([open(f[1], 'rb') for f in filename])
+        else:
+            reads, pair = FileGroup([open(f, 'rb') for f in filename]), None
+        file_obj = FASTXTranslator(reads, pair=pair, **translator_args)
+    elif isinstance(filename, tuple):
         if not validate:
             raise UploadException('Validation is required in order to auto-interleave files.')
         file_obj = FASTXTranslator(open(filename[0], 'rb'), pair=open(filename[1], 'rb'),
-                                   progress_callback=logger)
+                                   **translator_args)
     else:
         if validate:
-            file_obj = FASTXTranslator(open(filename, 'rb'), progress_callback=logger)
+            file_obj = FASTXTranslator(open(filename, 'rb'), **translator_args)
         else:
             file_obj = FASTXReader(open(filename, 'rb'), progress_callback=logger)
 
@@ -59,42 +168,174 @@ def _wrap_files(filename, logger=None, validate=True):
 
 
 def upload(files, session, samples_resource, server_url, threads=DEFAULT_UPLOAD_THREADS,
-           validate=True, log_to=None):
+           validate=True, log_to=None, compression_level='auto', max_bandwidth=None,
+           bandwidth_control_file=None, journal=None, distributed=False,
+           multipart_threshold=MULTIPART_SIZE, limiter=None, spool=None, normalize=False,
+           quality_bins=None, sketch=False, checks=None):
     """
     Uploads several files to the One Codex server, auto-detecting sizes and using the appropriate
     downstream upload functions. Also, wraps the files with a streaming validator to ensure they
-    work.
+    work. Returns a list of the uploaded sample IDs (in the order of `files`).
+
+    Each of `files` is a path, an (R1, R2) tuple of paths to interleave or a list of the lanes of
+    a library (paths or (R1, R2) tuples) to merge into one sample, in order.
+
+    `compression_level` is a fixed gzip level, a (min, max) tuple of levels or 'auto'. With the
+    latter two, each block is compressed at the level that should finish the upload soonest
+    given the network throughput measured so far across all of the files.
+
+    `threads` may also be 'auto', in which case the number of concurrent uploads starts small and
+    is tuned while uploading based on the aggregate throughput, CPU use and errors.
+
+    `max_bandwidth` caps the combined rate (in bytes per second) of all of the uploads, which
+    share it evenly. It can be changed while uploading by writing a new rate (e.g. "10M") into
+    `bandwidth_control_file`. Alternatively, pass a `BandwidthLimiter` shared with other uploads
+    as `limiter`.
+
+    If an `UploadJournal` is passed as `journal`, each file's progress is recorded in it and files
+    it has already confirmed are skipped. A failed file then doesn't stop the rest of the batch;
+    once the others are done an `UploadException` is raised so the batch can be re-run.
+
+    With `distributed`, files are claimed from the journal (which must be on a filesystem shared
+    by all of the participating processes) instead of being worked through in order, so several
+    processes or hosts running the same batch split it between them. Each keeps its claims alive
+    while uploading; the files of a process that dies are picked up by the others once its leases
+    expire.
+
+    Files expected to send at least `multipart_threshold` bytes (capped at S3's 5GB limit for a
+    single POST) once compressed are compressed and sent in several parts in parallel. How much
+    each file will send is estimated up front from a few samples of it (see `estimate_upload`);
+    the longest uploads are started first and the progress bar is weighted by the estimates. The
+    time left is predicted from them too, until the batch is far enough along to extrapolate.
+
+    With a `DiskSpool` as `spool`, the compressed output of each file sent in a single POST is
+    kept on disk (up to the spool's cap) as it's first produced, so neither sending it (after the
+    pass to find its length) nor retrying it has to recompress the file. Multipart uploads keep
+    the parts they're sending in memory, so they're never recompressed anyway.
+
+    With `normalize`, redundant bytes are stripped from the records as they're validated, and
+    with `quality_bins`, FASTQ quality scores are (lossily) binned (see `FASTXNuclIterator`).
+    `checks` changes how the checks run on each batch of records (e.g. a minimum read length)
+    handle the records they find; see `onecodex.lib.checks`.
+
+    With `sketch`, a `KmerSketch` of each file is built while it's validated and stored in the
+    `journal` (which is then required) alongside its sample ID, so later uploads can be checked
+    against it for duplicates (see `find_similar`).
     """
-    filenames = []
-    file_sizes = []
-    for file_path in files:
+    if threads is None:
+        threads = DEFAULT_UPLOAD_THREADS
+    tuner = ConcurrencyTuner() if threads == 'auto' else None
+    if limiter is None and (max_bandwidth is not None or bandwidth_control_file is not None):
+        limiter = BandwidthLimiter(max_bandwidth, control_file=bandwidth_control_file)
+    if checks:
+        # (raises a ValueError for any unknown check or action before anything is uploaded)
+        make_checks(checks)
+    if sketch:
+        if journal is None:
+            raise UploadException('A journal is required to keep sketches of the uploads.')
+        # (only imported when needed, since it pulls in numpy)
+        from onecodex.lib.sketch import KmerSketch
+    if distributed:
+        if journal is None:
+            raise UploadException('A journal is required for distributed uploads.')
+        journal.reset_attempts()
+    multipart_threshold = min(multipart_threshold, MAX_POST_SIZE)
+
+    sample_ids = [None] * len(files)
+    jobs = []
+    for index, file_path in enumerate(files):
+        if journal is not None:
+            journal.add(file_path)
+            entry = journal.get(file_path)
+            if entry['state'] == journal.CONFIRMED:
+                sample_ids[index] = entry['sample_id']
+                continue
         normalized_filename, file_size = _file_stats(file_path)
-        filenames.append(normalized_filename)
-        file_sizes.append(file_size)
+        jobs.append((index, file_path, normalized_filename, file_size))
+
+    estimates = {}
+
+    def _estimated_size(job):
+        try:
+            estimate = estimate_upload(job[1], compression_level=compression_level)
+        except (IOError, OSError):
+            # go by the size on disk (any problem with the file is reported when it's uploaded)
+            return job[3]
+        estimates[job[2]] = estimate
+        return int(job[3] * estimate.ratio)
+
+    if jobs:
+        # sampling is mostly spent (de)compressing, which releases the GIL
+        pool = ThreadPool(min(len(jobs), threads if isinstance(threads, int) else
+                              DEFAULT_UPLOAD_THREADS))
+        jobs = [job + (size,) for job, size in zip(jobs, pool.map(_estimated_size, jobs))]
+        pool.close()
+        pool.join()
+    # start the longest uploads first, so the batch doesn't end waiting on one big file
+    jobs.sort(key=lambda job: -job[4])
+    network_meter = ThroughputMeter()
+
+    def _predicted_seconds():
+        # how long the batch should take going by the estimates, with each of the concurrent
+        # uploads sending at the rate measured so far (or at its share of the bandwidth cap)
+        if len(estimates) < len(jobs):
+            return None
+        concurrency = max(1, min(len(jobs), tuner.limit if tuner is not None else threads))
+        bandwidth = network_meter.rate
+        if limiter is not None and limiter.rate:
+            share = limiter.rate / concurrency
+            bandwidth = share if bandwidth is None else min(bandwidth, share)
+        if bandwidth is None:
+            return None
+        return sum(estimate.seconds(bandwidth) for estimate in estimates.values()) / concurrency
 
     # set up the logging
     bar_length = 20
     if log_to is not None:
-        log_to.write('Uploading: Preparing upload(s)...    ')
+        if len(jobs) < len(files):
+            log_to.write('Uploading: Skipping {} already uploaded file(s).\n'.format(
+                len(files) - len(jobs)
+            ))
+        # (there's no measured rate yet, so this can only go by the bandwidth cap)
+        predicted_seconds = _predicted_seconds() if limiter is not None and jobs else None
+        prediction = '' if predicted_seconds is None else ' (about {} at {}/s)'.format(
+            _format_duration(predicted_seconds), format_size(limiter.rate)
+        )
+        log_to.write('Uploading: Preparing upload(s) of about {}{}...    '.format(
+            format_size(sum(job[4] for job in jobs)), prediction
+        ))
         log_to.flush()
 
-    overall_size = sum(file_sizes)
+    filenames = [job[2] for job in jobs]
+    overall_size = sum(job[3] for job in jobs)
     validated_sizes = {filename: 0 for filename in filenames}
     transferred_sizes = {filename: 0 for filename in filenames}
+    # each file's progress (in bytes read from disk) counts by how much it's expected to send, so
+    # the overall progress tracks the time spent
+    disk_sizes = {job[2]: job[3] for job in jobs}
+    upload_sizes = {job[2]: job[4] for job in jobs}
+    overall_upload_size = max(1, sum(upload_sizes.values()))
+    upload_started_at = []
+
+    def _weighted_progress(sizes):
+        return sum(upload_sizes[f] * min(1, sizes.get(f, 0) / disk_size)
+                   for f, disk_size in disk_sizes.items() if disk_size) / overall_upload_size
 
     # TODO: we should use click.progressbar?
     def progress_bar_display(file_id, bytes_transferred, validation=False):
         validation_in_progress = sum(validated_sizes.values()) != overall_size
         if validation and validation_in_progress:
             # Validating mode
-            prev_progress = sum(validated_sizes.values()) / overall_size
+            prev_progress = _weighted_progress(validated_sizes)
             validated_sizes[file_id] = bytes_transferred
-            progress = sum(validated_sizes.values()) / overall_size
+            progress = _weighted_progress(validated_sizes)
         else:
             # Uploading mode
-            prev_progress = sum(transferred_sizes.values()) / overall_size
+            if not upload_started_at:
+                upload_started_at.append(time.time())
+            prev_progress = _weighted_progress(transferred_sizes)
             transferred_sizes[file_id] = bytes_transferred
-            progress = sum(transferred_sizes.values()) / overall_size
+            progress = _weighted_progress(transferred_sizes)
 
         if floor(100 * prev_progress) == floor(100 * progress):
             return
@@ -103,80 +344,335 @@ def upload(files, session, samples_resource, server_url, threads=DEFAULT_UPLOAD_
         bar = '#' * block + '-' * (bar_length - block)
         if validation and validation_in_progress:
             log_to.write('\rValidating: [{}] {:.0f}% '.format(bar, progress * 100))
-        elif progress != 1:
-            log_to.write('\rUploading:  [{}] {:.0f}% '.format(bar, progress * 100))
+        elif round(progress, 6) < 1:
+            seconds_left = None
+            if progress < PREDICTED_ETA_PROGRESS:
+                # (too early for the time so far to say much)
+                predicted_seconds = _predicted_seconds()
+                if predicted_seconds is not None:
+                    seconds_left = predicted_seconds * (1 - progress)
+            if seconds_left is None:
+                elapsed = time.time() - upload_started_at[0]
+                seconds_left = elapsed * (1 - progress) / progress
+            log_to.write('\rUploading:  [{}] {:.0f}% ({} left) '.format(
+                bar, progress * 100, _format_duration(seconds_left)
+            ))
         else:
             log_to.write('\rUploading:  Finalizing upload...      ')
         log_to.flush()
 
-    progress_bar = None if log_to is None else progress_bar_display
+    uploaded_sizes = {}
 
-    # first, upload all the smaller files in parallel (if multiple threads are requested)
-    if threads > 1:
-        import ctypes
-        thread_error = Value(ctypes.c_wchar_p, '')
-        semaphore = BoundedSemaphore(threads)
-        upload_threads = []
+    def progress_tracker(file_id, bytes_transferred, validation=False):
+        if not validation:
+            # feed the tuner with how much has been sent (ignoring rewinds from retries)
+            tuner.record_bytes(max(0, bytes_transferred - uploaded_sizes.get(file_id, 0)))
+            uploaded_sizes[file_id] = bytes_transferred
+        if log_to is not None:
+            progress_bar_display(file_id, bytes_transferred, validation=validation)
 
-        def threaded_upload(*args):
-            def _wrapped(*wrapped_args):
-                semaphore.acquire()
-                try:
-                    upload_file(*wrapped_args[:-1])
-                except Exception as e:
-                    # handle inside the thread to prevent the exception message from leaking out
-                    wrapped_args[-1].value = '{}'.format(e)
-                    raise SystemExit
-                semaphore.release()
-
-            # the thread error message must be the last parameter
-            thread = Thread(target=_wrapped, args=args + (thread_error, ))
-            thread.daemon = True
-            thread.start()
-            upload_threads.append(thread)
+    if tuner is not None:
+        progress_bar = progress_tracker
+        retry_callback = tuner.record_error
+        tuner.start()
     else:
-        threaded_upload = upload_file
-
-    upload_threads = []
-    uploading_files = []
-    for file_path, filename, file_size in zip(files, filenames, file_sizes):
-        if file_size < MULTIPART_SIZE:
-            file_obj = _wrap_files(file_path, logger=progress_bar, validate=validate)
-            threaded_upload(file_obj, filename, session, samples_resource, log_to)
-            uploading_files.append(file_obj)
-
-    if threads > 1:
-        # we need to do this funky wait loop to ensure threads get killed by ctrl-c
+        progress_bar = None if log_to is None else progress_bar_display
+        retry_callback = None
+
+    def _file_logger(file_path):
+        # marks the file as uploading in the journal once its first bytes are sent
+        uploading = []
+
+        def _logger(file_id, bytes_transferred, validation=False):
+            if not validation and not uploading:
+                uploading.append(True)
+                journal.set_state(file_path, journal.UPLOADING)
+            if progress_bar is not None:
+                progress_bar(file_id, bytes_transferred, validation=validation)
+        return _logger
+
+    def _named_logger(logger, filename):
+        # the readers report their progress by the paths they're reading, but it's tracked by the
+        # name each file's uploaded as
+        def _logger(file_id, bytes_transferred, validation=False):
+            logger(filename, bytes_transferred, validation=validation)
+        return _logger
+
+    def _upload_job(file_path, filename, upload_size):
+        if journal is not None:
+            journal.set_state(file_path, journal.VALIDATING)
+        logger = progress_bar if journal is None else _file_logger(file_path)
+        if logger is not None:
+            logger = _named_logger(logger, filename)
+        multipart = upload_size >= multipart_threshold
+        file_sketch = KmerSketch() if sketch else None
+        # multipart uploads are compressed part by part (so the parts can be compressed in
+        # parallel), so they need the validated file uncompressed
+        file_obj = _wrap_files(file_path, logger=logger, validate=validate,
+                               compression_level=compression_level, network_meter=network_meter,
+                               recompress=not multipart, spool=spool, normalize=normalize,
+                               quality_bins=quality_bins, sketch=file_sketch, checks=checks)
+        try:
+            if not multipart:
+                sample_id = upload_file(file_obj, filename, session, samples_resource, log_to,
+                                        retry_callback, limiter, upload_size)
+            else:
+                part_threads = threads if tuner is None else tuner.best_limit
+                sample_id = upload_large_file(file_obj, filename, session, samples_resource,
+                                              server_url, threads=part_threads,
+                                              log_to=log_to, limiter=limiter, compress=validate,
+                                              compression_level=compression_level,
+                                              network_meter=network_meter,
+                                              total_size=upload_size)
+                file_obj.close()
+        finally:
+            # (so a failed file's spool doesn't keep its share of the spool's cap)
+            file_obj.discard()
+        if journal is not None:
+            if file_sketch is not None:
+                journal.set_sketch(file_path, file_sketch.to_bytes())
+            journal.set_state(file_path, journal.CONFIRMED, sample_id=sample_id)
+        return sample_id
+
+    # the whole batch is worked through by one pool of threads
+    job_queue = Queue()
+    for job in jobs:
+        job_queue.put(job)
+    jobs_by_key = {journal_key(job[1]): job for job in jobs}
+    errors = []
+    job_errors = []
+
+    def _next_job():
+        if not distributed:
+            return job_queue.get_nowait()
         while True:
-            for thread in upload_threads:
-                # hopefully no one has a <5Gb file that takes longer than a week to upload
-                thread.join(604800)
-            if all(not thread.is_alive() for thread in upload_threads):
+            file_path = journal.claim()
+            if file_path is not None:
                 break
-        if thread_error.value != '':
-            raise UploadException(thread_error.value)
-
-    # lastly, upload all the very big files sequentially
-    for file_path, filename, file_size in zip(files, filenames, file_sizes):
-        if file_size >= MULTIPART_SIZE:
-            file_obj = _wrap_files(file_path, logger=progress_bar, validate=validate)
-            upload_large_file(file_obj, filename, session, samples_resource, server_url,
-                              threads=threads, log_to=log_to)
-            file_obj.close()
+            if not journal.outstanding():
+                raise Empty
+            # other processes are still working; wait in case any of them die
+            time.sleep(min(journal.lease / 4, 5.))
+        job = jobs_by_key.get(journal_key(file_path))
+        if job is None:
+            # a file another process added to the journal
+            job = (None, file_path) + _file_stats(file_path)
+            job += (_estimated_size(job),)
+        return job
+
+    def _worker():
+        # without a journal, the first error stops any more files being started
+        while not errors or journal is not None:
+            if tuner is not None:
+                tuner.semaphore.acquire()
+            try:
+                try:
+                    index, file_path, filename, _, upload_size = _next_job()
+                except Empty:
+                    return
+                except Exception:
+                    # (e.g. the journal couldn't be read, so there's no file to mark as failed)
+                    job_errors.append(sys.exc_info())
+                    return
+                sample_id = _upload_job(file_path, filename, upload_size)
+                if index is not None:
+                    sample_ids[index] = sample_id
+            except Exception as e:
+                if tuner is not None:
+                    tuner.record_error()
+                if journal is not None:
+                    journal.set_state(file_path, journal.FAILED, error='{}'.format(e))
+                errors.append((filename, sys.exc_info()))
+            finally:
+                if tuner is not None:
+                    tuner.semaphore.release()
+
+    stop_renewing = Event()
+    if distributed:
+        def _renew_leases():
+            while not stop_renewing.wait(journal.lease / 3):
+                journal.renew()
+        renew_thread = Thread(target=_renew_leases)
+        renew_thread.daemon = True
+        renew_thread.start()
+
+    n_workers = tuner.max_workers if tuner is not None else threads
+    upload_threads = []
+    for _ in range(min(n_workers, len(jobs))):
+        thread = Thread(target=_worker)
+        thread.daemon = True
+        thread.start()
+        upload_threads.append(thread)
+
+    # we need to do this funky wait loop to ensure threads get killed by ctrl-c
+    while True:
+        for thread in upload_threads:
+            # hopefully no one has a file that takes longer than a week to upload
+            thread.join(604800)
+        if all(not thread.is_alive() for thread in upload_threads):
+            break
+
+    if tuner is not None:
+        tuner.stop()
+    stop_renewing.set()
+
+    if job_errors:
+        six.reraise(*job_errors[0])
+    if distributed:
+        # files that failed here may have been retried by another process (or vice versa)
+        sample_ids = [journal.get(f)['sample_id'] for f in files]
+        failed = [f for f in files if journal.state(f) != journal.CONFIRMED]
+        if failed:
+            raise UploadException('{} of {} file(s) failed to upload (the first, {}: {}). Re-run '
+                                  'the upload to retry them.'.format(
+                                      len(failed), len(files), failed[0],
+                                      journal.get(failed[0])['error']
+                                  ))
+    elif errors:
+        if journal is not None:
+            raise UploadException('{} of {} file(s) failed to upload (the first, {}: {}). Re-run '
+                                  'the upload to retry them.'.format(
+                                      len(errors), len(files), errors[0][0], errors[0][1][1]
+                                  ))
+        six.reraise(*errors[0][1])
 
     if log_to is not None:
         log_to.write('\rUploading: All complete.' + (bar_length - 3) * ' ' + '\n')
+        if tuner is not None:
+            log_to.write('Uploading: Best throughput with {} concurrent upload(s).\n'.format(
+                tuner.best_limit
+            ))
+        log_to.flush()
+    return sample_ids
+
+
+def upload_async(files, session, samples_resource, server_url, threads=DEFAULT_UPLOAD_THREADS,
+                 validate=True, compression_level='auto', max_bandwidth=None,
+                 bandwidth_control_file=None, journal=None, multipart_threshold=MULTIPART_SIZE,
+                 normalize=False, quality_bins=None, checks=None, executor=None,
+                 make_result=None):
+    """
+    Starts uploading `files` (as for `upload`) in the background, returning a
+    `concurrent.futures.Future` for each one straight away.
+
+    Each future resolves to the file's sample ID (or to `make_result(sample_id)`) or raises its
+    upload's error (an `UploadException` if no sample ID came back for it). Files are uploaded `threads` at a time by `executor` (by default, a thread
+    pool of their own); the futures of files that haven't started yet can be cancelled. The
+    bandwidth cap is shared by all of the files.
+    """
+    if not isinstance(threads, int):
+        threads = DEFAULT_UPLOAD_THREADS
+    limiter = None
+    if max_bandwidth is not None or bandwidth_control_file is not None:
+        limiter = BandwidthLimiter(max_bandwidth, control_file=bandwidth_control_file)
+
+    def _upload_one(file_path):
+        sample_id = upload([file_path], session, samples_resource, server_url, threads=threads,
+                           validate=validate, compression_level=compression_level,
+                           journal=journal, multipart_threshold=multipart_threshold,
+                           limiter=limiter, normalize=normalize, quality_bins=quality_bins,
+                           checks=checks)[0]
+        if sample_id is None:
+            # (e.g. a file an older journal recorded as uploaded without its ID)
+            raise UploadException('No sample ID was returned for the upload of {}.'.format(
+                file_path
+            ))
+        return sample_id if make_result is None else make_result(sample_id)
+
+    own_executor = executor is None
+    if own_executor:
+        executor = ThreadPoolExecutor(max_workers=threads)
+    futures = [executor.submit(_upload_one, file_path) for file_path in files]
+    if own_executor:
+        # the queued uploads still run; the pool's threads just exit once they're done
+        executor.shutdown(wait=False)
+    return futures
+
+
+def upload_stream(stream, session, samples_resource, server_url, filename=None,
+                  threads=DEFAULT_UPLOAD_THREADS, validate=True, log_to=None,
+                  compression_level='auto', max_bandwidth=None, bandwidth_control_file=None,
+                  normalize=False, quality_bins=None, checks=None):
+    """
+    Uploads a FASTA or FASTQ file (optionally gzipped or bzipped) from a readable stream that
+    needn't be seekable, e.g. a pipe, validating and compressing it in a single pass. The size
+    isn't known in advance so it's always sent in parts; only the few parts in flight are held
+    in memory (which is all that retrying a failed part needs). `filename` names the new sample
+    (by default "stdin.fa" or "stdin.fq"). Returns the new sample's ID.
+    """
+    if threads is None or threads == 'auto':
+        threads = DEFAULT_UPLOAD_THREADS
+    limiter = None
+    if max_bandwidth is not None or bandwidth_control_file is not None:
+        limiter = BandwidthLimiter(max_bandwidth, control_file=bandwidth_control_file)
+    network_meter = ThroughputMeter()
+
+    stream = RewindableStream(stream, name=filename)
+    if (normalize or quality_bins or checks) and not validate:
+        raise UploadException('Validation is required in order to normalize, bin or check files.')
+    if validate:
+        file_obj = FASTXTranslator(stream, check_filename=False, recompress=False,
+                                   progress_callback=None if log_to is None else
+                                   _stream_progress(log_to),
+                                   compression_level=compression_level,
+                                   network_meter=network_meter, normalize=normalize,
+                                   quality_bins=quality_bins, checks=checks)
+        file_type = file_obj.reads.file_type
+        compress = True
+    else:
+        # anything that isn't already gzipped gets compressed on the way
+        file_obj = stream
+        file_type = None
+        compress = stream.read(2) != b'\x1f\x8b'
+        stream.seek(0)
+
+    if filename is None:
+        filename = 'stdin.fa' if file_type == 'FASTA' else 'stdin.fq'
+    if log_to is not None:
+        log_to.write('Uploading: Streaming {}...'.format(filename))
+        log_to.flush()
+    sample_id = upload_large_file(file_obj, _upload_filename(filename), session, samples_resource,
+                                  server_url, threads=threads, log_to=log_to, limiter=limiter,
+                                  compress=compress,
+                                  compression_level=compression_level,
+                                  network_meter=network_meter)
+    file_obj.close()
+    return sample_id
+
+
+def _stream_progress(log_to, interval=0.5):
+    # there's no telling how far along a stream is, so just report how much has been read
+    last_update = [0]
+
+    def _progress(file_id, bytes_read, validation=False):
+        if time.time() - last_update[0] < interval:
+            return
+        last_update[0] = time.time()
+        log_to.write('\rUploading: {} read from {}...    '.format(
+            format_size(bytes_read), file_id
+        ))
         log_to.flush()
+    return _progress
 
 
 def upload_large_file(file_obj, filename, session, samples_resource, server_url, threads=10,
-                      log_to=None):
+                      log_to=None, limiter=None, compress=False, compression_level=5,
+                      network_meter=None, total_size=None):
     """
     Uploads a file to the One Codex server via an intermediate S3 bucket (and handles files >5Gb)
+    in parts, with up to `threads` parts being sent at once.
+
+    With `compress`, `file_obj` is expected to produce uncompressed data, which is gzipped part by
+    part (in parallel) at `compression_level`. `total_size` is roughly how big the file is, used
+    to plan the part size. `limiter` is an optional `BandwidthLimiter` shared with any other
+    uploads. Returns the new sample's ID (raising an `UploadException` if the server doesn't
+    report one).
+
+    The parts are sent to S3 unless the ONE_CODEX_S3_ENDPOINT_URL environment variable points at
+    another S3-compatible endpoint (e.g. a local stand-in for testing).
     """
     import boto3
-    from boto3.s3.transfer import TransferConfig
-    from boto3.exceptions import S3UploadFailedError
+    from botocore.exceptions import BotoCoreError, ClientError
 
     # first check with the one codex server to get upload parameters
     try:
@@ -189,13 +685,17 @@ def upload_large_file(file_obj, filename, session, samples_resource, server_url,
     secret_key = upload_params['upload_aws_secret_access_key']
 
     # actually do the upload
-    client = boto3.client('s3', aws_access_key_id=access_key, aws_secret_access_key=secret_key)
-    # TODO: this automatically uses 10 threads, but we'd probably like it to be configurable
-    config = TransferConfig(max_concurrency=threads)
+    client = boto3.client('s3', aws_access_key_id=access_key, aws_secret_access_key=secret_key,
+                          endpoint_url=os.environ.get('ONE_CODEX_S3_ENDPOINT_URL'))
+    transfer = ParallelMultipartUpload(client, upload_params['s3_bucket'],
+                                       upload_params['file_id'], threads=threads,
+                                       total_size=total_size, compress=compress,
+                                       compression_level=compression_level,
+                                       network_meter=network_meter, limiter=limiter,
+                                       extra_args={'ServerSideEncryption': 'AES256'})
     try:
-        client.upload_fileobj(file_obj, upload_params['s3_bucket'], upload_params['file_id'],
-                              ExtraArgs={'ServerSideEncryption': 'AES256'}, Config=config)
-    except S3UploadFailedError:
+        transfer.upload(file_obj)
+    except (BotoCoreError, ClientError):
         raise UploadException("Upload of %s has failed. Please contact help@onecodex.com "
                               "if you experience further issues" % filename)
 
@@ -206,19 +706,35 @@ def upload_large_file(file_obj, filename, session, samples_resource, server_url,
     if req.status_code != 200:
         raise UploadException("Upload confirmation of %s has failed. Please contact "
                               "help@onecodex.com if you experience further issues" % filename)
+    try:
+        sample_id = req.json().get('sample_id')
+    except (ValueError, AttributeError):
+        sample_id = None
+    if not sample_id:
+        raise UploadException("Upload of %s finished, but the One Codex server didn't report its "
+                              "sample ID. Please contact help@onecodex.com for assistance."
+                              % filename)
     if log_to is not None:
-        log_to.write('\rUploading: {} finished.\n'.format(filename))
+        log_to.write('\rUploading: {} finished as sample {}{}.\n'.format(
+            filename, sample_id, _format_summary(file_obj, transfer.level_sizes)
+        ))
         log_to.flush()
+    return sample_id
 
 
-def upload_file(file_obj, filename, session, samples_resource, log_to=None):
+def upload_file(file_obj, filename, session, samples_resource, log_to=None, retry_callback=None,
+                limiter=None, size=None):
     """
-    Uploads a file to the One Codex server directly to the users S3 bucket by self-signing
+    Uploads a file to the One Codex server directly to the users S3 bucket by self-signing.
+    `retry_callback` is called with the exception whenever the upload has to be retried and
+    `limiter` is an optional `BandwidthLimiter` shared with any other uploads. `size` is roughly
+    how much will be sent (e.g. from `estimate_upload`). Returns the new sample's ID.
     """
     try:
         upload_info = samples_resource.init_upload({
             'filename': filename,
-            'size': 1,  # because we don't have the actually uploaded size yet b/c we're gziping it
+            # (only an estimate, since we don't have the actually uploaded size until it's gzipped)
+            'size': size or 1,
             'upload_type': 'standard'  # This is multipart form data
         })
     except requests.exceptions.HTTPError:
@@ -235,34 +751,126 @@ def upload_file(file_obj, filename, session, samples_resource, log_to=None):
     for k, v in upload_info['additional_fields'].items():
         multipart_fields[str(k)] = str(v)
 
-    # First validate the file if a FASTXTranslator
-    if isinstance(file_obj, FASTXTranslator):
-        file_obj.validate()
+    # If the file is already compressed, try to send it as-is, validating it alongside the upload
+    uploaded = False
+    if isinstance(file_obj, FASTXTranslator) and file_obj.can_passthrough:
+        # (records that normalizing would change abort it, like any other modification)
+        passthrough_obj = FASTXPassthroughReader(file_obj.reads.file_obj.fileobj,
+                                                 progress_callback=file_obj.progress_callback,
+                                                 allow_iupac=file_obj.reads.allow_iupac,
+                                                 normalize=file_obj.reads.normalize,
+                                                 quality_bins=file_obj.reads.quality_bins,
+                                                 sketch=file_obj.reads.sketch,
+                                                 checks=file_obj.reads.check_config)
+        try:
+            _post_with_retries(session, upload_url, filename, passthrough_obj,
+                               lambda: _PassthroughMultipartBody(multipart_fields, filename,
+                                                                 passthrough_obj),
+                               retry_callback=retry_callback, limiter=limiter)
+            file_obj.reads.file_obj.close()
+            uploaded = True
+        except PassthroughAborted:
+            # the file needs cleaning up, so go the long way around and re-encode it
+            passthrough_obj.release()
+            file_obj.seek(0)
 
-        # If it isn't being modified and is already compressed, don't bother re-parsing it
-        if not file_obj.modified and file_obj.is_gzipped:
-            file_obj = FASTXReader(file_obj.reads.file_obj.fileobj,
-                                   progress_callback=file_obj.progress_callback)
+    if not uploaded:
+        # First validate the file if a FASTXTranslator
+        if isinstance(file_obj, FASTXTranslator):
+            file_obj.validate()
 
-    multipart_fields['file'] = (filename, file_obj, 'application/x-gzip')
-    encoder = MultipartEncoder(multipart_fields)
-    content_type = encoder.content_type
+        def _encoder():
+            fields = multipart_fields.copy()
+            fields['file'] = (filename, file_obj, 'application/x-gzip')
+            return MultipartEncoder(fields)
+
+        _post_with_retries(session, upload_url, filename, file_obj, _encoder,
+                           retry_callback=retry_callback, limiter=limiter)
+
+    # Finally, issue a callback
+    try:
+        samples_resource.confirm_upload({
+            'sample_id': upload_info['sample_id'],
+            'upload_type': 'standard'
+        })
+    except requests.exceptions.HTTPError:
+        raise UploadException('Failed to upload: %s' % filename)
+
+    if log_to is not None:
+        summary = '' if uploaded else _format_summary(file_obj)
+        log_to.write('\rUploading: {} finished as sample {}{}.\n'.format(
+            filename, upload_info['sample_id'], summary
+        ))
+        log_to.flush()
+    return upload_info['sample_id']
+
+
+def _format_levels(level_sizes):
+    """
+    Describe the gzip levels used for a file, e.g. "gzip levels 6 (80%), 1 (20%)"
+    """
+    if len(level_sizes) == 1:
+        return 'gzip level {}'.format(list(level_sizes)[0])
+    total = sum(level_sizes.values())
+    levels = sorted(level_sizes.items(), key=lambda l: -l[1])
+    return 'gzip levels ' + ', '.join('{} ({:.0%})'.format(l, size / total) for l, size in levels)
 
-    # try to upload the file, retrying as necessary
-    max_retries = 3
+
+def _format_summary(file_obj, level_sizes=None):
+    """
+    Describe how a file was changed on its way up, e.g. " (gzip level 5, 1.2MB normalized away)"
+    """
+    notes = []
+    if isinstance(file_obj, FASTXTranslator):
+        level_sizes = level_sizes or file_obj.compression_levels
+        if file_obj.normalized_size:
+            notes.append('{} normalized away'.format(format_size(file_obj.normalized_size)))
+        binning_savings = file_obj.binning_savings()
+        if binning_savings > 0:
+            notes.append('about {} saved by binning qualities'.format(
+                format_size(binning_savings)
+            ))
+    if level_sizes:
+        notes.insert(0, _format_levels(level_sizes))
+    return ' ({})'.format(', '.join(notes)) if notes else ''
+
+
+def _format_duration(seconds):
+    """
+    Describe a (rough) duration, e.g. "45s", "3m05s" or "2h10m"
+    """
+    seconds = int(seconds)
+    if seconds < 60:
+        return '{}s'.format(seconds)
+    if seconds < 3600:
+        return '{}m{:02d}s'.format(seconds // 60, seconds % 60)
+    return '{}h{:02d}m'.format(seconds // 3600, seconds % 3600 // 60)
+
+
+def _post_with_retries(session, upload_url, filename, file_obj, make_body, max_retries=3,
+                       retry_callback=None, limiter=None):
+    """
+    POSTs a multipart body (built by calling `make_body`) wrapping `file_obj`, rewinding the file
+    and rebuilding the body on connection errors.
+    """
     n_retries = 0
     while n_retries < max_retries:
+        body = make_body()
+        if limiter is not None:
+            body = ThrottledReader(body, limiter)
         try:
-            upload_request = session.post(upload_url, data=encoder,
-                                          headers={'Content-Type': content_type}, auth={})
+            upload_request = session.post(upload_url, data=body,
+                                          headers={'Content-Type': body.content_type}, auth={})
             if upload_request.status_code != 201:
                 raise UploadException("Upload failed. Please contact "
                                       "help@onecodex.com for assistance.")
             file_obj.close()
             break
-        except requests.exceptions.ConnectionError:
+        except requests.exceptions.ConnectionError as e:
             n_retries += 1
-            # reset the file_obj back to the start; we may need to rebuild the encoder too?
+            if retry_callback is not None:
+                retry_callback(e)
+            # reset the file_obj back to the start
             file_obj.seek(0)
             if n_retries == max_retries:
                 raise UploadException(
@@ -272,17 +880,48 @@ def upload_file(file_obj, filename, session, samples_resource, log_to=None):
                     "for assistance." % filename
                 )
 
-    # Finally, issue a callback
-    try:
-        samples_resource.confirm_upload({
-            'sample_id': upload_info['sample_id'],
-            'upload_type': 'standard'
-        })
-    except requests.exceptions.HTTPError:
-        raise UploadException('Failed to upload: %s' % filename)
 
-    if log_to is not None:
-        log_to.write('\rUploading: {} finished as sample {}.\n'.format(
-            filename, upload_info['sample_id']
-        ))
-        log_to.flush()
+class _PassthroughMultipartBody(object):
+    """
+    A minimal multipart/form-data body for streaming a `FASTXPassthroughReader`. Unlike
+    `MultipartEncoder`, this hands the file's bytes straight through without copying them into an
+    intermediate buffer and (because the compressed size is already known) it doesn't need a
+    pre-pass over the file to determine the Content-Length.
+    """
+    def __init__(self, fields, filename, file_obj, content_type='application/x-gzip'):
+        boundary = uuid.uuid4().hex
+        preamble = ''
+        for key, value in fields.items():
+            preamble += ('--{}\r\nContent-Disposition: form-data; name="{}"\r\n\r\n'
+                         '{}\r\n').format(boundary, key, value)
+        preamble += ('--{}\r\nContent-Disposition: form-data; name="file"; filename="{}"\r\n'
+                     'Content-Type: {}\r\n\r\n').format(boundary, filename, content_type)
+        preamble = preamble.encode('utf-8')
+        epilogue = '\r\n--{}--\r\n'.format(boundary).encode('utf-8')
+
+        self.content_type = 'multipart/form-data; boundary={}'.format(boundary)
+        self._parts = [BytesIO(preamble), file_obj, BytesIO(epilogue)]
+        self._total = len(preamble) + len(file_obj) + len(epilogue)
+        self._read = 0
+
+    @property
+    def len(self):
+        return self._total - self._read
+
+    def __len__(self):
+        return self.len
+
+    def read(self, n=-1):
+        chunks = []
+        while self._parts:
+            chunk = self._parts[0].read(n)
+            chunks.append(chunk)
+            if n >= 0 and len(chunk) == n:
+                break
+            # this part is exhausted so move on to the next
+            self._parts.pop(0)
+            if n >= 0:
+                n -= len(chunk)
+        data = b''.join(chunks)
+        self._read += len(data)
+        return data
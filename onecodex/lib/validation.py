@@ -0,0 +1,99 @@
+"""
+Validating files without uploading them, e.g. to check a whole run before sending any of it
+"""
+from __future__ import division
+
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+import os
+import time
+import warnings
+
+from onecodex.exceptions import ReadCheckWarning, ValidationWarning
+from onecodex.lib.inline_validator import FASTXTranslator
+
+
+# how much of the validated output is read (and thrown away) at a time
+READ_SIZE = 1024 * 1024
+
+
+def validate_file(filename, clean=False, checks=None):
+    """
+    Validates a FASTA/FASTQ file (or an (R1, R2) tuple of paired files) just as uploading it
+    would, returning a report of it: the number of records and bytes read, how long it took,
+    the `checks` that records failed, any warnings and the error (if any) it failed with.
+
+    Unless `clean`, anything that would have to be modified to upload it (such as tabs in its
+    headers) is an error, as it is for `onecodex upload` without --clean. Such errors are marked
+    as "fixable".
+    """
+    paths = list(filename) if isinstance(filename, tuple) else [filename]
+    report = OrderedDict([
+        ('file', paths if len(paths) > 1 else filename),
+        ('records', 0),
+        ('bytes', sum(os.path.getsize(path) for path in paths)),
+        ('seconds', 0.),
+        ('modified', False),
+        ('check_counts', {}),
+        ('warnings', []),
+        ('error', None),
+        ('fixable', False),
+    ])
+
+    start = time.time()
+    file_objs = []
+    outfile = None
+    with warnings.catch_warnings(record=True) as caught:
+        warnings.simplefilter('always')
+        if not clean:
+            warnings.filterwarnings('error', category=ValidationWarning)
+            warnings.filterwarnings('always', category=ReadCheckWarning)
+        try:
+            file_objs = [open(path, 'rb') for path in paths]
+            outfile = FASTXTranslator(file_objs[0], pair=file_objs[1] if len(paths) > 1 else None,
+                                      recompress=False, checks=checks)
+            while len(outfile.read(READ_SIZE)) != 0:
+                pass
+            outfile.close()
+        except Exception as e:
+            report['error'] = str(e) or e.__class__.__name__
+            report['fixable'] = isinstance(e, ValidationWarning)
+            for file_obj in file_objs:
+                file_obj.close()
+    report['seconds'] = time.time() - start
+
+    if outfile is not None:
+        iterators = [outfile.reads]
+        if outfile.reads_pair is not None:
+            iterators.append(outfile.reads_pair)
+        report['records'] = sum(reads.n_records for reads in iterators)
+        report['modified'] = any(reads.modified for reads in iterators)
+        for reads in iterators:
+            for name, count in reads.check_counts.items():
+                report['check_counts'][name] = report['check_counts'].get(name, 0) + count
+
+    for warning in caught:
+        message = str(warning.message)
+        if issubclass(warning.category, ValidationWarning) and message not in report['warnings']:
+            report['warnings'].append(message)
+    return report
+
+
+def _validate_file(args):
+    return validate_file(*args)
+
+
+def validate_files(files, processes=None, clean=False, checks=None):
+    """
+    Validates `files` (see `validate_file`) on a pool of `processes` (defaulting to the number
+    of CPUs), yielding their reports in the same order.
+    """
+    args = [(filename, clean, checks) for filename in files]
+    if processes == 1 or len(args) <= 1:
+        for file_args in args:
+            yield _validate_file(file_args)
+        return
+
+    with ProcessPoolExecutor(max_workers=processes) as executor:
+        for report in executor.map(_validate_file, args):
+            yield report
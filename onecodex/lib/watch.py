@@ -0,0 +1,216 @@
+"""
+Watching a directory (e.g. a sequencer's output folder) and uploading files as they're finished
+"""
+from __future__ import print_function, division
+import os
+import re
+from stat import S_ISREG
+from threading import Thread
+import time
+
+from six.moves.queue import Queue
+
+from onecodex.lib.throttle import BandwidthLimiter
+from onecodex.lib.upload import DEFAULT_UPLOAD_THREADS, MULTIPART_SIZE, read_mate, upload
+
+
+FASTX_EXTENSIONS = {'.fa', '.fna', '.fasta', '.fq', '.fastq'}
+COMPRESSED_EXTENSIONS = {'.gz', '.gzip', '.bz', '.bz2', '.bzip'}
+
+
+def is_fastx(filename):
+    root, ext = os.path.splitext(filename)
+    if ext in COMPRESSED_EXTENSIONS:
+        root, ext = os.path.splitext(root)
+    return ext in FASTX_EXTENSIONS
+
+
+class DirectoryWatcher(object):
+    """
+    Finds the FASTA/FASTQ files in a directory as they're finished being written.
+
+    A file is finished once its size and modification time haven't changed for `settle` seconds
+    or, if inotify is available (through the optional `inotify_simple` package), as soon as it's
+    closed after writing or moved into the directory. With `interleave`, each half of an R1/R2
+    pair is held back until the other is finished too (or, if the other doesn't turn up within
+    `pair_timeout` seconds, reported on its own).
+    """
+    def __init__(self, directory, settle=30., interleave=True, pair_timeout=300.,
+                 use_inotify=True):
+        self.directory = directory
+        self.settle = settle
+        self.interleave = interleave
+        self.pair_timeout = pair_timeout
+        self._stats = {}  # unfinished path -> ((size, mtime), when that was first seen)
+        self._finished = {}  # finished path -> when (until it's reported)
+        self._reported = set()
+
+        self._inotify = None
+        if use_inotify:
+            try:
+                from inotify_simple import INotify, flags
+            except ImportError:
+                pass
+            else:
+                self._inotify = INotify()
+                self._finished_flags = flags.CLOSE_WRITE | flags.MOVED_TO
+                self._inotify.add_watch(directory, self._finished_flags)
+
+    @property
+    def pending(self):
+        """Are any files still being written (or waiting for their mates)?
+        """
+        return bool(self._stats or self._finished)
+
+    def poll(self, timeout=0):
+        """
+        Waits for up to `timeout` seconds (or until inotify sees a file finish) and returns a list
+        of the files (or (R1, R2) tuples of files) finished since the last poll.
+        """
+        closed = set()
+        if self._inotify is not None:
+            for event in self._inotify.read(timeout=int(timeout * 1000)):
+                if event.mask & self._finished_flags:
+                    closed.add(os.path.join(self.directory, event.name))
+        elif timeout:
+            time.sleep(timeout)
+
+        now = time.time()
+        for name in sorted(os.listdir(self.directory)):
+            path = os.path.join(self.directory, name)
+            if path in self._reported or path in self._finished or not is_fastx(name):
+                continue
+            try:
+                stat = os.stat(path)
+            except OSError:
+                # it's been moved or deleted since it was listed
+                continue
+            if not S_ISREG(stat.st_mode):
+                continue
+
+            key = (stat.st_size, stat.st_mtime)
+            seen = self._stats.get(path)
+            if seen is None or seen[0] != key:
+                self._stats[path] = seen = (key, now)
+            if path in closed or (stat.st_size > 0 and now - seen[1] >= self.settle):
+                del self._stats[path]
+                self._finished[path] = now
+        return self._take_finished()
+
+    def flush(self):
+        """Returns the finished files still waiting for their mates, unpaired.
+        """
+        return self._take_finished(flush=True)
+
+    def _take_finished(self, flush=False):
+        ready = []
+        for path, finished_at in sorted(self._finished.items()):
+            mate = read_mate(os.path.basename(path)) if self.interleave else None
+            if mate is not None:
+                mate = os.path.join(self.directory, mate)
+            if mate is None:
+                ready.append(path)
+            elif mate in self._finished:
+                # the pair is reported when we come to its R1
+                if re.search('[._][Rr]1[._]', os.path.basename(path)):
+                    ready.append((path, mate))
+            elif (flush or mate in self._reported or
+                  time.time() - finished_at >= self.pair_timeout and not os.path.exists(mate)):
+                ready.append(path)
+
+        for item in ready:
+            for path in item if isinstance(item, tuple) else [item]:
+                del self._finished[path]
+                self._reported.add(path)
+        return ready
+
+    def close(self):
+        if self._inotify is not None:
+            self._inotify.close()
+
+
+def _describe(item):
+    if isinstance(item, tuple):
+        return ' & '.join(os.path.basename(f) for f in item)
+    return os.path.basename(item)
+
+
+def watch(directory, session, samples_resource, server_url, threads=DEFAULT_UPLOAD_THREADS,
+          validate=True, log_to=None, compression_level='auto', max_bandwidth=None,
+          bandwidth_control_file=None, journal=None, interleave=True, settle=30.,
+          poll_interval=5., idle_timeout=None, stop=None, multipart_threshold=MULTIPART_SIZE,
+          spool=None, normalize=False, quality_bins=None, checks=None):
+    """
+    Uploads FASTA/FASTQ files as they're written into `directory` (see `DirectoryWatcher`),
+    until the `stop` Event is set or, with `idle_timeout`, no new files have been found for that
+    many seconds and all of the uploads have finished.
+
+    Files are handed to a pool of `threads` upload workers as soon as they're finished, so only
+    the last file of a sequencing run is left to upload once the run is done. The bandwidth cap
+    and `spool` (a `DiskSpool`) are shared by all of the uploads. With a `journal`, files uploaded
+    by an earlier session are skipped. Returns a dict of the sample ID of each uploaded file (or (R1, R2) tuple).
+    """
+    n_workers = threads if isinstance(threads, int) else DEFAULT_UPLOAD_THREADS
+    limiter = None
+    if max_bandwidth is not None or bandwidth_control_file is not None:
+        limiter = BandwidthLimiter(max_bandwidth, control_file=bandwidth_control_file)
+    watcher = DirectoryWatcher(directory, settle=settle, interleave=interleave)
+
+    found = Queue()
+    sample_ids = {}
+
+    def _log(message):
+        if log_to is not None:
+            log_to.write(message + '\n')
+            log_to.flush()
+
+    def _worker():
+        while True:
+            item = found.get()
+            if item is None:
+                return
+            try:
+                sample_ids[item] = upload([item], session, samples_resource, server_url,
+                                          threads=threads, validate=validate,
+                                          compression_level=compression_level, journal=journal,
+                                          multipart_threshold=multipart_threshold,
+                                          limiter=limiter, spool=spool, normalize=normalize,
+                                          quality_bins=quality_bins, checks=checks)[0]
+                _log('Watching: Uploaded {} as sample {}.'.format(_describe(item),
+                                                                  sample_ids[item]))
+            except Exception as e:
+                _log('Watching: Failed to upload {}: {}'.format(_describe(item), e))
+            finally:
+                found.task_done()
+
+    workers = [Thread(target=_worker) for _ in range(n_workers)]
+    for worker in workers:
+        worker.daemon = True
+        worker.start()
+
+    try:
+        idle_since = time.time()
+        while stop is None or not stop.is_set():
+            ready = watcher.poll(poll_interval)
+            for item in ready:
+                if journal is not None and journal.state(item) == journal.CONFIRMED:
+                    continue
+                _log('Watching: Found {}.'.format(_describe(item)))
+                found.put(item)
+            if ready or watcher.pending or found.unfinished_tasks:
+                idle_since = time.time()
+            elif idle_timeout is not None and time.time() - idle_since >= idle_timeout:
+                break
+
+        # finish off whatever's been found
+        for item in watcher.flush():
+            found.put(item)
+        for _ in workers:
+            found.put(None)
+        while any(worker.is_alive() for worker in workers):
+            # (joined with a timeout, so ctrl-c still works)
+            for worker in workers:
+                worker.join(1)
+    finally:
+        watcher.close()
+    return sample_ids
@@ -1,3 +1,5 @@
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
 import inspect
 import itertools
@@ -13,6 +15,11 @@ from onecodex.models.helpers import (check_bind, generate_potion_sort_clause,
                                      generate_potion_keyword_where)
 
 
+# how many objects `get_many` fetches per request (their URIs are all in the URL of the request,
+# so much larger batches can be too long for the server)
+GET_MANY_BATCH_SIZE = 100
+
+
 class OneCodexBase(object):
     """
     A parent object for all the One Codex objects that wraps the Potion-Client API and makes
@@ -279,6 +286,58 @@ class OneCodexBase(object):
                 raise e
         return cls(_resource=resource)
 
+    @classmethod
+    def get_many(cls, uuids, batch_size=GET_MANY_BATCH_SIZE, threads=4):
+        """
+        Retrieve many {classname} objects from the server by their UUIDs, a batch at a time,
+        rather than making a request for each one.
+
+        Parameters
+        ----------
+        uuids : list of strings
+            UUIDs of the {classname} objects to retrieve.
+        batch_size : integer, optional
+            Retrieve up to this many objects in each request.
+        threads : integer, optional
+            Make up to this many requests at once.
+
+        Returns
+        -------
+        list
+            The {classname} objects, in the same order as `uuids`, with None in place of any that
+            couldn't be found.
+
+        Examples
+        --------
+        >>> api.Samples.get_many(['xxxxxxxxxxxxxxxx', 'yyyyyyyyyyyyyyyy'])
+        [<Sample xxxxxxxxxxxxxxxx>, None]
+        """.format(classname=cls.__name__)
+        check_bind(cls)
+
+        uris = [cls._convert_id_to_uri(uuid) for uuid in uuids]
+        # (the server also won't allow any duplicates in a batch)
+        unique_uris = list(OrderedDict.fromkeys(uris))
+        schema = next(l for l in cls._resource._schema['links'] if l['rel'] == 'instances')
+        max_per_page = schema['schema']['properties']['per_page'].get('maximum')
+        if max_per_page is not None:
+            batch_size = min(batch_size, max_per_page)
+        batches = [unique_uris[i:i + batch_size] for i in range(0, len(unique_uris), batch_size)]
+
+        def fetch_batch(batch):
+            cursor = cls._resource.instances(where={'$uri': {'$in': batch}}, per_page=len(batch))
+            # (there's only one page, so don't let the cursor try to fetch another)
+            return list(itertools.islice(cursor, len(batch)))
+
+        found = {}
+        if len(batches) > 1 and threads > 1:
+            with ThreadPoolExecutor(max_workers=min(threads, len(batches))) as executor:
+                results = list(executor.map(fetch_batch, batches))
+        else:
+            results = [fetch_batch(batch) for batch in batches]
+        for resource in itertools.chain.from_iterable(results):
+            found[resource._uri] = cls(_resource=resource)
+        return [found.get(uri) for uri in uris]
+
     def delete(self):
         """
         Delete this {classname} object off the One Codex server.
@@ -1,6 +1,7 @@
 import os
 import sys
 
+from dateutil.parser import parse
 import requests
 from requests.exceptions import HTTPError
 from six import string_types
@@ -9,7 +10,11 @@ from onecodex.exceptions import OneCodexException
 from onecodex.models import OneCodexBase
 from onecodex.models.misc import Projects, Tags
 from onecodex.models.helpers import truncate_string
-from onecodex.lib.upload import upload  # upload_file
+from onecodex.lib.journal import UploadJournal
+from onecodex.lib.manifest import read_manifest
+from onecodex.lib.spool import DEFAULT_SPOOL_SIZE, DiskSpool
+from onecodex.lib.upload import MULTIPART_SIZE, upload, upload_async, upload_stream  # upload_file
+from onecodex.lib.watch import watch
 
 class OneCodexBaseCollection(object):
     model = OneCodexBase
@@ -150,17 +155,62 @@ class Samples(OneCodexBase):
             self.metadata.save()
 
     @classmethod
-    def upload(cls, filename, threads=None, validate=True):
+    def upload(cls, filename, threads=None, validate=True, compression_level='auto',
+               max_bandwidth=None, bandwidth_control_file=None, journal=None, distributed=False,
+               multipart_threshold=MULTIPART_SIZE, spool_dir=None,
+               max_spool_size=DEFAULT_SPOOL_SIZE, normalize=False, quality_bins=None,
+               sketch=False, checks=None):
         """
         Uploads a series of files to the One Codex server. These files are automatically
         validated during upload.
 
         Parameters
         ----------
-        path: list of strings or tuples
+        path: list of strings, tuples or lists
             List of full paths to the files. If one (or more) of the list items are a tuple, this
             is parsed as a set of files that are paired and the files are automatically
-            iterleaved during upload.
+            iterleaved during upload. A list item that's a list holds the lanes of one library
+            (paths or tuples of paired paths, in order), which are uploaded as a single sample.
+        threads: int or 'auto', optional
+            Number of files to upload concurrently. With 'auto', this is tuned while uploading.
+        compression_level: int, tuple or 'auto', optional
+            A fixed gzip level for (re)compressing files, a (min, max) tuple of levels or 'auto'.
+            The latter two adapt the level to the measured CPU and network throughput.
+        max_bandwidth: float, optional
+            Cap on the combined upload rate in bytes per second, shared evenly between files.
+        bandwidth_control_file: string, optional
+            Path to a file that's polled for a new cap (e.g. "10M", or "0" for unlimited) while
+            uploading.
+        journal: UploadJournal, optional
+            Records the progress of each file, so that re-running a partially failed batch only
+            uploads the files that haven't been confirmed yet.
+        distributed: bool, optional
+            Split the batch with any other processes uploading it by claiming files from the
+            `journal` (which must then be on a shared filesystem).
+        multipart_threshold: int, optional
+            Files expected to be at least this many bytes once compressed are uploaded in several
+            parts in parallel.
+        spool_dir: string, optional
+            Keep each file's compressed output in a temporary file in this directory as it's
+            produced, so that it isn't recompressed when it's sent or retried.
+        max_spool_size: int, optional
+            Cap on the disk space used in `spool_dir`; files that don't fit are recompressed
+            instead.
+        normalize: bool, optional
+            Strip redundant bytes from the records while validating them: trailing whitespace,
+            the identifiers repeated on FASTQ "+" lines and FASTA line wrapping.
+        quality_bins: bool or list of tuples, optional
+            Lossily bin FASTQ quality scores, which makes them compress much better. True uses
+            Illumina's 8 levels; otherwise, a list of (lowest score, binned score) tuples, each
+            applying up to the next one's lowest score.
+        sketch: bool, optional
+            Keep a k-mer sketch of each file in the `journal` (which is then required), so that
+            files can later be checked for being duplicates of ones already uploaded.
+        checks: dict, optional
+            How the checks run on the records as they're validated handle the records they find,
+            mapping check names to 'warn', 'fix', 'error' (or None to skip the check), or to an
+            (action, value) tuple, e.g. `{'min_length': ('fix', 50), 'duplicate_ids': 'warn'}`.
+            See `onecodex.lib.checks.CHECKS` for the available checks.
         """
         # TODO: either raise/wrap UploadException or just us the new one in lib.samples
         # upload_file(filename, cls._resource._client.session, None, 100)
@@ -168,11 +218,210 @@ class Samples(OneCodexBase):
         if isinstance(filename, string_types) or isinstance(filename, tuple):
             filename = [filename]
         upload(filename, res._client.session, res, res._client._root_url + '/', threads=threads,
-               validate=validate, log_to=sys.stderr)
+               validate=validate, log_to=sys.stderr, compression_level=compression_level,
+               max_bandwidth=max_bandwidth, bandwidth_control_file=bandwidth_control_file,
+               journal=journal, distributed=distributed,
+               multipart_threshold=multipart_threshold,
+               spool=DiskSpool(spool_dir, max_spool_size) if spool_dir is not None else None,
+               normalize=normalize, quality_bins=quality_bins, sketch=sketch, checks=checks)
 
         # FIXME: pass the auth into this so we can authenticate the callback?
         # FIXME: return a Sample object?
 
+    @classmethod
+    def upload_async(cls, filename, threads=None, validate=True, compression_level='auto',
+                     max_bandwidth=None, bandwidth_control_file=None, journal=None,
+                     multipart_threshold=MULTIPART_SIZE, normalize=False, quality_bins=None,
+                     checks=None, executor=None):
+        """
+        Starts uploading a series of files in the background, without waiting for them to finish
+        or writing any progress.
+
+        Parameters
+        ----------
+        filename: string, tuple or list
+            As for `Samples.upload`.
+        executor: concurrent.futures.Executor, optional
+            Runs the uploads (one task per file). Defaults to a thread pool of `threads` workers.
+
+        The other parameters are as for `Samples.upload`.
+
+        Returns
+        -------
+        list of concurrent.futures.Future
+            One per file, in order, each resolving to the uploaded `Samples` object (or raising
+            the file's upload error, which is an `UploadException` if the server didn't report
+            the new sample's ID). Uploads that haven't started yet can be cancelled with
+            `future.cancel()`, and `future.add_done_callback()` can chain further work, e.g.
+            waiting for the sample's analyses.
+
+        Examples
+        --------
+        >>> futures = api.Samples.upload_async(['a.fq.gz', ('b_R1.fq', 'b_R2.fq')])
+        >>> samples = [f.result() for f in futures]
+        """
+        res = cls._resource
+        if isinstance(filename, string_types) or isinstance(filename, tuple):
+            filename = [filename]
+        return upload_async(filename, res._client.session, res, res._client._root_url + '/',
+                            threads=threads, validate=validate,
+                            compression_level=compression_level, max_bandwidth=max_bandwidth,
+                            bandwidth_control_file=bandwidth_control_file, journal=journal,
+                            multipart_threshold=multipart_threshold, normalize=normalize,
+                            quality_bins=quality_bins, checks=checks, executor=executor,
+                            make_result=lambda sample_id: cls(_resource=res(sample_id)))
+
+    @classmethod
+    def upload_stream(cls, stream, filename=None, threads=None, validate=True,
+                      compression_level='auto', max_bandwidth=None, bandwidth_control_file=None,
+                      normalize=False, quality_bins=None, checks=None):
+        """
+        Uploads a FASTA or FASTQ file from a readable stream (e.g. `sys.stdin` or the output of a
+        subprocess), validating and compressing it in a single pass without it being seekable or
+        its size being known.
+
+        Parameters
+        ----------
+        stream: file-like object
+            Opened in binary mode.
+        filename: string, optional
+            Name of the new sample; defaults to "stdin.fa" or "stdin.fq".
+        threads: int, optional
+            Number of parts to compress and send at once.
+
+        The other parameters are as for `Samples.upload`.
+        """
+        res = cls._resource
+        upload_stream(stream, res._client.session, res, res._client._root_url + '/',
+                      filename=filename, threads=threads, validate=validate, log_to=sys.stderr,
+                      compression_level=compression_level, max_bandwidth=max_bandwidth,
+                      bandwidth_control_file=bandwidth_control_file, normalize=normalize,
+                      quality_bins=quality_bins, checks=checks)
+
+    @classmethod
+    def watch(cls, directory, threads=None, validate=True, compression_level='auto',
+              max_bandwidth=None, bandwidth_control_file=None, journal=None, interleave=True,
+              settle=30., idle_timeout=None, stop=None, multipart_threshold=MULTIPART_SIZE,
+              spool_dir=None, max_spool_size=DEFAULT_SPOOL_SIZE, normalize=False,
+              quality_bins=None, checks=None):
+        """
+        Uploads FASTA and FASTQ files as they're written into a directory (e.g. by a sequencer),
+        each as soon as it's finished being written. Runs until interrupted, `stop` is set or,
+        with `idle_timeout`, no new files have appeared for that many seconds.
+
+        Parameters
+        ----------
+        directory: string
+        interleave: bool, optional
+            Upload R1/R2 files as pairs, once both halves are finished.
+        settle: float, optional
+            Seconds a file must go unchanged to be considered finished (files closed after writing
+            are picked up straight away if the optional `inotify_simple` package is installed).
+        idle_timeout: float, optional
+        stop: threading.Event, optional
+
+        The other parameters are as for `Samples.upload`. Returns a dict of the sample ID of each
+        uploaded file (or R1/R2 tuple).
+        """
+        res = cls._resource
+        return watch(directory, res._client.session, res, res._client._root_url + '/',
+                     threads=threads, validate=validate, log_to=sys.stderr,
+                     compression_level=compression_level, max_bandwidth=max_bandwidth,
+                     bandwidth_control_file=bandwidth_control_file, journal=journal,
+                     interleave=interleave, settle=settle, idle_timeout=idle_timeout, stop=stop,
+                     multipart_threshold=multipart_threshold,
+                     spool=DiskSpool(spool_dir, max_spool_size) if spool_dir is not None else None,
+                     normalize=normalize, quality_bins=quality_bins, checks=checks)
+
+    @classmethod
+    def upload_manifest(cls, manifest, journal=None, **kwargs):
+        """
+        Uploads the files listed in a CSV/TSV manifest, then applies any metadata and tags given
+        for each sample. Progress is checkpointed in a journal, so if the batch is interrupted or
+        some files fail, running it again picks up where it left off.
+
+        Parameters
+        ----------
+        manifest: string
+            Path to the manifest. It must have a `file` column and may have `pair` (an R2 file to
+            interleave with `file`) and `tags` (separated by semicolons) columns; any other columns
+            are metadata fields (non-standard ones are stored as custom metadata).
+        journal: string, optional
+            Path to the journal. Defaults to the manifest's path plus ".journal".
+
+        Any other keyword arguments are passed to `Samples.upload`.
+        """
+        entries = read_manifest(manifest)
+        md_schema = Metadata._resource._schema['properties']
+        entries_metadata = [cls._manifest_metadata(e.metadata, md_schema) for e in entries]
+
+        journal = UploadJournal(journal if journal is not None else manifest + '.journal')
+        try:
+            try:
+                cls.upload([e.files for e in entries], journal=journal, **kwargs)
+            finally:
+                # annotate whatever was uploaded, even if the rest of the batch failed
+                for entry, metadata in zip(entries, entries_metadata):
+                    cls._annotate_upload(journal, entry.files, metadata, entry.tags)
+            counts = journal.counts()
+        finally:
+            journal.close()
+        return counts
+
+    @staticmethod
+    def _manifest_metadata(fields, md_schema):
+        """
+        Converts a manifest's metadata strings to the types in the metadata schema (putting any
+        unknown fields into the custom metadata).
+        """
+        metadata = {}
+        for key, value in fields.items():
+            schema = md_schema.get(key)
+            if schema is None or key in ('$uri', 'sample', 'custom'):
+                metadata.setdefault('custom', {})[key] = value
+                continue
+            try:
+                if 'number' in schema.get('type', []):
+                    value = float(value)
+                elif schema.get('format') == 'date-time':
+                    value = parse(value)
+            except ValueError:
+                raise OneCodexException('Invalid value for metadata field {}: {}'.format(key, value))
+            if 'enum' in schema and value not in schema['enum']:
+                raise OneCodexException('{} must be one of: {}'.format(
+                    key, ', '.join(v for v in schema['enum'] if v is not None)
+                ))
+            metadata[key] = value
+        return metadata
+
+    @classmethod
+    def _annotate_upload(cls, journal, filename, metadata, tags):
+        entry = journal.get(filename)
+        if entry is None or entry['state'] != journal.CONFIRMED or entry['annotated']:
+            return
+        if (metadata or tags) and entry['sample_id'] is not None:
+            sample = cls.get(entry['sample_id'])
+            if metadata:
+                for key, value in metadata.items():
+                    setattr(sample.metadata, key, value)
+                sample.metadata.save()
+            if tags:
+                sample_tags = sample.tags
+                existing = {t.name for t in sample_tags}
+                for name in tags:
+                    if name in existing:
+                        continue
+                    matches = Tags.where(name=name)
+                    if matches:
+                        tag = matches[0]
+                    else:
+                        tag = Tags(name=name)
+                        tag.save()
+                    sample_tags.append(tag)
+                sample.tags = sample_tags
+                sample.save()
+        journal.set_annotated(filename)
+
     def download(self, path=None):
         """
         Downloads the original reads file (FASTA/FASTQ) from One Codex.
@@ -2,6 +2,7 @@
 utils.py
 author: @mbiokyle29
 """
+from collections import OrderedDict
 import json
 import logging
 import os
@@ -11,10 +12,12 @@ try:
 except ImportError:
     from urllib.parse import urlparse
 
-
-import requests
 from click import BadParameter, echo
-from potion_client.converter import PotionJSONEncoder
+
+# (requests and potion_client are slow to import, so only are when they're needed)
+from onecodex.exceptions import OneCodexException
+from onecodex.lib.checks import CHECKS, make_checks, parse_check
+from onecodex.lib.throttle import parse_bandwidth, parse_size
 
 log = logging.getLogger(__name__)
 cli_log = logging.getLogger("onecodex.cli")
@@ -23,7 +26,8 @@ OPTION_HELP = {
     'api_key': 'Manually provide a One Codex API key',
     'no_pprint': 'Do not pretty-print JSON responses',
     'threads': 'Do not use multiple background threads to upload files',  # noqa
-    'max_threads': 'Specify a different max # of upload threads (defaults to 4)',  # noqa
+    'max_threads': ("Specify a different max # of upload threads (defaults to 4), or 'auto' to tune "
+                    "it while uploading"),
     'verbose': 'Log extra information to STDERR',
     'results': 'Get a JSON array of the metagenomic classification results table',
     'readlevel': 'Get the read-level data as a .tsv file',
@@ -39,6 +43,49 @@ OPTION_HELP = {
                "will allow running without any user intervention, e.g. in a script."),
     'validate': ("Do not validate the FASTA/Q file before uploading. Incompatible with automatic "
                  "paired end interleaving (NOT RECOMMENDED)."),
+    'normalize': ("Strip redundant bytes from the reads before uploading them (trailing whitespace, "
+                  "the names repeated on FASTQ '+' lines and FASTA line wrapping)"),
+    'bin_qualities': ("Bin FASTQ quality scores into Illumina's 8 levels before uploading, which "
+                      "makes them compress much better (this is lossy)"),
+    'check': ("Change how a check of the reads handles the records it finds, as NAME=ACTION or "
+              "NAME=ACTION:VALUE, where ACTION is warn, fix (which, like other cleanups, needs "
+              "--clean) or error (may be repeated). Checks: " + ', '.join(CHECKS) + "; e.g. "
+              "--check min_length=fix:50 --check max_n_fraction=error:0.1"),
+    'sketch': ("Keep a k-mer sketch of each file in the journal, so that later files can be checked "
+               "for duplicates with `onecodex compare`"),
+    'validate_interleave': "Do not automatically find paired files and validate them as pairs",
+    'processes': "Validate this many files at a time (defaults to the number of CPUs)",
+    'json_report': "Print the report of each file as JSON instead of a table",
+    'compare_journal': "The journal of an earlier upload made with --sketch (may be repeated)",
+    'min_containment': ("Report earlier uploads containing at least this fraction of a file's "
+                        "k-mers (defaults to 0.5)"),
+    'compression_level': ("The gzip level (1-9) used to compress uploads. Defaults to 'auto', which "
+                          "adapts the level to the measured CPU and network speed; a range like "
+                          "'1-6' adapts within those bounds."),
+    'max_bandwidth': ("Cap the combined upload rate in bytes per second, e.g. 500K, 10M or 1G "
+                      "(defaults to unlimited)"),
+    'bandwidth_control_file': ("A file that's checked every second for a new bandwidth cap (in the "
+                               "same format as --max-bandwidth, or 0 for unlimited), allowing it "
+                               "to be changed while uploading"),
+    'manifest': ("Upload the files listed in a CSV/TSV manifest with a 'file' column and optional "
+                 "'pair', 'tags' and metadata columns. Re-running it resumes an interrupted or "
+                 "partially failed batch."),
+    'multipart_threshold': ("Upload files at least this big once compressed (e.g. 500M, defaults to "
+                            "100M) in several parts in parallel"),
+    'spool_dir': ("Keep the compressed output of each file in this directory while it's uploaded, so "
+                  "it doesn't have to be recompressed to send or retry it"),
+    'max_spool_size': ("Cap on the disk space used by --spool-dir (e.g. 20G, defaults to 10G); files "
+                       "that don't fit are recompressed instead"),
+    'merge_lanes': ("Upload the files of several lanes of the same library (e.g. _L001 to _L004) as "
+                    "one sample"),
+    'watch': ("Keep uploading FASTA/FASTQ files as they're written into this directory (e.g. by a "
+              "sequencer) until interrupted"),
+    'stream_name': "Filename to give a sample uploaded from stdin (-)",
+    'journal': ("Where to record the progress of an upload, so it can be resumed (for a manifest, "
+                "defaults to <manifest>.journal)"),
+    'distributed': ("Share the upload with other `onecodex upload` processes (e.g. on other nodes) "
+                    "running the same batch, by claiming files from the journal. The journal must "
+                    "be on a filesystem they all share."),
 }
 
 SUPPORTED_EXTENSIONS = ["fa", "fasta", "fq", "fastq",
@@ -57,11 +104,80 @@ def valid_api_key(ctx, param, value):
         return value
 
 
+def valid_threads(ctx, param, value):
+    """
+    Parses a number of threads or "auto" (this is a click callback)
+    """
+    if value == 'auto':
+        return value
+    try:
+        threads = int(value)
+    except ValueError:
+        threads = 0
+    if threads < 1:
+        raise BadParameter("Threads must be 'auto' or a positive number")
+    return threads
+
+
+def valid_compression_level(ctx, param, value):
+    """
+    Parses a compression level of the form "5", "1-6" or "auto" (this is a click callback)
+    """
+    if value == 'auto':
+        return value
+    try:
+        levels = tuple(int(l) for l in value.split('-'))
+    except ValueError:
+        levels = ()
+    if len(levels) not in (1, 2) or not all(1 <= l <= 9 for l in levels) or levels != tuple(sorted(levels)):
+        raise BadParameter("Compression level must be 'auto', a level from 1-9 or a range like 1-6")
+    return levels[0] if len(levels) == 1 else levels
+
+
+def valid_bandwidth(ctx, param, value):
+    """
+    Parses a rate in bytes per second like "10M" (this is a click callback)
+    """
+    if value is None:
+        return value
+    try:
+        return parse_bandwidth(value)
+    except OneCodexException:
+        raise BadParameter("Bandwidth must be a number of bytes per second like 500K, 10M or 1G")
+
+
+def valid_size(ctx, param, value):
+    """
+    Parses a number of bytes like "100M" (this is a click callback)
+    """
+    if value is None:
+        return value
+    try:
+        return int(parse_size(value))
+    except OneCodexException:
+        raise BadParameter("Size must be a number of bytes like 500K, 100M or 1G")
+
+
+def valid_checks(ctx, param, value):
+    """
+    Parses repeated check settings like "min_length=fix:50" into a dict (this is a click callback)
+    """
+    if not value:
+        return None
+    try:
+        checks = dict(parse_check(spec) for spec in value)
+        make_checks(checks)
+    except ValueError as e:
+        raise BadParameter(str(e))
+    return checks
+
+
 def pprint(j, no_pretty):
     """
     Prints as formatted JSON
     """
     if not no_pretty:
+        from potion_client.converter import PotionJSONEncoder
         echo(json.dumps(j, cls=PotionJSONEncoder, sort_keys=True,
                         indent=4, separators=(',', ': ')))
     else:
@@ -71,6 +187,8 @@ def pprint(j, no_pretty):
 def cli_resource_fetcher(ctx, resource, uris):
     """Helper method to parse CLI args in API calls
     """
+    import requests
+
     try:
         _cli_resource_fetcher(ctx, resource, uris)
     except requests.exceptions.HTTPError:
@@ -90,17 +208,16 @@ def _cli_resource_fetcher(ctx, resource, uris):
         cli_log.info("Fetched %i %ss", len(instances), resource)
         pprint([x._resource._properties for x in instances], ctx.obj['NOPPRINT'])
     else:
-        uris = list(set(uris))
+        uris = list(OrderedDict.fromkeys(uris))
         cli_log.info("Fetching %s: %s", resource_name, ",".join(uris))
 
+        # (all at once, rather than making a request for each)
         instances = []
-        for uri in uris:
-            try:
-                instance = getattr(ctx.obj['API'], resource_name).get(uri)
+        for uri, instance in zip(uris, getattr(ctx.obj['API'], resource_name).get_many(uris)):
+            if instance is None:
+                cli_log.error("Could not find %s %s", resource_name, uri)
+            else:
                 instances.append(instance._resource._properties)
-            except requests.exceptions.HTTPError as e:
-                cli_log.error("Could not find %s %s (%d status code)",
-                              resource_name, uri, e.response.status_code)
         pprint(instances, ctx.obj['NOPPRINT'])
 
 
@@ -154,6 +271,8 @@ def download_file_helper(url, input_path):
     """
     Manages the chunked downloading of a file given an url
     """
+    import requests
+
     r = requests.get(url, stream=True)
     if r.status_code != 200:
         cli_log.error("Failed to download file: %s" % r.json()["message"])
@@ -24,14 +24,17 @@ with open('onecodex/version.py') as import_file:
 setup(
     name='onecodex',
     version=__version__,  # noqa
-    packages=find_packages(exclude=['*test*']),
+    packages=find_packages(exclude=['*test*', 'benchmarks']),
     install_requires=['potion-client==2.4.2', 'requests>=2.9', 'click>=6.6',
                       'requests_toolbelt==0.7.0', 'python-dateutil>=2.5.3',
-                      'six>=1.10.0', 'boto3>=1.4.2'],
+                      'six>=1.10.0', 'boto3>=1.4.2',
+                      'futures>=3.0.0; python_version < "3.0"'],
     include_package_data=True,
     zip_safe=False,
     extras_require={
-        'all': ['numpy>=1.11.0', 'pandas>=0.18.1', 'matplotlib>1.5.1', 'networkx>=1.11']
+        'all': ['numpy>=1.11.0', 'pandas>=0.18.1', 'matplotlib>1.5.1', 'networkx>=1.11'],
+        'compression': ['isal>=1.0.0'],
+        'watch': ['inotify_simple>=1.1.0'],
     },
     dependency_links=[],
     author='Kyle McChesney & Nick Greenfield & Roderick Bovee',
@@ -214,7 +214,7 @@ def upload_mocks():
             'upload_aws_access_key_id': 'aws_key',
             'upload_aws_secret_access_key': 'aws_secret_key'
         },
-        'POST::api/import_file_from_s3': '',
+        'POST::api/import_file_from_s3': {'sample_id': 'cd6276c673814123'},
     }
     json_data.update(SCHEMA_ROUTES)
     with mock_requests(json_data):
@@ -239,6 +239,14 @@ def runner():
 
 
 # CLI / FILE SYSTEM FIXTURE
+@pytest.fixture(autouse=True)
+def schema_cache_dir(monkeypatch, tmpdir):
+    # (so tests never read or write the user's own schema cache)
+    cache_dir = str(tmpdir.join('schema'))
+    monkeypatch.setenv('ONE_CODEX_SCHEMA_CACHE', cache_dir)
+    return cache_dir
+
+
 @pytest.fixture(scope='function')
 def mocked_creds_path(monkeypatch, tmpdir):
     # TODO: tmpdir is actually a LocalPath object
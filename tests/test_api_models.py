@@ -1,18 +1,24 @@
 from __future__ import print_function
 import datetime
+import json
+import os
 import pandas as pd
 
 import onecodex
 from onecodex import Api
-from onecodex.exceptions import MethodNotSupported
+from onecodex.exceptions import MethodNotSupported, OneCodexException, UploadException
 
+from mock import patch
 import pytest
 import responses
 
+from tests.conftest import API_DATA, SCHEMA_ROUTES, mock_requests
+
 try:
-    from urllib.parse import unquote_plus  # Py3
+    from urllib.parse import parse_qs, unquote_plus, urlparse  # Py3
 except ImportError:
     from urllib import unquote_plus
+    from urlparse import parse_qs, urlparse
 
 
 def test_api_creation(api_data):
@@ -22,6 +28,30 @@ def test_api_creation(api_data):
     assert True
 
 
+def test_lazy_api_creation(mocked_creds_path):
+    with responses.RequestsMock():  # (which fails any request)
+        ocx = Api(api_key='1eab4217d30d42849dbde0cd1bb94e39',
+                  base_url='http://localhost:3000', cache_schema=True, lazy=True)
+    assert not os.path.exists(os.path.expanduser('~/.onecodex'))
+
+    with mock_requests(API_DATA):
+        sample = ocx.Samples.get('761bc54b97f64980')
+        assert sample.filename == 'SRR2352223.fastq.gz'
+        # (the resources it refers to are loaded too)
+        assert sample.primary_analysis.complete
+        urls = [call.request.url for call in responses.calls]
+    assert 'http://localhost:3000/api/v1/schema' not in urls
+    assert 'http://localhost:3000/api/v1/samples/schema' in urls
+    assert 'http://localhost:3000/api/v1/panels/schema' not in urls
+
+    # the schemas used are cached (and the cache isn't rewritten when they're all used from there)
+    api_data = {k: v for k, v in API_DATA.items() if k not in SCHEMA_ROUTES}
+    with mock_requests(api_data), patch('onecodex.lib.schema_cache.atomic_write') as write:
+        ocx = Api(base_url='http://localhost:3000', cache_schema=True, lazy=True)
+        assert ocx.Samples.get('761bc54b97f64980').primary_analysis.complete
+    assert not write.called
+
+
 def test_sample_get(ocx, api_data):
     sample = ocx.Samples.get('761bc54b97f64980')
     assert sample.size == 302369471
@@ -38,6 +68,32 @@ def test_sample_get(ocx, api_data):
     assert 'isolate' in [t.name for t in tags]
 
 
+def test_sample_get_many(ocx):
+    def instances_callback(request):
+        where = json.loads(parse_qs(urlparse(request.url).query)['where'][0])
+        samples = [s for s in API_DATA['GET::api/v1/samples'] if s['$uri'] in where['$uri']['$in']]
+        return 200, {'X-Total-Count': str(len(samples))}, json.dumps(samples)
+
+    api_data = dict(API_DATA)
+    api_data['GET::api/v1/samples'] = instances_callback
+    ids = ['e3b7e6f1278d46d0', '0000000000000000', '/api/v1/samples/03d55899b4d644df',
+           'e3b7e6f1278d46d0', '002f55a11aae4b8f']
+    with mock_requests(api_data):
+        samples = ocx.Samples.get_many(ids, batch_size=2)
+        calls = list(responses.calls)
+    assert [s.id if s is not None else None for s in samples] == [
+        'e3b7e6f1278d46d0', None, '03d55899b4d644df', 'e3b7e6f1278d46d0', '002f55a11aae4b8f'
+    ]
+
+    # the 4 unique IDs are fetched 2 at a time
+    queries = [unquote_plus(c.request.url) for c in calls
+               if c.request.url.startswith('http://localhost:3000/api/v1/samples?')]
+    assert len(queries) == 2
+    assert any('"$in": ["/api/v1/samples/e3b7e6f1278d46d0", "/api/v1/samples/0000000000000000"]'
+               in query and 'per_page=2' in query for query in queries)
+    assert ocx.Samples.get_many([]) == []
+
+
 def test_dir_method(ocx, api_data):
     sample = ocx.Samples.get('761bc54b97f64980')
 
@@ -191,3 +247,35 @@ def test_where_primary_analysis(ocx, api_data):
         query_in_urls.append(query in url)
 
     assert any(query_in_urls)
+
+
+def test_manifest_metadata(ocx):
+    schema = ocx.Metadata._resource._schema['properties']
+    metadata = ocx.Samples._manifest_metadata({
+        'location_lat': '12.5', 'date_collected': '2017-01-02', 'platform': 'Illumina MiSeq',
+        'site': 'gut'
+    }, schema)
+    assert metadata['location_lat'] == 12.5
+    assert metadata['date_collected'] == datetime.datetime(2017, 1, 2)
+    assert metadata['platform'] == 'Illumina MiSeq'
+    assert metadata['custom'] == {'site': 'gut'}
+
+    with pytest.raises(OneCodexException):
+        ocx.Samples._manifest_metadata({'platform': 'Abacus'}, schema)
+    with pytest.raises(OneCodexException):
+        ocx.Samples._manifest_metadata({'location_lat': 'north'}, schema)
+
+
+def test_upload_async(ocx):
+    with patch('onecodex.lib.upload.upload', side_effect=lambda files, *a, **kw: [files[0][:16]]):
+        futures = ocx.Samples.upload_async(['7428cca4a3a04a8e.fq', 'b1e4b5f87b2e4b4f.fq'])
+        samples = [f.result(timeout=5) for f in futures]
+    assert [s.id for s in samples] == ['7428cca4a3a04a8e', 'b1e4b5f87b2e4b4f']
+    assert all(isinstance(s, ocx.Samples) for s in samples)
+
+    # with no sample ID to bind to, the future fails rather than resolving to an empty sample
+    with patch('onecodex.lib.upload.upload', return_value=[None]):
+        future = ocx.Samples.upload_async('7428cca4a3a04a8e.fq')[0]
+        with pytest.raises(UploadException) as e:
+            future.result(timeout=5)
+    assert 'No sample ID was returned' in str(e.value)
@@ -0,0 +1,159 @@
+from io import BytesIO
+import warnings
+
+from mock import patch
+import pytest
+
+from onecodex.exceptions import ReadCheckWarning, ValidationError, ValidationWarning
+from onecodex.lib import checks as checks_module
+from onecodex.lib.checks import count_in_records, make_checks, parse_check
+from onecodex.lib.inline_validator import FASTXNuclIterator, FASTXTranslator
+
+
+FASTQ = (b'@read1 1:N:0\nACGTACGTACGTACGTACGT\n+\nIIIIIIIIIIIIIIIIIIII\n' +
+         b'@read2 1:N:0\nACGTNNNNNNNNNNNNACGT\n+\nIIIIIIIIIIIIIIIIIIII\n' +
+         b'@read3 1:N:0\nACGTACGT\n+\nIIIIIIII\n' +
+         b'@read1 2:N:0\nACGTACGTACGTACGTACGT\n+\nIIIIIIIIIIIIIIIIIIII\n' +
+         b'@read4 1:N:0\nACGTACGTACGTACGTACGT\n+\nIIIIIIIIIIIII\n')
+
+
+def _read_ids(data, checks, **kwargs):
+    with warnings.catch_warnings(record=True) as caught:
+        warnings.simplefilter('always')
+        reads = FASTXNuclIterator(BytesIO(data), checks=checks, as_raw=True, **kwargs)
+        records = list(reads)
+    return [r[0].split()[0] for r in records], reads, caught
+
+
+def test_count_in_records():
+    records = [b'ACGTN\nNNA', b'n', b'ACGT\r\n', b'A' * 1000 + b'N']
+    assert count_in_records(records, b'Nn') == [3, 1, 0, 1]
+    assert count_in_records(records, b'\r\n') == [1, 0, 2, 0]
+    with patch('onecodex.lib.checks._numpy', return_value=None):
+        assert count_in_records(records, b'Nn') == [3, 1, 0, 1]
+        assert count_in_records(records, b'\r\n') == [1, 0, 2, 0]
+
+
+def test_make_checks():
+    # the existing checks are on by default, but the new ones aren't
+    checks = make_checks()
+    assert [(c.name, c.action) for c in checks] == [('alphabet', 'error'), ('header_tabs', 'fix')]
+    checks = make_checks({'header_tabs': None, 'min_length': ('warn', '50')})
+    assert [(c.name, c.action, c.value) for c in checks] == [
+        ('alphabet', 'error', None), ('min_length', 'warn', 50)
+    ]
+    with pytest.raises(ValueError):
+        make_checks({'min_length': 'warn'})
+    with pytest.raises(ValueError):
+        make_checks({'max_n_fraction': ('ignore', 0.5)})
+    with pytest.raises(ValueError):
+        make_checks({'max_length': ('warn', 500)})
+
+    assert parse_check('min_length=fix:50') == ('min_length', ('fix', '50'))
+    assert parse_check('duplicate_ids=warn') == ('duplicate_ids', 'warn')
+    with pytest.raises(ValueError):
+        parse_check('duplicate_ids')
+
+
+@pytest.mark.parametrize('check,failing,fixed_ids', [
+    (('min_length', 10), b'read3', [b'read1', b'read2', b'read1', b'read4']),
+    (('max_n_fraction', 0.5), b'read2', [b'read1', b'read3', b'read1', b'read4']),
+    # (the later of the duplicates is dropped)
+    ('duplicate_ids', b'read1', [b'read1', b'read2', b'read3', b'read4']),
+    # (and mismatched qualities are trimmed)
+    ('qual_length', b'read4', [b'read1', b'read2', b'read3', b'read1', b'read4']),
+])
+@pytest.mark.parametrize('use_numpy', [True, False])
+def test_checks(check, failing, fixed_ids, use_numpy, monkeypatch):
+    if not use_numpy:
+        monkeypatch.setattr(checks_module, '_numpy', lambda: None)
+    name, value = check if isinstance(check, tuple) else (check, None)
+    all_ids = [b'read1', b'read2', b'read3', b'read1', b'read4']
+
+    # warnings leave the records as they are
+    ids, reads, caught = _read_ids(FASTQ, {name: ('warn', value) if value else 'warn'})
+    assert ids == all_ids
+    assert [w.category for w in caught] == [ReadCheckWarning]
+    assert reads.check_counts == {name: 1}
+    assert not reads.modified
+
+    ids, reads, caught = _read_ids(FASTQ, {name: ('fix', value) if value else 'fix'})
+    assert [w.category for w in caught] == [ValidationWarning]
+    assert reads.modified
+    assert ids == fixed_ids
+
+    with pytest.raises(ValidationError) as e:
+        _read_ids(FASTQ, {name: ('error', value) if value else 'error'})
+    assert failing.decode() in str(e.value)
+
+
+def test_qual_length_fix():
+    reads = FASTXNuclIterator(BytesIO(FASTQ), checks={'qual_length': 'fix'}, as_raw=True)
+    with warnings.catch_warnings():
+        warnings.simplefilter('ignore')
+        last = list(reads)[-1]
+    assert len(last[1]) == len(last[2]) == 13
+
+
+@pytest.mark.parametrize('use_numpy', [True, False])
+def test_fasta_lengths(use_numpy, monkeypatch):
+    if not use_numpy:
+        monkeypatch.setattr(checks_module, '_numpy', lambda: None)
+    fasta = b'>one\nACGTACGTAC\nGTACGTACGT\n>two\nACGTA\nCGT\n'
+    ids, _, _ = _read_ids(fasta, {'min_length': ('fix', 10)})
+    assert ids == [b'one']
+
+
+def test_alphabet_fix():
+    data = b'@read1\nACGTXCGT\n+\nIIIIIIII\n'
+    with pytest.raises(ValidationError):
+        _read_ids(data, None)
+    reads = FASTXNuclIterator(BytesIO(data), checks={'alphabet': 'fix'}, as_raw=True)
+    with warnings.catch_warnings():
+        warnings.simplefilter('ignore')
+        assert list(reads)[0][1] == b'ACGTNCGT'
+
+
+def test_translator_checks():
+    data = FASTQ * 10
+    with warnings.catch_warnings():
+        warnings.simplefilter('ignore')
+        outfile = FASTXTranslator(BytesIO(data), recompress=False,
+                                  checks={'min_length': ('fix', 10), 'qual_length': 'fix'})
+        output = outfile.read()
+    assert output.count(b'@read') == 40
+    assert b'@read3' not in output
+    assert outfile.reads.check_counts == {'min_length': 10, 'qual_length': 10}
+
+    # removing reads from one file of a pair would unpair them
+    with pytest.raises(ValidationError):
+        FASTXTranslator(BytesIO(data), pair=BytesIO(data), recompress=False,
+                        checks={'min_length': ('fix', 10)})
+    # but warnings and fixes that keep every read are fine
+    outfile = FASTXTranslator(BytesIO(data), pair=BytesIO(data), recompress=False,
+                              checks={'min_length': ('error', 5), 'qual_length': 'fix'})
+    assert outfile.reads_pair.checks[2].name == 'min_length'
+
+
+def test_registry():
+    @checks_module.register_check
+    class LowercaseCheck(checks_module.RecordCheck):
+        name = 'lowercase'
+        description = 'lowercase bases'
+        drops_records = False
+
+        def find(self, batch, reads):
+            return [i for i, seq in enumerate(batch.seqs) if seq != seq.upper()]
+
+        def fix(self, batch, failing, reads):
+            for i in failing:
+                batch.seqs[i] = batch.seqs[i].upper()
+
+    try:
+        reads = FASTXNuclIterator(BytesIO(b'>one\nacgt\n>two\nACGT\n'),
+                                  checks={'lowercase': 'fix'})
+        with warnings.catch_warnings():
+            warnings.simplefilter('ignore')
+            assert b''.join(reads) == b'>one\nACGT\n>two\nACGT\n'
+    finally:
+        del checks_module.CHECKS['lowercase']
@@ -2,6 +2,8 @@
 import datetime
 import json
 import os
+import subprocess
+import sys
 
 # Testing imports
 from click.testing import CliRunner
@@ -29,6 +31,24 @@ def test_version(runner):
     assert "onecodex, version" in result.output
 
 
+def test_lazy_imports():
+    # the CLI doesn't import the API (or requests) until a command needs it
+    code = ('import sys; from onecodex.cli import onecodex; sys.argv[0] = "onecodex"\n'
+            'try:\n    onecodex()\nexcept SystemExit:\n    pass\n'
+            'print(sorted(m for m in ["onecodex.api", "requests", "potion_client"] '
+            'if m in sys.modules))')
+    for args in [['--help'], ['samples', '--help'], ['upload', '--help']]:
+        output = subprocess.check_output([sys.executable, '-c', code] + args)
+        assert output.decode().strip().splitlines()[-1] == '[]'
+
+
+def test_subcommand_help_without_api(runner, monkeypatch):
+    monkeypatch.delattr("requests.sessions.Session.request")
+    result = runner.invoke(Cli, ['samples', '--help'])
+    assert result.exit_code == 0
+    assert 'No One Codex API key' not in result.output
+
+
 # Test CLI without base override
 def test_cli_wo_override(api_data, monkeypatch):
     monkeypatch.delattr("requests.sessions.Session.request")
@@ -163,6 +183,7 @@ SEQUENCE = ('ACGTGTCGTAGGTAGCTACGACGTAGCTAACGTGTCGTAGCTACGACGTAGCTA'
     (["temp.fa"], True),
     (["temp.fa", "temp2.fa"], False),
     (["temp.fa", "temp2.fa"], True),
+    (["temp.fa", "temp2.fa"], 'auto'),
 ])
 def test_standard_uploads(runner, upload_mocks, files, threads):
     """Test single and multi file uploads, with and without threads
@@ -172,6 +193,8 @@ def test_standard_uploads(runner, upload_mocks, files, threads):
         args = ['--api-key', '01234567890123456789012345678901', 'upload']
         if not threads:
             args += ['--max-threads', '1']
+        elif threads == 'auto':
+            args += ['--max-threads', 'auto']
         for f in files:
             args.append(f)
             with open(f, mode='w') as f_out:
@@ -183,6 +206,241 @@ def test_standard_uploads(runner, upload_mocks, files, threads):
         assert 'ab6276c673814123' in result.output  # mocked file id
 
 
+@pytest.mark.parametrize("level,valid", [
+    ('auto', True),
+    ('3', True),
+    ('1-6', True),
+    ('0', False),
+    ('6-1', False),
+    ('fast', False),
+])
+def test_upload_compression_level(runner, upload_mocks, level, valid):
+    with runner.isolated_filesystem():
+        with open('temp.fa', mode='w') as f_out:
+            f_out.write('>Test fasta\n')
+            f_out.write(SEQUENCE)
+        args = ['--api-key', '01234567890123456789012345678901', 'upload',
+                '--compression-level', level, 'temp.fa']
+        result = runner.invoke(Cli, args)
+        if valid:
+            assert result.exit_code == 0
+            assert 'gzip level' in result.output
+        else:
+            assert result.exit_code != 0
+            assert 'Compression level must be' in result.output
+
+
+@pytest.mark.parametrize("bandwidth,valid", [
+    ('10M', True),
+    ('500k', True),
+    ('fast', False),
+])
+def test_upload_max_bandwidth(runner, upload_mocks, bandwidth, valid):
+    with runner.isolated_filesystem():
+        with open('temp.fa', mode='w') as f_out:
+            f_out.write('>Test fasta\n')
+            f_out.write(SEQUENCE)
+        args = ['--api-key', '01234567890123456789012345678901', 'upload',
+                '--max-bandwidth', bandwidth, 'temp.fa']
+        result = runner.invoke(Cli, args)
+        if valid:
+            assert result.exit_code == 0
+            assert 'ab6276c673814123' in result.output
+        else:
+            assert result.exit_code != 0
+            assert 'Bandwidth must be' in result.output
+
+
+@pytest.mark.parametrize("check,exit_code,message", [
+    ('min_length=warn:100', 0, 'ab6276c673814123'),
+    ('min_length=error:500', 1, 'has reads shorter than 500 bases: Test fasta'),
+    ('min_length=error', 2, 'needs a value'),
+    ('alphabet=warn', 2, 'can only fix or error'),
+    ('max_n_fraction', 2, 'must be given as name=action'),
+    ('typo=warn', 2, 'Unknown check(s): typo'),
+])
+def test_upload_checks(runner, upload_mocks, check, exit_code, message):
+    with runner.isolated_filesystem():
+        with open('temp.fa', mode='w') as f_out:
+            f_out.write('>Test fasta\n')
+            f_out.write(SEQUENCE)
+        args = ['--api-key', '01234567890123456789012345678901', 'upload', '--check', check,
+                'temp.fa']
+        result = runner.invoke(Cli, args)
+        assert result.exit_code == exit_code
+        assert message in result.output
+
+
+def test_upload_max_spool_size(runner, upload_mocks):
+    with runner.isolated_filesystem():
+        with open('temp.fa', mode='w') as f_out:
+            f_out.write('>Test fasta\n')
+            f_out.write(SEQUENCE)
+        args = ['--api-key', '01234567890123456789012345678901', 'upload',
+                '--max-spool-size', '1G', 'temp.fa']
+        result = runner.invoke(Cli, args)
+        assert result.exit_code != 0
+        assert '--max-spool-size caps the space used in --spool-dir' in result.output
+
+        result = runner.invoke(Cli, args + ['--spool-dir', '.'])
+        assert result.exit_code == 0
+        assert 'ab6276c673814123' in result.output
+
+
+def test_upload_manifest(runner, upload_mocks):
+    with runner.isolated_filesystem():
+        for f in ['temp1.fa', 'temp2.fa']:
+            with open(f, mode='w') as f_out:
+                f_out.write('>Test fasta\n')
+                f_out.write(SEQUENCE)
+        with open('manifest.csv', mode='w') as f_out:
+            f_out.write('file\ntemp1.fa\ntemp2.fa\n')
+        args = ['--api-key', '01234567890123456789012345678901', 'upload',
+                '--manifest', 'manifest.csv']
+        result = runner.invoke(Cli, args)
+        assert result.exit_code == 0
+        assert '2 of 2 file(s) in the manifest are uploaded' in result.output
+        assert os.path.exists('manifest.csv.journal')
+
+        # a re-run has nothing left to do
+        result = runner.invoke(Cli, args)
+        assert result.exit_code == 0
+        assert 'Skipping 2 already uploaded file(s)' in result.output
+
+
+def test_upload_stdin(runner, upload_mocks):
+    import mock
+
+    def side_effect(*args, **kwargs):
+        args[0].read()
+        return None
+
+    args = ['--api-key', '01234567890123456789012345678901', 'upload', '--stream-name', 'run1.fa',
+            '-']
+    with mock.patch('onecodex.lib.upload.upload_large_file') as mp:
+        mp.side_effect = side_effect
+        result = runner.invoke(Cli, args, input='>Test fasta\n' + SEQUENCE)
+        assert mp.call_count == 1
+        assert mp.call_args[0][1] == 'run1.fa.gz'
+    assert result.exit_code == 0
+
+    result = runner.invoke(Cli, args + ['-'], input='>Test fasta\n' + SEQUENCE)
+    assert result.exit_code != 0
+    assert 'Only a single stream' in result.output
+
+    for option in [['--spool-dir', '.'], ['--multipart-threshold', '1G'], ['--merge-lanes']]:
+        result = runner.invoke(Cli, args + option, input='>Test fasta\n' + SEQUENCE)
+        assert result.exit_code != 0
+        assert "don't apply to a stream" in result.output
+
+
+def test_upload_lanes(runner, upload_mocks):
+    import mock
+
+    with runner.isolated_filesystem():
+        files = ['lib_L001_R1.fa', 'lib_L002_R1.fa', 'lib_L001_R2.fa', 'lib_L002_R2.fa']
+        for f in files:
+            with open(f, mode='w') as f_out:
+                f_out.write('>Test fasta\n')
+                f_out.write(SEQUENCE)
+
+        args = ['--api-key', '01234567890123456789012345678901', 'upload'] + files
+        with mock.patch('onecodex.lib.upload.upload_file') as mp:
+            result = runner.invoke(Cli, args, input='Y\nY\n')
+            # the two pairs of lanes are interleaved and merged into one upload
+            assert mp.call_count == 1
+            assert mp.call_args[0][1] == 'lib_fa.gz'
+        assert 'several lanes of the same libraries' in result.output
+        assert result.exit_code == 0
+
+
+def test_validate(runner):
+    with runner.isolated_filesystem():
+        for filename, header in [('good_R1.fa', 'Test fasta'), ('good_R2.fa', 'Test fasta'),
+                                 ('tabs.fa', 'Test\tfasta')]:
+            with open(filename, mode='w') as f_out:
+                f_out.write('>{}\n'.format(header))
+                f_out.write(SEQUENCE)
+
+        result = runner.invoke(Cli, ['validate', 'good_R1.fa', 'good_R2.fa'])
+        assert result.exit_code == 0
+        assert 'good_R1.fa & good_R2.fa' in result.output
+
+        # (without --clean, records that would be modified are errors)
+        result = runner.invoke(Cli, ['validate', '--processes', '2', 'good_R1.fa', 'tabs.fa'])
+        assert result.exit_code == 1
+        assert 'ERROR (--clean fixes this)' in result.output
+        assert 'tabs.fa can not have tabs in headers' in result.output
+
+        result = runner.invoke(Cli, ['validate', '--clean', '--json', 'tabs.fa'])
+        assert result.exit_code == 0
+        report = json.loads(result.output)[0]
+        assert report['records'] == 1
+        assert report['error'] is None
+        assert report['modified'] is True
+
+
+def test_compare(runner):
+    import random
+    from onecodex.lib.journal import UploadJournal
+    from onecodex.lib.sketch import sketch_file
+
+    rand = random.Random(42)
+    genome = ''.join(rand.choice('ACGT') for _ in range(100000))
+    with runner.isolated_filesystem():
+        with open('old.fa', mode='w') as f_out:
+            f_out.write('>Test fasta\n' + genome + '\n')
+        with open('new.fa', mode='w') as f_out:
+            f_out.write('>Same sequence, different name\n' + genome[:60000] + '\n')
+        with open('other.fa', mode='w') as f_out:
+            f_out.write('>Test fasta\n' + SEQUENCE * 100)
+
+        journal = UploadJournal('uploads.journal')
+        journal.add('old.fa')
+        journal.set_sketch('old.fa', sketch_file('old.fa').to_bytes())
+        journal.set_state('old.fa', journal.CONFIRMED, sample_id='abc123')
+        journal.close()
+
+        result = runner.invoke(Cli, ['compare', 'other.fa', '--journal', 'uploads.journal'])
+        assert result.exit_code == 0
+        assert 'other.fa: no similar uploads' in result.output
+
+        result = runner.invoke(Cli, ['compare', 'new.fa', '--journal', 'uploads.journal'])
+        assert result.exit_code == 1
+        assert 'new.fa: 100% of its k-mers are in' in result.output
+        assert 'old.fa (sample abc123' in result.output
+
+
+def test_upload_watch(runner, upload_mocks):
+    import mock
+
+    with runner.isolated_filesystem():
+        os.mkdir('run')
+        args = ['--api-key', '01234567890123456789012345678901', 'upload', '--watch', 'run']
+        with mock.patch('onecodex.models.sample.watch') as p:
+            result = runner.invoke(Cli, args + ['--multipart-threshold', '1G', '--spool-dir', '.',
+                                                '--max-spool-size', '2G'])
+            assert p.call_count == 1
+            assert p.call_args[0][0] == 'run'
+            assert p.call_args[1]['multipart_threshold'] == 1000 ** 3
+            assert p.call_args[1]['spool'].directory == '.'
+            assert p.call_args[1]['spool'].max_size == 2 * 1000 ** 3
+        assert result.exit_code == 0
+        assert 'Uploading files written into run' in result.output
+
+        # lanes can't be merged as files are uploaded one by one
+        result = runner.invoke(Cli, args + ['--merge-lanes'])
+        assert result.exit_code != 0
+        assert '--merge-lanes cannot be used with --watch' in result.output
+
+        with open('temp.fa', mode='w') as f_out:
+            f_out.write('>Test fasta\n')
+            f_out.write(SEQUENCE)
+        result = runner.invoke(Cli, args + ['temp.fa'])
+        assert result.exit_code != 0
+        assert 'cannot be used with --watch' in result.output
+
+
 def test_empty_upload(runner, upload_mocks):
     with runner.isolated_filesystem():
         f = 'tmp.fa'
@@ -0,0 +1,101 @@
+import gzip
+from io import BytesIO
+
+import pytest
+
+from onecodex.exceptions import OneCodexException
+from onecodex.lib.compression import (AdaptiveCompressionLevel, GzipWriter, ThroughputMeter,
+                                      available_backends, get_backend)
+from onecodex.lib.inline_validator import FASTXTranslator
+
+
+CONTENT = b''.join(
+    b'>Test_' + str(i).encode() + b'\n' + b'ACGATCGATCGATCGAACGATCGTACGTAGCCGTCGATCGACACGA'[i:] + b'\n'
+    for i in range(30)
+)
+
+
+def _gzip(data):
+    out = BytesIO()
+    with gzip.GzipFile(fileobj=out, mode='wb') as f:
+        f.write(data)
+    return out.getvalue()
+
+
+def test_backend_fallback():
+    assert 'zlib' in available_backends()
+    assert available_backends()[-1] == 'zlib'
+    assert get_backend().name == available_backends()[0]
+
+    backend = get_backend('zlib')
+    assert get_backend(backend) is backend
+
+    with pytest.raises(OneCodexException):
+        get_backend('lzma')
+
+
+@pytest.mark.parametrize('name', available_backends())
+@pytest.mark.parametrize('level', [1, 5, 9])
+def test_backend_roundtrip(name, level):
+    out = BytesIO()
+    writer = GzipWriter(out, level, backend=name)
+    writer.write(CONTENT[:100])
+    writer.write(CONTENT[100:])
+    writer.close()
+
+    # output has to be readable by the stdlib and by the backend itself
+    assert gzip.GzipFile(fileobj=BytesIO(out.getvalue())).read() == CONTENT
+    assert get_backend(name).open(BytesIO(out.getvalue())).read() == CONTENT
+
+
+@pytest.mark.parametrize('name', available_backends())
+def test_translator_backends(tmpdir, name):
+    path = str(tmpdir.join('test.fa.gz'))
+    with open(path, 'wb') as f:
+        f.write(_gzip(CONTENT))
+    translator = FASTXTranslator(open(path, 'rb'), compression_backend=name)
+    assert translator.reads.compression_backend.name == name
+    assert gzip.GzipFile(fileobj=BytesIO(translator.read())).read() == CONTENT
+
+
+@pytest.mark.parametrize('name', available_backends())
+def test_switching_levels(name):
+    out = BytesIO()
+    writer = GzipWriter(out, 1, backend=name)
+    writer.write(CONTENT)
+    writer.set_level(9)
+    writer.write(CONTENT)
+    writer.close()
+    assert writer.bytes_out == len(out.getvalue())
+    assert gzip.GzipFile(fileobj=BytesIO(out.getvalue())).read() == CONTENT * 2
+
+
+@pytest.mark.parametrize('rate,best_level', [
+    (1e10, 1),  # fast network: spend as little time compressing as possible
+    (1e5, 9),  # slow network: squeeze as much as possible
+])
+def test_adaptive_level(rate, best_level):
+    meter = ThroughputMeter(window=0)
+    controller = AdaptiveCompressionLevel(network=meter)
+
+    # the first blocks probe the levels we're choosing between
+    probed = [controller.next_level() for _ in range(5)]
+    assert probed == [1, 3, 5, 7, 9]
+    for level in probed:
+        # higher levels are slower but smaller
+        controller.record_compression(level, 1000000, 400000 - 20000 * level, 0.002 * level ** 2)
+
+    # without a network estimate we stick with the default level
+    assert controller.next_level() == 5
+
+    meter.record(rate, 1)
+    assert controller.next_level() == best_level
+
+
+def test_adaptive_level_bounds():
+    controller = AdaptiveCompressionLevel(min_level=2, max_level=4)
+    assert [controller.next_level() for _ in range(3)] == [2, 3, 4]
+    assert controller.next_level() == 4
+
+    with pytest.raises(OneCodexException):
+        AdaptiveCompressionLevel(min_level=0)
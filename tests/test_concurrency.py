@@ -0,0 +1,59 @@
+from threading import Thread
+import time
+
+from onecodex.lib.concurrency import AdjustableSemaphore, ConcurrencyTuner
+
+
+def test_adjustable_semaphore():
+    semaphore = AdjustableSemaphore(1)
+    semaphore.acquire()
+
+    acquired = []
+    thread = Thread(target=lambda: acquired.append(semaphore.acquire()))
+    thread.daemon = True
+    thread.start()
+    time.sleep(0.05)
+    assert acquired == []
+
+    # raising the limit lets the waiting thread through
+    semaphore.set_limit(2)
+    thread.join(1)
+    assert acquired == [None]
+
+
+def test_tuner_hill_climbing():
+    tuner = ConcurrencyTuner(initial=2, max_workers=10)
+    assert tuner.limit == 2
+
+    # keep adding workers while throughput (measured at the current limit) improves
+    assert tuner.adjust(100) == 3
+    assert tuner.adjust(150) == 4
+    assert tuner.adjust(190) == 5
+    # throughput dropped, so turn around
+    assert tuner.adjust(170) == 4
+    # a plateau holds steady
+    assert tuner.adjust(172) == 4
+    assert tuner.best_limit == 4
+
+
+def test_tuner_backs_off():
+    tuner = ConcurrencyTuner(initial=8, max_workers=10)
+    # errors halve the number of workers
+    assert tuner.adjust(100, errors=2) == 4
+    # as does a saturated CPU (by one)
+    assert tuner.adjust(100, cpu=0.95) == 3
+    assert tuner.adjust(100, errors=1) == 1
+    # but never below the minimum
+    assert tuner.adjust(100, errors=1) == 1
+
+
+def test_tuner_settles():
+    tuner = ConcurrencyTuner(initial=2, max_workers=10, settle_after=2)
+    tuner.adjust(100)  # 2 workers -> 3
+    tuner.adjust(200)  # 3 workers -> 4
+    tuner.adjust(150)  # 4 workers, reversal -> 3
+    assert not tuner.settled
+    tuner.adjust(100)  # 3 workers, reversal so settle on the best (3)
+    assert tuner.settled
+    assert tuner.limit == 3
+    assert tuner.adjust(300) == 3
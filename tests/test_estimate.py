@@ -0,0 +1,89 @@
+from __future__ import division
+import bz2
+import gzip
+from io import BytesIO
+import random
+
+from mock import patch
+import pytest
+
+from onecodex.lib.estimate import estimate_upload
+from onecodex.lib.upload import upload
+
+
+def _fastq(n_reads, seed=42):
+    rand = random.Random(seed)
+    records = []
+    for i in range(n_reads):
+        seq = ''.join(rand.choice('ACGT') for _ in range(100))
+        records.append('@read{}\n{}\n+\n{}\n'.format(i, seq, 'I' * 100))
+    return ''.join(records).encode()
+
+
+def _gzip(data, level=5):
+    out = BytesIO()
+    with gzip.GzipFile(fileobj=out, mode='wb', compresslevel=level) as f:
+        f.write(data)
+    return out.getvalue()
+
+
+def test_estimate_small_file_exact(tmpdir):
+    data = _fastq(100)
+    path = tmpdir.join('reads.fq')
+    path.write_binary(data)
+
+    estimate = estimate_upload(str(path))
+    assert estimate.exact
+    assert estimate.disk_size == estimate.data_size == len(data)
+    # about the same as compressing it outright (the fastest backend may compress differently)
+    assert 0.9 < estimate.upload_size / len(_gzip(data)) < 1.1
+
+
+@pytest.fixture(scope='module')
+def many_reads():
+    # bigger than a bzip2 block
+    return _fastq(20000)
+
+
+@pytest.mark.parametrize('compress', [None, _gzip, bz2.compress])
+def test_estimate_sampled(tmpdir, many_reads, compress):
+    data = many_reads
+    path = tmpdir.join('reads.fq')
+    path.write_binary(data if compress is None else compress(data))
+
+    estimate = estimate_upload(str(path), n_samples=4, sample_size=64 * 1024)
+    assert not estimate.exact
+    assert 0.9 < estimate.data_size / len(data) < 1.1
+    actual = len(_gzip(data))
+    assert 0.85 < estimate.upload_size / actual < 1.15
+    assert estimate.seconds(bandwidth=1e6) > estimate.upload_size / 1e6
+
+
+def test_estimate_pair(tmpdir):
+    r1, r2 = tmpdir.join('reads_R1.fq'), tmpdir.join('reads_R2.fq')
+    r1.write_binary(_fastq(100, seed=1))
+    r2.write_binary(_gzip(_fastq(100, seed=2)))
+
+    estimate = estimate_upload((str(r1), str(r2)))
+    assert estimate.exact
+    assert estimate.data_size == 2 * len(_fastq(100))
+
+
+def test_estimate_corrupt_file(tmpdir):
+    path = tmpdir.join('reads.fq.gz')
+    path.write_binary(b'\x1f\x8b' + b'not really gzip' * 100)
+    with pytest.raises(IOError):
+        estimate_upload(str(path))
+
+
+def test_upload_routes_by_estimate(tmpdir, many_reads):
+    # 4MB on disk, but well under 2MB once compressed
+    path = tmpdir.join('reads.fq')
+    path.write_binary(many_reads)
+
+    uf = 'onecodex.lib.upload.upload_file'
+    ulf = 'onecodex.lib.upload.upload_large_file'
+    with patch(uf) as sm_upload, patch(ulf) as lg_upload:
+        upload([str(path)], None, None, None, multipart_threshold=2 * 1000 * 1000)
+    assert sm_upload.call_count == 1
+    assert lg_upload.call_count == 0
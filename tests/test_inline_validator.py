@@ -1,14 +1,18 @@
 import bz2
 import gzip
 from io import BytesIO
+import os
 import random
 import sys
 import warnings
+import zlib
 
 import pytest
 
-from onecodex.exceptions import ValidationError, ValidationWarning
-from onecodex.lib.inline_validator import FASTXNuclIterator, FASTXReader, FASTXTranslator
+from onecodex.exceptions import PassthroughAborted, ValidationError, ValidationWarning
+from onecodex.lib.inline_validator import (FASTXNuclIterator, FASTXPassthroughReader, FASTXReader,
+                                           FASTXTranslator, FileGroup, RewindableStream)
+from onecodex.lib.spool import DiskSpool
 
 
 # Sample files
@@ -109,6 +113,9 @@ def test_bzip_file(runner):
             f.write(SAMPLE_FILES['GZIPPABLE'])
         translator = FASTXTranslator(open('myfasta.fa.bz2', mode='rb'), recompress=False)
         assert translator.read() == SAMPLE_FILES['GZIPPABLE']
+        # progress is measured through the bzipped file
+        assert translator.reads.bytes_left == 0
+        translator.close()
 
 
 def test_translator_to_reader(runner):
@@ -128,6 +135,92 @@ def test_translator_to_reader(runner):
         reader.close()
 
 
+def test_passthrough_reader(runner):
+    with runner.isolated_filesystem():
+        with gzip.open('myfasta.fa.gz', mode='w') as f:
+            f.write(SAMPLE_FILES['GZIPPABLE'])
+
+        translator = FASTXTranslator(open('myfasta.fa.gz', mode='rb'))
+        assert translator.can_passthrough
+        reader = FASTXPassthroughReader(translator.reads.file_obj.fileobj)
+        raw = open('myfasta.fa.gz', mode='rb').read()
+        assert len(reader) == len(raw)
+        assert reader.read(10) + reader.read() == raw
+        assert reader.reads.bytes_left == 0
+        reader.seek(0)
+        assert reader.read() == raw
+        reader.close()
+
+        # modifying a record aborts the passthrough
+        warnings.filterwarnings('ignore', category=ValidationWarning)
+        with gzip.open('mytabbed.fq.gz', mode='w') as f:
+            f.write(SAMPLE_FILES['TABBED_FASTQ'])
+        reader = FASTXPassthroughReader(open('mytabbed.fq.gz', mode='rb'))
+        with pytest.raises(PassthroughAborted):
+            reader.read()
+        reader.close()
+
+
+def test_normalize():
+    fastq = b'@r1 \nACGT\n+r1\nIIII \n@r2\nACGT\n+\nIIII\n'
+    reader = FASTXTranslator(BytesIO(fastq), recompress=False, check_filename=False,
+                             normalize=True)
+    assert reader.read() == b'@r1\nACGT\n+\nIIII\n@r2\nACGT\n+\nIIII\n'
+    assert reader.modified
+    assert reader.normalized_size == 4
+
+    fasta = b'>c1\r\nACGTACGT\nACGT\nAC\n>c2\nACGT\n'
+    reader = FASTXTranslator(BytesIO(fasta), recompress=False, check_filename=False,
+                             normalize=True)
+    assert reader.read() == b'>c1\nACGTACGTACGTAC\n>c2\nACGT\n'
+    assert reader.normalized_size == 3
+
+    # files that are already normal are left alone
+    normal = b'@r1\nACGT\n+\nIIII\n' * 5
+    reader = FASTXTranslator(BytesIO(normal), recompress=False, check_filename=False,
+                             normalize=True)
+    assert reader.read() == normal
+    assert not reader.modified
+
+
+def test_quality_binning(runner):
+    rand = random.Random(42)
+    quals = [''.join(chr(33 + rand.randint(2, 41)) for _ in range(100)) for _ in range(2000)]
+    fastq = ''.join('@r{}\n{}\n+\n{}\n'.format(i, 'ACGT' * 25, q)
+                    for i, q in enumerate(quals)).encode()
+    reader = FASTXTranslator(BytesIO(fastq), recompress=False, check_filename=False,
+                             quality_bins=True)
+    binned = reader.read().split(b'\n')[3::4]
+    assert set(b''.join(binned)) == set(b"'07<BFI")
+    assert reader.modified
+    assert reader.binning_savings() > 0.3 * len(zlib.compress(''.join(quals).encode(), 5))
+
+    # custom bins
+    reader = FASTXTranslator(BytesIO(fastq), recompress=False, check_filename=False,
+                             quality_bins=[(0, 10), (20, 30)])
+    assert set(b''.join(reader.read().split(b'\n')[3::4])) == set(b'+?')
+
+    with runner.isolated_filesystem():
+        with gzip.open('reads.fq.gz', mode='w') as f:
+            f.write(fastq)
+        assert FASTXTranslator(open('reads.fq.gz', 'rb')).can_passthrough
+        assert not FASTXTranslator(open('reads.fq.gz', 'rb'), quality_bins=True).can_passthrough
+
+
+def test_normalize_aborts_passthrough(runner):
+    with runner.isolated_filesystem():
+        with gzip.open('reads.fq.gz', mode='w') as f:
+            f.write(b''.join(b'@read%d\nACGT\n+read%d\nIIII\n' % (i, i) for i in range(100)))
+        reader = FASTXPassthroughReader(open('reads.fq.gz', mode='rb'))
+        reader.read()
+        reader.close()
+
+        reader = FASTXPassthroughReader(open('reads.fq.gz', mode='rb'), normalize=True)
+        with pytest.raises(PassthroughAborted):
+            reader.read()
+        reader.close()
+
+
 @pytest.mark.parametrize('file_id,filename,validates,allow_iupac,modified', [
     ('VALID_FASTQ', 'my.fq', True, False, False),
     ('INVALID_FASTQ', 'my.fq', False, False, False),
@@ -216,3 +309,170 @@ def test_wrapper_speed():
                       for i in range(200))
     wrapper = FASTXTranslator(BytesIO(data))
     assert len(wrapper.read()) < len(data)
+
+
+def test_adaptive_compression_replay():
+    # enough data for several blocks, so the level changes while probing
+    rng = random.Random(0)
+    seqs = [''.join(rng.choice('ACGT') for _ in range(100)).encode() for _ in range(100)]
+    data = b''.join(b'>read_' + str(i).encode() + b'\n' + rng.choice(seqs) + b'\n'
+                    for i in range(20000))
+
+    translator = FASTXTranslator(BytesIO(data), compression_level='auto')
+    total = len(translator)
+    assert len(translator.checked_buffer.level_schedule) > 5
+    assert len(set(translator.checked_buffer.level_schedule)) > 1
+
+    # after the length pre-pass, reading again replays the same levels (and so the same length)
+    compressed = translator.read()
+    assert len(compressed) == total
+    assert gzip.GzipFile(fileobj=BytesIO(compressed)).read() == data
+    assert sum(translator.compression_levels.values()) == len(data)
+
+
+class Pipe(object):
+    """A readable stream that can't be sought (or stat'd), like stdin."""
+    def __init__(self, data):
+        self._data = BytesIO(data)
+
+    def read(self, n=-1):
+        return self._data.read(n)
+
+    def close(self):
+        pass
+
+
+def test_rewindable_stream():
+    stream = RewindableStream(Pipe(b'0123456789'), spool_size=4)
+    assert stream.read(3) == b'012'
+    stream.seek(0)
+    assert stream.read(2) == b'01'
+    assert stream.read(4) == b'2345'
+    assert stream.tell() == 6
+    # past the spool, there's no going back
+    with pytest.raises(IOError):
+        stream.seek(0)
+    assert stream.read() == b'6789'
+
+
+@pytest.mark.parametrize('compress', [None, gzip.compress, bz2.compress])
+def test_validate_stream(compress):
+    data = SAMPLE_FILES['VALID_FASTQ'] * 1000
+    stream = Pipe(data if compress is None else compress(data))
+    reader = FASTXTranslator(RewindableStream(stream), check_filename=False, recompress=False)
+    assert reader.reads.total_size is None
+    assert reader.read() == data
+    reader.close()
+
+
+def _write_lanes(tmpdir, prefix, lanes):
+    paths = []
+    for i, data in enumerate(lanes, 1):
+        path = tmpdir.join('{}_L00{}_R1.fq'.format(prefix, i))
+        if data[:1] == b'\x1f':
+            path = tmpdir.join('{}_L00{}_R1.fq.gz'.format(prefix, i))
+        path.write_binary(data)
+        paths.append(str(path))
+    return paths
+
+
+def test_file_group(tmpdir):
+    lane1 = b'@r1\nACGT\n+\nIIII\n@r2\nACGT\n+\nIIII\n' * 10
+    lane2 = b'@r3\nTTTT\n+\nIIII\n' * 10
+    lane3 = b'@r4\nGGGG\n+\nIIII'  # no trailing newline
+    paths = _write_lanes(tmpdir, 's', [lane1, gzip.compress(lane2), lane3])
+    progress = []
+    reader = FASTXTranslator(FileGroup([open(p, 'rb') for p in paths]), recompress=False,
+                             progress_callback=lambda f, size, validation: progress.append(size))
+    assert reader.reads.file_type == 'FASTQ'
+    expected = lane1 + lane2 + lane3 + b'\n'
+    assert reader.read() == expected
+    assert progress[-1] == sum(os.path.getsize(p) for p in paths)
+
+    # it can be rewound (e.g. to retry an upload)
+    reader.seek(0)
+    assert reader.read() == expected
+    reader.close()
+
+
+def test_file_group_pairs(tmpdir):
+    r1 = _write_lanes(tmpdir, 's', [b'@a1\nAAAA\n+\nIIII\n', b'@b1\nCCCC\n+\nIIII\n'])
+    r2 = _write_lanes(tmpdir, 't', [b'@a2\nGGGG\n+\nIIII\n', b'@b2\nTTTT\n+\nIIII\n'])
+    reader = FASTXTranslator(FileGroup([open(p, 'rb') for p in r1]),
+                             pair=FileGroup([open(p, 'rb') for p in r2]), recompress=False)
+    # interleaved lane by lane
+    assert reader.read().split(b'\n')[::4] == [b'@a1', b'@a2', b'@b1', b'@b2', b'']
+
+
+def test_file_group_mixed_types(tmpdir):
+    paths = _write_lanes(tmpdir, 's', [b'@r1\nACGT\n+\nIIII\n' * 10, b'>r2\nACGT\n' * 10])
+    group = FileGroup([open(p, 'rb') for p in paths])
+    reader = FASTXTranslator(group, recompress=False)
+    with pytest.raises(ValidationError):
+        reader.read()
+
+
+def _write_reads(tmpdir, n_reads=20000):
+    path = str(tmpdir.join('reads.fq'))
+    with open(path, 'wb') as f:
+        f.write(b''.join(b'@r%d\nACGTACGTNN\n+\nIIIIIIIIII\n' % i for i in range(n_reads)))
+    return path
+
+
+def _spooled_translator(path, spool):
+    progress = []
+    reader = FASTXTranslator(open(path, 'rb'), spool=spool, compression_level=5,
+                             progress_callback=lambda f, size, validation: progress.append(
+                                 (size, validation)))
+    return reader, progress
+
+
+def test_spooled_translator(tmpdir):
+    path = _write_reads(tmpdir)
+    expected = gzip.decompress(FASTXTranslator(open(path, 'rb'), compression_level=5).read())
+
+    spool = DiskSpool(str(tmpdir), max_size=None)
+    reader, progress = _spooled_translator(path, spool)
+    total = len(reader)
+    assert progress[-1] == (os.path.getsize(path), True)
+    assert spool.used == total
+    compressor = reader.checked_buffer
+
+    # sending it (and retrying part way through) replays the spooled output
+    first = reader.read(total // 2)
+    reader.seek(0)
+    assert len(reader) == total
+    data = reader.read()
+    assert reader.checked_buffer is compressor
+    assert len(data) == total and data[:len(first)] == first
+    assert gzip.decompress(data) == expected
+    assert progress[-1] == (os.path.getsize(path), False)
+    reader.close()
+    assert spool.used == 0
+
+
+def test_spooled_translator_mid_stream(tmpdir):
+    path = _write_reads(tmpdir)
+
+    # rewinding before reaching the end replays what's been spooled, then carries on
+    reader, _ = _spooled_translator(path, DiskSpool(str(tmpdir)))
+    first = reader.read(1000)
+    reader.seek(0)
+    data = reader.read(500) + reader.read(1000) + reader.read()
+    assert data[:1000] == first
+    assert gzip.decompress(data).count(b'@r') == 20000
+    reader.close()
+
+
+def test_spool_cap(tmpdir):
+    path = _write_reads(tmpdir)
+
+    # once the spool's full, the file's recompressed as usual
+    spool = DiskSpool(str(tmpdir), max_size=1000)
+    reader, _ = _spooled_translator(path, spool)
+    total = len(reader)
+    assert spool.used == 0
+    data = reader.read()
+    assert len(data) == total
+    assert gzip.decompress(data).count(b'@r') == 20000
+    reader.close()
@@ -0,0 +1,99 @@
+import os
+
+import pytest
+
+from onecodex.exceptions import OneCodexException
+from onecodex.lib.journal import UploadJournal
+from onecodex.lib.manifest import read_manifest
+
+
+def _write(path, content):
+    with open(path, 'w') as f:
+        f.write(content)
+
+
+def test_read_manifest(tmpdir):
+    tmpdir = str(tmpdir)
+    for name in ['a.fq', 'b_R1.fq', 'b_R2.fq']:
+        _write(os.path.join(tmpdir, name), '')
+
+    manifest = os.path.join(tmpdir, 'manifest.tsv')
+    _write(manifest, 'file\tpair\ttags\tplatform\tsite\n'
+                     'a.fq\t\t\tIllumina MiSeq\tgut\n'
+                     'b_R1.fq\tb_R2.fq\tisolate; batch 2\t\t\n')
+    entries = read_manifest(manifest)
+    assert entries[0].files == os.path.join(tmpdir, 'a.fq')
+    assert entries[0].metadata == {'platform': 'Illumina MiSeq', 'site': 'gut'}
+    assert entries[0].tags == []
+    assert entries[1].files == (os.path.join(tmpdir, 'b_R1.fq'), os.path.join(tmpdir, 'b_R2.fq'))
+    assert entries[1].metadata == {}
+    assert entries[1].tags == ['isolate', 'batch 2']
+
+    # CSVs are also supported
+    manifest = os.path.join(tmpdir, 'manifest.csv')
+    _write(manifest, 'file,tags\na.fq,"one,two"\n')
+    assert read_manifest(manifest)[0].tags == ['one', 'two']
+
+
+def test_read_manifest_errors(tmpdir):
+    manifest = os.path.join(str(tmpdir), 'manifest.csv')
+    _write(manifest, 'filename\na.fq\n')
+    with pytest.raises(OneCodexException) as e:
+        read_manifest(manifest)
+    assert '"file" column' in str(e.value)
+
+    _write(manifest, 'file\nmissing.fq\n')
+    with pytest.raises(OneCodexException) as e:
+        read_manifest(manifest)
+    assert 'does not exist' in str(e.value)
+
+
+def test_upload_journal(tmpdir):
+    path = os.path.join(str(tmpdir), 'upload.journal')
+    journal = UploadJournal(path)
+    journal.add('a.fq')
+    journal.add(('b_R1.fq', 'b_R2.fq'))
+    assert journal.state('a.fq') == journal.PENDING
+    assert journal.state('c.fq') is None
+
+    journal.set_state('a.fq', journal.UPLOADING)
+    journal.set_state('a.fq', journal.CONFIRMED, sample_id='0123456789abcdef')
+    journal.set_state(('b_R1.fq', 'b_R2.fq'), journal.FAILED, error='Bad file')
+    journal.close()
+
+    # the state persists and re-adding a file doesn't reset it
+    journal = UploadJournal(path)
+    journal.add('a.fq')
+    assert journal.get('a.fq') == {'state': 'confirmed', 'sample_id': '0123456789abcdef',
+                                   'error': None, 'annotated': False}
+    assert journal.get(('b_R1.fq', 'b_R2.fq'))['error'] == 'Bad file'
+    assert journal.counts() == {'confirmed': 1, 'failed': 1}
+    journal.set_annotated('a.fq')
+    assert journal.get('a.fq')['annotated']
+    journal.close()
+
+
+def test_upload_journal_leases(tmpdir):
+    path = os.path.join(str(tmpdir), 'upload.journal')
+    worker1 = UploadJournal(path, owner='worker1', lease=60, max_attempts=2)
+    worker2 = UploadJournal(path, owner='worker2', lease=60, max_attempts=2)
+    worker1.add('a.fq')
+    worker1.add('b.fq')
+
+    assert worker1.claim() == os.path.abspath('a.fq')
+    assert worker2.claim() == os.path.abspath('b.fq')
+    assert worker1.claim() is None
+    assert worker1.outstanding() == 2
+
+    # failures release the lease so the file can be retried, up to max_attempts times
+    worker1.set_state('a.fq', worker1.FAILED, error='Bad file')
+    assert worker1.claim() == os.path.abspath('a.fq')
+    worker1.set_state('a.fq', worker1.FAILED, error='Bad file')
+    assert worker1.claim() is None
+    worker2.set_state('b.fq', worker2.CONFIRMED, sample_id='0123456789abcdef')
+    assert worker1.outstanding() == 0
+
+    worker1.reset_attempts()
+    assert worker1.outstanding() == 1
+    worker1.close()
+    worker2.close()
@@ -0,0 +1,195 @@
+from __future__ import division
+import gzip
+from io import BytesIO
+from math import ceil
+import random
+from threading import Lock
+
+from mock import patch
+import pytest
+
+from onecodex.exceptions import UploadException
+from onecodex.lib.inline_validator import FASTXTranslator
+from onecodex.lib.journal import UploadJournal
+from onecodex.lib.multipart import (MIN_PART_SIZE, S3_MAX_PARTS, ParallelMultipartUpload,
+                                    part_size_for, plan_part_size)
+from onecodex.lib.throttle import BandwidthLimiter
+from onecodex.lib.upload import upload, upload_large_file, upload_stream
+from tests.test_inline_validator import Pipe
+from tests.test_upload import FakeSamplesResource, FakeSession
+
+
+def _fastq(n_reads=2000, seed=42):
+    rand = random.Random(seed)
+    records = []
+    for i in range(n_reads):
+        seq = ''.join(rand.choice('ACGT') for _ in range(100))
+        records.append('@read{}\n{}\n+\n{}\n'.format(i, seq, 'I' * 100))
+    return ''.join(records).encode()
+
+
+class FakeS3Client(object):
+    read_size = 16 * 1024
+
+    def __init__(self, fail_part=None):
+        self.parts = {}
+        self.fail_part = fail_part
+        self.completed = None
+        self.aborted = False
+        self._lock = Lock()
+
+    def create_multipart_upload(self, Bucket, Key, **kwargs):
+        return {'UploadId': 'upload-1'}
+
+    def upload_part(self, Bucket, Key, UploadId, PartNumber, Body):
+        if PartNumber == self.fail_part:
+            raise IOError('Connection reset')
+        if hasattr(Body, 'read'):
+            # (like botocore, which reads it as it's sent)
+            Body = b''.join(iter(lambda: Body.read(self.read_size), b''))
+        with self._lock:
+            self.parts[PartNumber] = Body
+        return {'ETag': 'etag-{}'.format(PartNumber)}
+
+    def complete_multipart_upload(self, Bucket, Key, UploadId, MultipartUpload):
+        self.completed = MultipartUpload['Parts']
+
+    def abort_multipart_upload(self, Bucket, Key, UploadId):
+        self.aborted = True
+
+    @property
+    def data(self):
+        return b''.join(self.parts[n] for n in sorted(self.parts))
+
+
+def test_plan_part_size():
+    assert plan_part_size() == MIN_PART_SIZE
+    assert plan_part_size(10 ** 9) == MIN_PART_SIZE
+    for size in [100 * 10 ** 9, 10 ** 12]:
+        part_size = plan_part_size(size)
+        assert ceil(1.5 * size / part_size) < S3_MAX_PARTS
+
+    # parts grow as they go so that unknown sizes don't run out of parts
+    assert part_size_for(1, MIN_PART_SIZE) == MIN_PART_SIZE
+    assert part_size_for(1000, MIN_PART_SIZE) == MIN_PART_SIZE
+    assert part_size_for(1001, MIN_PART_SIZE) == 2 * MIN_PART_SIZE
+    capacity = sum(part_size_for(n, MIN_PART_SIZE) for n in range(1, S3_MAX_PARTS + 1))
+    assert capacity > 5 * 10 ** 12  # S3's maximum object size
+
+
+@pytest.mark.parametrize('compression_level', [1, 'auto'])
+def test_parallel_multipart_upload(compression_level):
+    data = _fastq()
+    client = FakeS3Client()
+    transfer = ParallelMultipartUpload(client, 'bucket', 'key', threads=3,
+                                       compression_level=compression_level, block_size=20000)
+    transfer.base_part_size = 15000
+    transfer.upload(BytesIO(data))
+
+    # each block is a separate gzip member, which decompress back to the original together
+    assert gzip.GzipFile(fileobj=BytesIO(client.data)).read() == data
+    assert [p['PartNumber'] for p in client.completed] == list(range(1, len(client.parts) + 1))
+    assert len(client.parts) > 1
+    assert all(len(client.parts[n]) >= 15000 for n in list(client.parts)[:-1])
+    assert transfer.bytes_sent == len(client.data)
+    assert sum(transfer.level_sizes.values()) == len(data)
+
+
+def test_parallel_multipart_upload_uncompressed():
+    data = _fastq(200)
+    client = FakeS3Client()
+    transfer = ParallelMultipartUpload(client, 'bucket', 'key', compress=False, block_size=1000)
+    transfer.base_part_size = 3000
+    transfer.upload(BytesIO(data))
+    assert client.data == data
+
+
+def test_parallel_multipart_upload_throttled():
+    data = _fastq(2000)
+    client = FakeS3Client()
+    limiter = BandwidthLimiter(None)
+    transfer = ParallelMultipartUpload(client, 'bucket', 'key', threads=3, compress=False,
+                                       limiter=limiter, block_size=20000)
+    transfer.base_part_size = 60000
+    with patch.object(limiter, 'consume') as consume:
+        transfer.upload(BytesIO(data))
+    assert client.data == data
+    # each part is throttled as it's read to be sent, not all at once before it
+    sizes = [c[0][0] for c in consume.call_args_list]
+    assert sum(sizes) == len(data)
+    assert max(sizes) <= FakeS3Client.read_size
+    assert all(c[1]['key'] is transfer for c in consume.call_args_list)
+
+
+def test_parallel_multipart_upload_failure():
+    client = FakeS3Client(fail_part=2)
+    transfer = ParallelMultipartUpload(client, 'bucket', 'key', compress=False, block_size=1000)
+    transfer.base_part_size = 3000
+    with pytest.raises(IOError):
+        transfer.upload(BytesIO(_fastq(200)))
+    assert client.aborted
+    assert client.completed is None
+
+
+def test_upload_large_file_compressed(tmpdir):
+    path = str(tmpdir.join('reads.fq'))
+    data = _fastq()
+    with open(path, 'wb') as f:
+        f.write(data)
+
+    client = FakeS3Client()
+    file_obj = FASTXTranslator(open(path, 'rb'), recompress=False)
+    with patch('boto3.client', return_value=client):
+        upload_large_file(file_obj, 'reads.fq.gz', FakeSession(), FakeSamplesResource(), '',
+                          threads=2, compress=True, compression_level=3)
+    assert gzip.GzipFile(fileobj=BytesIO(client.data)).read() == data
+
+
+def test_upload_multipart(tmpdir):
+    path = str(tmpdir.join('reads.fq'))
+    data = _fastq()
+    with open(path, 'wb') as f:
+        f.write(data)
+    journal = UploadJournal(str(tmpdir.join('upload.journal')))
+
+    # the server doesn't report the new sample, so the file isn't marked as uploaded
+    client = FakeS3Client()
+    with patch('boto3.client', return_value=client):
+        with pytest.raises(UploadException) as e:
+            upload([path], FakeSession(sample_id=None), FakeSamplesResource(), '',
+                   journal=journal, multipart_threshold=1, compression_level=3)
+    assert "didn't report its sample ID" in str(e.value)
+    assert journal.state(path) == journal.FAILED
+    assert journal.get(path)['sample_id'] is None
+
+    client = FakeS3Client()
+    with patch('boto3.client', return_value=client):
+        sample_ids = upload([path], FakeSession(), FakeSamplesResource(), '', journal=journal,
+                            multipart_threshold=1, compression_level=3)
+    assert sample_ids == ['cd6276c673814123']
+    assert journal.state(path) == journal.CONFIRMED
+    assert journal.get(path)['sample_id'] == 'cd6276c673814123'
+    assert gzip.GzipFile(fileobj=BytesIO(client.data)).read() == data
+    journal.close()
+
+
+@pytest.mark.parametrize('validate', [True, False])
+def test_upload_stream(validate):
+    data = _fastq()
+    client = FakeS3Client()
+    with patch('boto3.client', return_value=client), \
+            patch('onecodex.lib.upload.upload_large_file', wraps=upload_large_file) as ulf:
+        upload_stream(Pipe(data), FakeSession(), FakeSamplesResource(), '', validate=validate,
+                      threads=2, compression_level=3)
+    assert ulf.call_args[0][1] == 'stdin.fq.gz'
+    assert gzip.GzipFile(fileobj=BytesIO(client.data)).read() == data
+
+
+def test_upload_stream_gzipped():
+    data = gzip.compress(_fastq(200))
+    client = FakeS3Client()
+    with patch('boto3.client', return_value=client):
+        upload_stream(Pipe(data), FakeSession(), FakeSamplesResource(), '', filename='reads.fq.gz',
+                      validate=False)
+    # already gzipped, so it's sent as-is
+    assert client.data == data
@@ -0,0 +1,147 @@
+import json
+import marshal
+import os
+import time
+
+from mock import patch
+import responses
+
+from onecodex import Api
+from onecodex.api import ExtendedPotionClient
+from onecodex.lib.schema_cache import SchemaCache, atomic_write, find_refs, resolve_refs
+from tests.conftest import API_DATA, SCHEMA_ROUTES, mock_requests
+
+
+SCHEMA_URL = 'http://localhost:3000/api/v1/schema'
+
+
+def test_snapshots(tmpdir):
+    cache = SchemaCache(str(tmpdir.join('schema')))
+    assert cache.load(SCHEMA_URL) is None
+    schemas = {SCHEMA_URL: {'properties': {}}, '/api/v1/tags/schema#': {'links': []}}
+    cache.save(SCHEMA_URL, schemas, etag='"abc"')
+
+    entry = cache.load(SCHEMA_URL)
+    assert entry['schemas'] == schemas
+    assert entry['etag'] == '"abc"'
+    assert not cache.is_stale(entry)
+    assert cache.load('http://localhost:3001/api/v1/schema') is None
+    assert os.listdir(str(tmpdir.join('schema'))) == [os.path.basename(cache.path(SCHEMA_URL))]
+
+    # unreadable snapshots are just ignored
+    with open(cache.path(SCHEMA_URL), 'wb') as f:
+        f.write(b'\x00not a snapshot')
+    assert cache.load(SCHEMA_URL) is None
+
+    # as are errors writing them
+    cache = SchemaCache(str(tmpdir.join('file')))
+    tmpdir.join('file').write('')
+    assert cache.save(SCHEMA_URL, schemas) is None
+
+
+def test_resolve_refs():
+    schema = {'properties': {'a': {'$ref': '#'}, 'b': [{'$ref': '/b#'}, {'c': 1}]},
+              'links': [{'schema': {'$ref': '/c#'}}]}
+    paths = find_refs(schema)
+    assert sorted(paths) == [['links', 0, 'schema'], ['properties', 'a'], ['properties', 'b', 0]]
+    resolved = resolve_refs(json.loads(json.dumps(schema)), paths, lambda ref: 'ref:' + ref)
+    assert resolved['properties']['a'] is resolved
+    assert resolved['properties']['b'] == ['ref:/b#', {'c': 1}]
+    assert resolved['links'][0]['schema'] == 'ref:/c#'
+
+
+def test_lock(tmpdir):
+    cache = SchemaCache(str(tmpdir))
+    with cache.lock(SCHEMA_URL) as locked:
+        assert locked
+        with cache.lock(SCHEMA_URL) as locked_again:
+            assert not locked_again
+    with cache.lock(SCHEMA_URL) as locked:
+        assert locked
+
+    # locks left behind by processes that died are taken over
+    open(cache.path(SCHEMA_URL) + '.lock', 'w').close()
+    old = time.time() - 600
+    os.utime(cache.path(SCHEMA_URL) + '.lock', (old, old))
+    with cache.lock(SCHEMA_URL) as locked:
+        assert locked
+    assert not os.path.exists(cache.path(SCHEMA_URL) + '.lock')
+
+
+def test_api_schema_cache(mocked_creds_path, tmpdir):
+    # (the schema used to be cached in the credentials file)
+    with open(os.path.expanduser('~/.onecodex'), 'w') as f:
+        json.dump({'api_key': 'abc', 'schema': {}, 'schema_saved_at': '2018-01-01 00:00'}, f)
+
+    cache_dir = str(tmpdir.join('schema'))
+    with mock_requests(SCHEMA_ROUTES):
+        ocx = Api(base_url='http://localhost:3000', cache_schema=cache_dir)
+        assert len(responses.calls) == len(SCHEMA_ROUTES)
+    with open(os.path.expanduser('~/.onecodex')) as f:
+        assert json.load(f) == {'api_key': 'abc'}
+    entry = SchemaCache(cache_dir).load(SCHEMA_URL)
+    assert len(entry['schemas']) == len(SCHEMA_ROUTES)
+
+    api_data = {k: v for k, v in API_DATA.items() if k not in SCHEMA_ROUTES}
+    with mock_requests(api_data):
+        ocx = Api(base_url='http://localhost:3000', cache_schema=cache_dir)
+        sample = ocx.Samples.get('761bc54b97f64980')
+        assert sample.filename == 'SRR2352223.fastq.gz'
+        assert len(responses.calls) == 1
+
+
+def test_revalidation_at_exit(mocked_creds_path, tmpdir):
+    cache_dir = str(tmpdir.join('schema'))
+    with mock_requests(SCHEMA_ROUTES):
+        Api(base_url='http://localhost:3000', cache_schema=cache_dir)
+    cache = SchemaCache(cache_dir)
+    entry = cache.load(SCHEMA_URL)
+    entry['fetched_at'] = 0
+    atomic_write(cache.path(SCHEMA_URL), marshal.dumps(entry))
+
+    # the stale snapshot's revalidated in the background, which an exiting process waits for
+    with mock_requests(SCHEMA_ROUTES), patch('atexit.register') as register:
+        Api(base_url='http://localhost:3000', cache_schema=cache_dir)
+        join, timeout = register.call_args[0]
+        join(timeout)
+    assert not cache.is_stale(cache.load(SCHEMA_URL))
+
+
+def test_revalidation(tmpdir):
+    cache = SchemaCache(str(tmpdir))
+    root = {'properties': {'tags': {'$ref': '/api/v1/tags/schema#'}}}
+    cache.save(SCHEMA_URL, {SCHEMA_URL: root, '/api/v1/tags/schema#': {'links': []}},
+               etag='"v1"')
+
+    client = ExtendedPotionClient('http://localhost:3000', schema_path='/api/v1/schema',
+                                  fetch_schema=False)
+    client._schema_cache = cache
+
+    def make_stale():
+        entry = cache.load(SCHEMA_URL)
+        entry['fetched_at'] = 0
+        atomic_write(cache.path(SCHEMA_URL), marshal.dumps(entry))
+
+    # (it's only revalidated once it's out of date)
+    with responses.RequestsMock():
+        client._revalidate_schema_cache()
+
+    make_stale()
+    with responses.RequestsMock() as rsps:
+        rsps.add(responses.GET, SCHEMA_URL, status=304)
+        client._revalidate_schema_cache()
+        assert rsps.calls[0].request.headers['If-None-Match'] == '"v1"'
+    entry = cache.load(SCHEMA_URL)
+    assert not cache.is_stale(entry)
+    assert entry['schemas']['/api/v1/tags/schema#'] == {'links': []}
+
+    # if it's changed, the schemas in the snapshot are all refetched
+    make_stale()
+    with responses.RequestsMock() as rsps:
+        rsps.add(responses.GET, SCHEMA_URL, json=root, headers={'ETag': '"v2"'})
+        rsps.add(responses.GET, 'http://localhost:3000/api/v1/tags/schema',
+                 json={'links': [], 'properties': {}})
+        client._revalidate_schema_cache()
+    entry = cache.load(SCHEMA_URL)
+    assert entry['etag'] == '"v2"'
+    assert entry['schemas']['/api/v1/tags/schema#'] == {'links': [], 'properties': {}}
@@ -0,0 +1,103 @@
+import random
+
+from mock import patch
+import pytest
+
+from onecodex.exceptions import UploadException
+from onecodex.lib import sketch as sketch_module
+from onecodex.lib.journal import UploadJournal
+from onecodex.lib.sketch import KmerSketch, find_similar, sketch_file
+from onecodex.lib.upload import upload
+
+
+def _genome(length, seed):
+    rand = random.Random(seed)
+    return ''.join(rand.choice('ACGT') for _ in range(length))
+
+
+def _reads_file(path, genome, n_reads=2000, seed=0):
+    rand = random.Random(seed)
+    with open(path, 'w') as f:
+        for i in range(n_reads):
+            start = rand.randint(0, len(genome) - 100)
+            f.write('@read{}\n{}\n+\n{}\n'.format(i, genome[start:start + 100], 'I' * 100))
+    return path
+
+
+def _reverse_complement(seq):
+    complements = {'A': 'T', 'C': 'G', 'G': 'C', 'T': 'A'}
+    return ''.join(complements[base] for base in reversed(seq))
+
+
+@pytest.mark.skipif(sketch_module.np is None, reason='needs numpy to compare with')
+def test_hashes_match_without_numpy():
+    seq = (_genome(5000, seed=1) + 'NNacgtRYacgtacgt' + _genome(5000, seed=2)).encode()
+    threshold = sketch_module.MASK_64 // 10
+    hashes = sketch_module._hash_kmers_numpy(seq, 21, threshold)
+    assert len(hashes) > 500
+    assert hashes == sketch_module._hash_kmers_python(seq, 21, threshold)
+
+
+def test_canonical_kmers():
+    genome = _genome(20000, seed=3)
+    forward, reverse = KmerSketch(scale=10), KmerSketch(scale=10)
+    forward.add_sequence(genome.encode())
+    reverse.add_sequence(_reverse_complement(genome).encode())
+    forward.finish()
+    reverse.finish()
+    assert len(forward) > 1000
+    assert forward.hashes == reverse.hashes
+
+
+def test_similarity(tmpdir):
+    genome = _genome(50000, seed=4)
+    first = sketch_file(_reads_file(str(tmpdir.join('a.fq')), genome, seed=1))
+    resequenced = sketch_file(_reads_file(str(tmpdir.join('b.fq')), genome, seed=2))
+    other = sketch_file(_reads_file(str(tmpdir.join('c.fq')), _genome(50000, seed=5)))
+
+    assert first.containment(resequenced) > 0.9
+    assert first.jaccard(resequenced) > 0.8
+    assert first.containment(other) < 0.05
+
+    # the sketches survive being stored
+    stored = KmerSketch.from_bytes(first.to_bytes())
+    assert stored.hashes == first.hashes and stored.threshold == first.threshold
+
+
+def test_max_hashes():
+    sketch = KmerSketch(scale=1, max_hashes=100)
+    sketch.add_sequence(_genome(10000, seed=6).encode())
+    sketch.finish()
+    assert len(sketch) == 100
+    assert max(sketch.hashes) < sketch.threshold < sketch_module.MASK_64
+
+    # compared below the lower of the thresholds
+    full = KmerSketch(scale=1)
+    full.add_sequence(_genome(10000, seed=6).encode())
+    full.finish()
+    assert sketch.jaccard(full) == 1.
+
+
+def test_upload_sketches(tmpdir):
+    genome = _genome(50000, seed=7)
+    path = _reads_file(str(tmpdir.join('reads.fq')), genome)
+    journal = UploadJournal(str(tmpdir.join('journal')))
+
+    with pytest.raises(UploadException):
+        upload([path], None, None, None, sketch=True)
+
+    def fake_upload(file_obj, *args, **kwargs):
+        file_obj.validate()
+        while file_obj.read(1024 * 1024):
+            pass
+        return 'sample1'
+
+    with patch('onecodex.lib.upload.upload_file', side_effect=fake_upload):
+        upload([path], None, None, None, journal=journal, sketch=True)
+
+    assert [s[:2] for s in journal.sketches()] == [(path, 'sample1')]
+    again = sketch_file(_reads_file(str(tmpdir.join('again.fq')), genome, seed=3))
+    matches = find_similar(again, journal)
+    assert [m[:2] for m in matches] == [(path, 'sample1')]
+    assert matches[0][2] > 0.9
+    journal.close()
@@ -0,0 +1,96 @@
+from __future__ import division
+from io import BytesIO
+import os
+from threading import Thread
+import time
+
+import pytest
+
+from onecodex.exceptions import OneCodexException
+from onecodex.lib.throttle import BandwidthLimiter, ThrottledReader, parse_bandwidth
+
+
+def test_parse_bandwidth():
+    assert parse_bandwidth('500') == 500
+    assert parse_bandwidth('500K') == 500000
+    assert parse_bandwidth('1.5MB/s') == 1500000
+    assert parse_bandwidth('2g') == 2e9
+    assert parse_bandwidth('0') is None
+    with pytest.raises(OneCodexException):
+        parse_bandwidth('fast')
+
+
+def test_limiter_rate():
+    limiter = BandwidthLimiter(200000, quantum=10000)
+    reader = ThrottledReader(BytesIO(b'A' * 150000), limiter)
+    assert len(reader) == 150000
+    start = time.time()
+    while reader.read(10000):
+        pass
+    # the first 50k come out of the initial burst and the remaining 100k take ~0.5s
+    assert 0.4 < time.time() - start < 1.5
+
+
+def test_limiter_fair_sharing():
+    limiter = BandwidthLimiter(400000, quantum=4000)
+    sent = {'big': 0, 'small': 0}
+
+    def send(key, block_size, n_blocks):
+        for _ in range(n_blocks):
+            limiter.consume(block_size)
+            sent[key] += block_size
+
+    # one reader asks for much larger blocks, but both get the same share of the bandwidth
+    threads = [Thread(target=send, args=('big', 40000, 100)),
+               Thread(target=send, args=('small', 4000, 1000))]
+    for thread in threads:
+        thread.daemon = True
+        thread.start()
+    # skip the initial burst, which whichever thread starts first gets
+    time.sleep(0.2)
+    before = dict(sent)
+    time.sleep(0.6)
+    big, small = sent['big'] - before['big'], sent['small'] - before['small']
+    assert 0.6 < small / big < 1.7
+    limiter.set_rate(None)
+    for thread in threads:
+        thread.join(5)
+    assert sent['big'] == sent['small'] == 4000000
+
+
+def test_limiter_control_file(tmpdir):
+    control_file = os.path.join(str(tmpdir), 'bandwidth')
+    with open(control_file, 'w') as f:
+        f.write('10K\n')
+    limiter = BandwidthLimiter(None, control_file=control_file)
+    assert limiter.rate == 10000
+
+    with open(control_file, 'w') as f:
+        f.write('0\n')
+    os.utime(control_file, (time.time() + 10, time.time() + 10))
+    limiter._control_checked_at = 0
+    start = time.time()
+    limiter.consume(1000000)
+    assert limiter.rate is None
+    assert time.time() - start < 0.5
+
+
+def test_limiter_control_file_while_waiting(tmpdir):
+    control_file = os.path.join(str(tmpdir), 'bandwidth')
+    with open(control_file, 'w') as f:
+        f.write('100\n')
+    limiter = BandwidthLimiter(None, control_file=control_file, quantum=1000)
+    limiter.consume(1000)  # (the initial burst)
+
+    # at 100 bytes/s, the next slice would take 10s, but raising the rate cuts that short
+    thread = Thread(target=limiter.consume, args=(1000,))
+    start = time.time()
+    thread.start()
+    time.sleep(0.2)
+    with open(control_file, 'w') as f:
+        f.write('1M\n')
+    os.utime(control_file, (time.time() + 10, time.time() + 10))
+    thread.join(5)
+    assert not thread.is_alive()
+    assert limiter.rate == 1000000
+    assert time.time() - start < 2.5
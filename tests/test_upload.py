@@ -1,12 +1,26 @@
 from collections import OrderedDict
-from io import BytesIO
+import gzip
+from io import BytesIO, StringIO
+import multiprocessing
+import os
+import re
+import sqlite3
 from requests_toolbelt import MultipartEncoder
+from threading import Event
+import time
+import warnings
 
 from mock import patch
 import pytest
 
+from onecodex.exceptions import UploadException, ValidationError, ValidationWarning
 from onecodex.lib.inline_validator import FASTXTranslator
-from onecodex.lib.upload import upload, upload_file, upload_large_file
+from onecodex.lib.estimate import SizeEstimate
+from onecodex.lib.journal import UploadJournal
+from onecodex.lib.spool import DiskSpool
+from onecodex.lib.throttle import format_size
+from onecodex.lib.upload import (_file_stats, group_lanes, pair_files, read_mate, upload,
+                                 upload_async, upload_file, upload_large_file)
 
 
 @pytest.mark.parametrize('file_list,n_small,n_big', [
@@ -32,6 +46,72 @@ def test_upload_lots_of_files(file_list, n_small, n_big):
             assert p2.call_count == sum(2 if isinstance(f, tuple) else 1 for f in file_list)
 
 
+def test_upload_auto_threads():
+    log = StringIO()
+    uf = 'onecodex.lib.upload.upload_file'
+    wf = 'onecodex.lib.upload._wrap_files'
+    opg = 'onecodex.lib.upload.os.path.getsize'
+    with patch(uf) as sm_upload, patch(wf), patch(opg, return_value=1000):
+        upload(['file.1.fa', 'file.2.fa', 'file.3.fa'], None, None, None, threads='auto',
+               log_to=log)
+        assert sm_upload.call_count == 3
+    assert 'Best throughput with 2 concurrent upload(s)' in log.getvalue()
+
+
+def _write_reads(tmpdir):
+    path = str(tmpdir.join('reads.fq'))
+    with open(path, 'w') as f:
+        for ix in range(5000):
+            f.write('@read{}\n{}\n+\n{}\n'.format(ix, 'ACGT' * 25, 'F' * 100))
+    return path
+
+
+def test_upload_progress_bar(tmpdir):
+    log = StringIO()
+    path = _write_reads(tmpdir)
+
+    def read_upload(file_obj, *args):
+        # (like upload_file, which validates the file while finding its length)
+        file_obj.len
+        while len(file_obj.read(1024)) != 0:
+            pass
+        return 'sample-1'
+
+    with patch('onecodex.lib.upload.upload_file', side_effect=read_upload):
+        upload([path], None, None, None, log_to=log)
+    # (the progress is reported by path, but tracked by the name each file's uploaded as)
+    output = log.getvalue()
+    for stage in ['Validating: ', 'Uploading:  ']:
+        progress = [int(p) for p in re.findall(re.escape(stage) + r'\[[#-]+\] (\d+)%', output)]
+        assert len(progress) > 10
+        assert progress == sorted(progress)
+        assert progress[-1] == 100
+
+
+def test_upload_predicted_eta(tmpdir):
+    log = StringIO()
+    path = _write_reads(tmpdir)
+    disk_size = os.path.getsize(path)
+    samples_resource = FakeSamplesResource()
+
+    # slow enough to compress that the early ETAs (before the time taken so far says much) are
+    # well over an hour
+    estimate = SizeEstimate(disk_size, disk_size, disk_size // 10, compress_seconds=4000)
+    with patch('onecodex.lib.upload.estimate_upload', return_value=estimate), \
+            patch.object(samples_resource, 'init_upload',
+                         wraps=samples_resource.init_upload) as init_upload:
+        upload([path], ReadingSession(), samples_resource, '', log_to=log,
+               max_bandwidth=100 * 1000 * 1000)
+    # (the estimated size is sent when the upload's started)
+    assert init_upload.call_args[0][0]['size'] == disk_size // 10
+    output = log.getvalue()
+    assert 'of about {} (about 1h06m at 100.0MB/s)'.format(format_size(disk_size // 10)) in output
+    etas = re.findall(r'\d+% \((\w+) left\)', output)
+    assert re.match(r'1h0[56]m$', etas[0])
+    # later on, it's extrapolated from how long it's taken so far
+    assert etas[-1].endswith('s')
+
+
 class FakeSamplesResource():
     def init_upload(self, obj):
         assert 'filename' in obj
@@ -58,9 +138,14 @@ class FakeSamplesResource():
 
 
 class FakeSession():
+    def __init__(self, sample_id='cd6276c673814123'):
+        # (the ID the multipart upload callback reports)
+        self.sample_id = sample_id
+
     def post(self, url, **kwargs):
         resp = lambda: None  # noqa
         resp.status_code = 201 if 'auth' in kwargs else 200
+        resp.json = lambda: {} if self.sample_id is None else {'sample_id': self.sample_id}
         return resp
 
 
@@ -101,3 +186,244 @@ def test_multipart_encoder():
     MAGIC_HEADER_LEN = 178
     wrapper.seek(0)
     assert len(encoder.read()) - MAGIC_HEADER_LEN == wrapper_len
+
+
+class ReadingSession():
+    """A fake session that actually streams the request body (like `requests` would)
+    """
+    def __init__(self):
+        self.bodies = []
+
+    def post(self, url, data=None, **kwargs):
+        self.bodies.append((data, None))
+        self.bodies[-1] = (data, data.read())
+        resp = lambda: None  # noqa
+        resp.status_code = 201
+        return resp
+
+
+GZIP_CONTENT = b'>test\n' + b'ACGATCGATCGATCGAACGATCGTACGTAGCCGTCGATCGACACGA\n' * 30
+
+
+def test_upload_passthrough(runner):
+    with runner.isolated_filesystem():
+        with gzip.open('myfasta.fa.gz', mode='wb') as f:
+            f.write(GZIP_CONTENT)
+        raw = open('myfasta.fa.gz', 'rb').read()
+
+        session = ReadingSession()
+        upload_file(FASTXTranslator(open('myfasta.fa.gz', 'rb')), 'myfasta.fa.gz', session,
+                    FakeSamplesResource())
+        assert len(session.bodies) == 1
+        body, data = session.bodies[0]
+        assert not isinstance(body, MultipartEncoder)
+        assert raw in data
+        assert len(data) == body._total
+
+
+def test_upload_passthrough_invalid(runner):
+    with runner.isolated_filesystem():
+        with gzip.open('myfasta.fa.gz', mode='wb') as f:
+            f.write(GZIP_CONTENT + b'>bad\nACGTQ\n')
+
+        samples_resource = FakeSamplesResource()
+        with patch.object(samples_resource, 'confirm_upload') as confirm:
+            with pytest.raises(ValidationError):
+                upload_file(FASTXTranslator(open('myfasta.fa.gz', 'rb')), 'myfasta.fa.gz',
+                            ReadingSession(), samples_resource)
+            assert confirm.call_count == 0
+
+
+def test_upload_passthrough_fallback(runner):
+    warnings.filterwarnings('ignore', category=ValidationWarning)
+    with runner.isolated_filesystem():
+        with gzip.open('myfasta.fa.gz', mode='wb') as f:
+            f.write(GZIP_CONTENT + b'>tabbed\theader\nACGT\n')
+
+        session = ReadingSession()
+        upload_file(FASTXTranslator(open('myfasta.fa.gz', 'rb')), 'myfasta.fa.gz', session,
+                    FakeSamplesResource())
+        # the first (passthrough) attempt is abandoned and the file is re-encoded
+        assert len(session.bodies) == 2
+        assert isinstance(session.bodies[1][0], MultipartEncoder)
+        uploaded = session.bodies[1][1].split(b'\r\n\r\n', 1)[1].rsplit(b'\r\n--', 1)[0]
+        assert b'tabbed|header' in gzip.GzipFile(fileobj=BytesIO(uploaded)).read()
+
+
+def test_upload_journal_resume(tmpdir):
+    journal = UploadJournal(str(tmpdir.join('upload.journal')))
+    files = ['file.1.fa', 'file.2.fa', 'file.3.fa']
+
+    def flaky_upload(file_obj, filename, *args):
+        if filename == 'file.2.fa.gz':
+            raise UploadException('Connection lost')
+        return 'sample-' + filename.split('.')[1]
+
+    uf = 'onecodex.lib.upload.upload_file'
+    wf = 'onecodex.lib.upload._wrap_files'
+    opg = 'onecodex.lib.upload.os.path.getsize'
+    with patch(uf, side_effect=flaky_upload) as sm_upload, patch(wf), \
+            patch(opg, return_value=1000):
+        # one failure doesn't stop the rest of the batch
+        with pytest.raises(UploadException) as e:
+            upload(files, None, None, None, threads=2, journal=journal)
+        assert '1 of 3 file(s) failed' in str(e.value)
+        assert sm_upload.call_count == 3
+        assert journal.get('file.1.fa')['sample_id'] == 'sample-1'
+        assert journal.state('file.2.fa') == journal.FAILED
+        assert journal.state('file.3.fa') == journal.CONFIRMED
+
+    # re-running only uploads the failed file
+    with patch(uf, return_value='sample-2') as sm_upload, patch(wf), \
+            patch(opg, return_value=1000):
+        sample_ids = upload(files, None, None, None, journal=journal)
+        assert sm_upload.call_count == 1
+        assert sample_ids == ['sample-1', 'sample-2', 'sample-3']
+    journal.close()
+
+
+def test_upload_failure_releases_spool(tmpdir):
+    path = _write_reads(tmpdir)
+    journal = UploadJournal(str(tmpdir.join('upload.journal')))
+    spool = DiskSpool(str(tmpdir), max_size=None)
+    file_objs = []
+
+    def failed_upload(file_obj, *args):
+        # (fails part way through sending the spooled output)
+        file_objs.append(file_obj)
+        file_obj.len
+        file_obj.read(1024)
+        assert spool.used > 0
+        raise UploadException('Connection lost')
+
+    with patch('onecodex.lib.upload.upload_file', side_effect=failed_upload):
+        with pytest.raises(UploadException):
+            upload([path], None, None, None, journal=journal, spool=spool)
+    assert journal.state(path) == journal.FAILED
+    assert spool.used == 0
+    assert file_objs[0].reads.file_obj.closed
+    journal.close()
+
+
+def _distributed_upload(journal_path, files, log_path):
+    def logged_upload(file_obj, filename, *args):
+        with open(log_path, 'a') as log:
+            log.write(filename + '\n')
+        time.sleep(0.02)
+        return 'sample-' + filename.split('.')[1]
+
+    uf = 'onecodex.lib.upload.upload_file'
+    wf = 'onecodex.lib.upload._wrap_files'
+    opg = 'onecodex.lib.upload.os.path.getsize'
+    with patch(uf, side_effect=logged_upload), patch(wf), patch(opg, return_value=1000):
+        journal = UploadJournal(journal_path, lease=0.5)
+        upload(files, None, None, None, threads=2, journal=journal, distributed=True)
+        journal.close()
+
+
+def test_upload_journal_error(tmpdir):
+    journal = UploadJournal(str(tmpdir.join('upload.journal')))
+    uf = 'onecodex.lib.upload.upload_file'
+    wf = 'onecodex.lib.upload._wrap_files'
+    opg = 'onecodex.lib.upload.os.path.getsize'
+    with patch(uf) as sm_upload, patch(wf), patch(opg, return_value=1000), \
+            patch.object(journal, 'claim', side_effect=sqlite3.OperationalError('locked')):
+        # (the journal's error is raised, rather than one about the file it couldn't claim)
+        with pytest.raises(sqlite3.OperationalError):
+            upload(['file.1.fa', 'file.2.fa'], None, None, None, journal=journal,
+                   distributed=True)
+        assert sm_upload.call_count == 0
+    journal.close()
+
+
+def test_upload_distributed(tmpdir):
+    journal_path = str(tmpdir.join('upload.journal'))
+    log_path = str(tmpdir.join('uploaded.log'))
+    files = ['file.{}.fa'.format(i) for i in range(24)]
+
+    processes = [multiprocessing.Process(target=_distributed_upload,
+                                         args=(journal_path, files, log_path))
+                 for _ in range(3)]
+    for process in processes:
+        process.start()
+    for process in processes:
+        process.join(30)
+        assert process.exitcode == 0
+
+    # every file was uploaded by exactly one of the processes
+    with open(log_path) as log:
+        uploaded = log.read().split()
+    assert sorted(uploaded) == sorted(f + '.gz' for f in files)
+    journal = UploadJournal(journal_path)
+    assert journal.counts() == {'confirmed': 24}
+    journal.close()
+
+
+def test_upload_distributed_expired_lease(tmpdir):
+    journal_path = str(tmpdir.join('upload.journal'))
+    log_path = str(tmpdir.join('uploaded.log'))
+    files = ['file.1.fa', 'file.2.fa']
+
+    # a process claims the first file and then dies
+    crashed = UploadJournal(journal_path, owner='crashed:1', lease=0.5)
+    for f in files:
+        crashed.add(f)
+    assert crashed.claim() == os.path.abspath('file.1.fa')
+    crashed.close()
+
+    # so its lease expires and it's uploaded by another process
+    _distributed_upload(journal_path, files, log_path)
+    with open(log_path) as log:
+        assert sorted(log.read().split()) == ['file.1.fa.gz', 'file.2.fa.gz']
+    journal = UploadJournal(journal_path)
+    assert journal.get('file.1.fa')['sample_id'] == 'sample-1'
+    journal.close()
+
+
+def test_pair_files(tmpdir):
+    for name in ['a_R1_001.fq', 'a_R2_001.fq', 'b_R1_001.fq', 'b_R2_001.fq', 'c.fq']:
+        tmpdir.join(name).write('')
+    a1, a2, b1, b2, c = [str(tmpdir.join(name)) for name in
+                         ['a_R1_001.fq', 'a_R2_001.fq', 'b_R1_001.fq', 'b_R2_001.fq', 'c.fq']]
+    assert read_mate(a1) == a2
+    assert read_mate(a2) == a1
+    assert read_mate(c) is None
+
+    assert pair_files([a1, a2, b1, c]) == ([(a1, a2)], [b1, c])
+    # R2s can be inferred
+    assert pair_files([a1, a2, b1, c], include_unlisted=True) == ([(a1, a2), (b1, b2)], [c])
+
+
+def test_group_lanes():
+    files = ['a_L002_R1_001.fq', 'a_L001_R1_001.fq', 'b_L001_R1_001.fq', 'c.fq',
+             ('d_L001_R1.fq', 'd_L001_R2.fq'), ('d_L002_R1.fq', 'd_L002_R2.fq')]
+    lanes, others = group_lanes(files)
+    assert lanes == [['a_L001_R1_001.fq', 'a_L002_R1_001.fq'],
+                     [('d_L001_R1.fq', 'd_L001_R2.fq'), ('d_L002_R1.fq', 'd_L002_R2.fq')]]
+    assert others == ['b_L001_R1_001.fq', 'c.fq']
+
+    with patch('onecodex.lib.upload.os.path.getsize', return_value=100):
+        assert _file_stats(lanes[1]) == ('d_fq.gz', 400)
+
+
+def test_upload_async():
+    release = Event()
+
+    def fake_upload(files, *args, **kwargs):
+        assert release.wait(5)
+        if files[0] == 'bad.fq':
+            raise UploadException('bad file')
+        return ['sample-' + files[0]]
+
+    with patch('onecodex.lib.upload.upload', side_effect=fake_upload):
+        futures = upload_async(['a.fq', 'bad.fq', 'c.fq'], None, None, None, threads=1)
+        # only the first file has started, so the others can still be cancelled
+        assert futures[2].cancel()
+        done = []
+        futures[0].add_done_callback(lambda f: done.append(f.result()))
+        release.set()
+        assert futures[0].result(timeout=5) == 'sample-a.fq'
+        with pytest.raises(UploadException):
+            futures[1].result(timeout=5)
+    assert done == ['sample-a.fq']
+    assert futures[2].cancelled()
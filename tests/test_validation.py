@@ -0,0 +1,41 @@
+from onecodex.lib.validation import validate_file, validate_files
+
+
+def test_validate_file():
+    report = validate_file('tests/data/files/test.fq')
+    assert report['file'] == 'tests/data/files/test.fq'
+    assert report['records'] == 10
+    assert report['bytes'] == 1210
+    assert report['error'] is None
+    assert report['warnings'] == []
+
+    report = validate_file(('tests/data/files/test.fq', 'tests/data/files/test.fq'),
+                           checks={'min_length': ('warn', 500)})
+    assert report['file'] == ['tests/data/files/test.fq', 'tests/data/files/test.fq']
+    assert report['records'] == 20
+    assert report['check_counts'] == {'min_length': 20}
+    assert len(report['warnings']) == 1
+    assert report['error'] is None
+
+
+def test_validate_errors(tmpdir):
+    tabs = tmpdir.join('tabs.fa')
+    tabs.write('>Test\tfasta\n' + 'ACGT' * 50 + '\n')
+    report = validate_file(str(tabs))
+    assert 'tabs in headers' in report['error']
+    assert report['fixable']
+    report = validate_file(str(tabs), clean=True)
+    assert report['error'] is None
+    assert report['modified']
+    assert report['warnings'] == ['{} can not have tabs in headers; autoreplacing'.format(tabs)]
+
+    bad = tmpdir.join('bad.fa')
+    bad.write('>Test fasta\n' + 'ACGT' * 50 + 'XX\n')
+    report = validate_file(str(bad), clean=True)
+    assert 'non-nucleic acid characters' in report['error']
+    assert not report['fixable']
+
+    # (the reports come back in order, whichever finishes first)
+    reports = list(validate_files([str(bad), 'tests/data/files/test.fa', str(tabs)], processes=2))
+    assert [r['file'] for r in reports] == [str(bad), 'tests/data/files/test.fa', str(tabs)]
+    assert [r['error'] is None for r in reports] == [False, True, False]
@@ -0,0 +1,78 @@
+import os
+from threading import Thread
+import time
+
+from mock import patch
+
+from onecodex.lib.watch import DirectoryWatcher, is_fastx, watch
+
+
+def test_is_fastx():
+    assert is_fastx('reads.fq')
+    assert is_fastx('reads_R1_001.fastq.gz')
+    assert is_fastx('contigs.fna.bz2')
+    assert not is_fastx('SampleSheet.csv')
+    assert not is_fastx('reads.fq.tmp')
+
+
+def test_watcher_settles(tmpdir):
+    watcher = DirectoryWatcher(str(tmpdir), settle=0.2, use_inotify=False)
+    reads = tmpdir.join('reads.fq')
+    reads.write('@read\nACGT\n+\nIIII\n')
+    tmpdir.join('notes.txt').write('not reads')
+    assert watcher.poll() == []
+    assert watcher.pending
+
+    # still being written
+    time.sleep(0.15)
+    reads.write('@read\nACGT\n+\nIIII\n' * 2)
+    time.sleep(0.15)
+    assert watcher.poll() == []
+
+    time.sleep(0.25)
+    assert watcher.poll() == [str(reads)]
+    assert not watcher.pending
+    # each file is only reported once
+    time.sleep(0.25)
+    assert watcher.poll() == []
+
+
+def test_watcher_pairs(tmpdir):
+    watcher = DirectoryWatcher(str(tmpdir), settle=0, use_inotify=False)
+    r1, r2 = tmpdir.join('s_R1_001.fq'), tmpdir.join('s_R2_001.fq')
+    r1.write('@read\nACGT\n+\nIIII\n')
+    # the R1 waits for its R2
+    assert watcher.poll() == []
+    r2.write('@read\nACGT\n+\nIIII\n')
+    assert watcher.poll() == [(str(r1), str(r2))]
+
+    # and unpaired files are let go when we're done
+    lonely = tmpdir.join('t_R2_001.fq')
+    lonely.write('@read\nACGT\n+\nIIII\n')
+    assert watcher.poll() == []
+    assert watcher.flush() == [str(lonely)]
+
+    watcher = DirectoryWatcher(str(tmpdir), settle=0, interleave=False, use_inotify=False)
+    assert watcher.poll() == sorted([str(r1), str(r2), str(lonely)])
+
+
+def test_watch(tmpdir):
+    def write_run():
+        for i in range(3):
+            time.sleep(0.1)
+            tmpdir.join('s{}_R1_001.fq'.format(i)).write('@read\nACGT\n+\nIIII\n')
+            tmpdir.join('s{}_R2_001.fq'.format(i)).write('@read\nACGT\n+\nIIII\n')
+
+    def fake_upload(files, *args, **kwargs):
+        return ['sample-' + os.path.basename(files[0][0])[1]]
+
+    writer = Thread(target=write_run)
+    writer.start()
+    with patch('onecodex.lib.watch.upload', side_effect=fake_upload) as p:
+        sample_ids = watch(str(tmpdir), None, None, None, settle=0.1, poll_interval=0.05,
+                           idle_timeout=0.5)
+    writer.join()
+
+    assert p.call_count == 3
+    assert sorted(sample_ids.values()) == ['sample-0', 'sample-1', 'sample-2']
+    assert (str(tmpdir.join('s1_R1_001.fq')), str(tmpdir.join('s1_R2_001.fq'))) in sample_ids